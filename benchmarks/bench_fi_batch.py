@@ -0,0 +1,101 @@
+"""
+Benchmark: cálculo de saldos de renda fixa por contrato (compute_contract_update) vs. motor em lote
+(compute_contract_updates_batch), conferindo que os resultados são idênticos bit a bit.
+
+Uso: python benchmarks/bench_fi_batch.py [quantidades_de_contratos...]   (padrão: 1000 10000 100000)
+
+Não faz chamadas de rede: as séries do BCB são sintéticas, no mesmo formato da API, e os contratos não têm saques.
+A janela de cada contrato vai da última taxa aplicada (até 60 dias atrás, como em runs diários atrasados) até hoje.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from notion_finance import Engine, EngineConfig  # noqa: E402
+from notion_finance import core as up  # noqa: E402
+
+TODAY = date(2026, 6, 30)
+
+
+def fake_bcb_series(serie_id: int, start_date: date, end_date: date, timeout: int = 20) -> list:
+    """Série sintética determinística: dias úteis para SELIC/CDI (% a.a.), dia 1 de cada mês para o IPCA (% a.m.)."""
+    data = []
+    day = start_date
+    while day <= end_date:
+        if serie_id == up.IPCA_SERIES_ID:
+            if day.day == 1:
+                data.append({"data": day.strftime("%d/%m/%Y"), "valor": f"{0.3 + (day.month % 5) * 0.07:.2f}"})
+        elif day.weekday() < 5 and day not in up.br_holidays():
+            value = 10.4 + (day.toordinal() % 97) / 100 + (0.1 if serie_id == up.BCB_DAILY_SERIES_MAP["CDI"] else 0)
+            data.append({"data": day.strftime("%d/%m/%Y"), "valor": f"{value:.2f}"})
+        day += timedelta(days=1)
+    return data
+
+
+def make_contracts(count: int) -> list:
+    rng = random.Random(42)
+    contracts = []
+    for i in range(count):
+        indexer = rng.choice(["CDI", "CDI", "SELIC", "IPCA"])
+        contribution_date = TODAY - timedelta(days=rng.randint(90, 1500))
+        last_rate_date = TODAY - timedelta(days=rng.randint(1, 60))
+        contracts.append(up.FixedIncomeContract(
+            id=f"contract-{i}",
+            asset_id=f"asset-{i % 40}",
+            contribution_id=f"contribution-{i}",
+            contribution_date=contribution_date,
+            indexer=indexer,
+            indexer_pct=rng.choice([1.0, 1.1, 1.2]) if indexer != "IPCA" else 1.0,
+            fixed_rate=0.0 if indexer != "IPCA" else rng.choice([0.05, 0.06]),
+            due_date=TODAY + timedelta(days=rng.randint(-30, 1500)),
+            principal=1000.0,
+            balance=round(rng.uniform(1000, 100000), 2),
+            last_update=last_rate_date,
+            last_rate_date=last_rate_date,
+            closed=False,
+            unique_id=i,
+        ))
+    return contracts
+
+
+def main() -> None:
+    if up.np is None:
+        print("Este benchmark requer o pacote numpy (pip install numpy).")
+        return
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    up._fetch_bcb_series_data = fake_bcb_series
+    up.log_and_print = lambda message, level="info": None
+    up.prefetch_bcb_data_for_contracts(make_contracts(1_000), TODAY)
+
+    for count in counts:
+        contracts = make_contracts(count)
+        started = time.perf_counter()
+        scalar = {contract.id: up.compute_contract_update(contract, TODAY, []) for contract in contracts}
+        scalar_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch = up.compute_contract_updates_batch(contracts, TODAY, {})
+        batch_elapsed = time.perf_counter() - started
+
+        mismatches = sum(
+            1 for contract_id, expected in scalar.items()
+            if (expected is None) != (batch[contract_id] is None)
+            or (expected is not None and (
+                expected.balance != batch[contract_id].balance
+                or expected.last_rate_date != batch[contract_id].last_rate_date
+                or expected.acc_ipca != batch[contract_id].acc_ipca
+            ))
+        )
+        print(
+            f"{count:>7} contratos  por contrato={scalar_elapsed:7.2f}s ({count / scalar_elapsed:9,.0f}/s)  "
+            f"lote={batch_elapsed:7.2f}s ({count / batch_elapsed:9,.0f}/s)  divergências={mismatches}"
+        )
+
+
+if __name__ == "__main__":
+    with Engine(EngineConfig()).activate():
+        main()
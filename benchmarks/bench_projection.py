@@ -0,0 +1,110 @@
+"""
+Benchmark: projeção Monte Carlo vetorizada (numpy) vs. laço Python dia a dia (mesma convenção de compound_balance_period).
+
+Uso: python benchmarks/bench_projection.py [quantidade_de_contratos] [quantidade_de_cenários]
+
+Não faz chamadas de rede: os modelos de taxa são fixos e os contratos sintéticos. O laço Python é medido
+em uma amostra de contratos × cenários e extrapolado para o tamanho total.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from notion_finance import Engine, EngineConfig  # noqa: E402
+from notion_finance import core as up  # noqa: E402
+
+START = date(2026, 1, 2)
+MODELS = {
+    "SELIC": up.Ar1Model(start=0.1490, mean=0.1100, phi=0.95, sigma=0.004),
+    "CDI": up.Ar1Model(start=0.1480, mean=0.1090, phi=0.95, sigma=0.004),
+    "IPCA": up.Ar1Model(start=0.0040, mean=0.0038, phi=0.60, sigma=0.002),
+}
+
+
+def make_contracts(count: int) -> list:
+    rng = random.Random(42)
+    contracts = []
+    for i in range(count):
+        indexer = rng.choice(["CDI", "SELIC", "IPCA"])
+        due_date = START + timedelta(days=rng.randint(30, 3650)) if rng.random() < 0.9 else None
+        contracts.append(up.FixedIncomeContract(
+            id=f"contract-{i}",
+            asset_id=f"asset-{i % 200}",
+            contribution_id=f"contribution-{i}",
+            contribution_date=START - timedelta(days=rng.randint(0, 1500)),
+            indexer=indexer,
+            indexer_pct=rng.choice([0.9, 1.0, 1.05, 1.1, 1.2]) if indexer != "IPCA" else 1.0,
+            fixed_rate=rng.choice([0.0, 0.01, 0.02]) if indexer != "IPCA" else rng.choice([0.045, 0.055, 0.065]),
+            due_date=due_date,
+            principal=1000.0,
+            balance=rng.uniform(1000, 100000),
+            last_update=START,
+            last_rate_date=START,
+            closed=False,
+            unique_id=i,
+        ))
+    return contracts
+
+
+def python_loop(contracts: list, scenarios: "up.RateScenarios", scenario_indices: range) -> float:
+    """Compõe dia a dia, como compound_balance_period, com as taxas do cenário em vez das do BCB."""
+    first_month = START.year * 12 + START.month - 1
+    total = 0.0
+    for s in scenario_indices:
+        for contract in contracts:
+            end = min(contract.due_date or scenarios.horizon, scenarios.horizon)
+            balance = contract.balance
+            path = scenarios.paths[contract.indexer][s]
+            day = START
+            if contract.indexer == "IPCA":
+                accumulated = 1.0
+                for month in range(1, (end.year * 12 + end.month - 1) - first_month + 1):
+                    accumulated *= 1 + path[month]
+                balance *= accumulated * (1 + contract.fixed_rate) ** (up.get_net_workdays(START, end) / up.BUSY_DAYS_IN_YEAR)
+            else:
+                while day < end:
+                    day += timedelta(days=1)
+                    if day.weekday() < 5 and day not in up.br_holidays():
+                        annual_rate = path[day.year * 12 + day.month - 1 - first_month]
+                        balance *= (1 + annual_rate * contract.indexer_pct + contract.fixed_rate) ** (1 / up.BUSY_DAYS_IN_YEAR)
+            total += balance
+    return total
+
+
+def main() -> None:
+    if up.np is None:
+        print("Este benchmark requer o pacote numpy (pip install numpy).")
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_scenarios = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    print(f"{count} contratos × {n_scenarios} cenários, horizonte de {up.current_config().projection_max_years} anos")
+    contracts = make_contracts(count)
+
+    started = time.perf_counter()
+    scenarios = up.generate_rate_scenarios(MODELS, START, up.current_config().projection_max_years * 12 + 1, n_scenarios, seed=7)
+    generated = time.perf_counter()
+    result = up.project_fixed_income_contracts(contracts, scenarios, [5, 25, 50, 75, 95])
+    projected = time.perf_counter()
+    print(
+        f"numpy      cenários={generated - started:7.3f}s projeção={projected - generated:7.3f}s "
+        f"ativos={len(result.asset_ids)} p50 total=R${result.total_band[2]:,.2f}"
+    )
+
+    sample_contracts, sample_scenarios = contracts[:100], range(2)
+    started = time.perf_counter()
+    python_loop(sample_contracts, scenarios, sample_scenarios)
+    elapsed = time.perf_counter() - started
+    factor = (count / len(sample_contracts)) * (n_scenarios / len(sample_scenarios))
+    print(
+        f"laço python amostra {len(sample_contracts)}×{len(sample_scenarios)}={elapsed:7.3f}s "
+        f"estimativa total={elapsed * factor / 60:7.1f} min"
+    )
+
+
+if __name__ == "__main__":
+    with Engine(EngineConfig()).activate():
+        main()
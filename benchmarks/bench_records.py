@@ -0,0 +1,189 @@
+"""
+Benchmark: páginas brutas do Notion + dateutil (caminho antigo) vs. registros tipados com __slots__.
+
+Uso: python benchmarks/bench_records.py [quantidade_de_contratos]
+
+Não faz chamadas de rede: as páginas são sintéticas, com o mesmo formato retornado pela API
+(incluindo fórmulas que o script não lê). Indexador, percentual e vencimento vêm do ativo e o principal do aporte,
+pelas relações do contrato: os dois caminhos fazem esse join (JSON bruto x fi_assets_by_id/fi_contributions_by_id).
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dateutil import parser  # noqa: E402
+from notion_finance import Engine, EngineConfig  # noqa: E402
+from notion_finance import core as up  # noqa: E402
+
+
+def _date_prop(value):
+    return {"id": "d", "type": "date", "date": {"start": value.isoformat(), "end": None, "time_zone": None}}
+
+
+ASSETS = 40
+
+
+def _relation(page_id: str) -> dict:
+    return {"id": "r", "type": "relation", "relation": [{"id": page_id}], "has_more": False}
+
+
+def make_asset_page(j: int) -> dict:
+    rng = random.Random(j)
+    return {
+        "object": "page",
+        "id": f"asset-{j}",
+        "last_edited_time": "2024-01-01T00:00:00.000Z",
+        "properties": {
+            "Name": {"id": "title", "type": "title", "title": [{"type": "text", "plain_text": f"CDB {j}", "text": {"content": f"CDB {j}"}}]},
+            up.FIX_INDEXER: {"id": "i", "type": "select", "select": {"id": "s", "name": rng.choice(["CDI", "SELIC", "IPCA"]), "color": "blue"}},
+            up.FIX_INDEXER_PCT: {"id": "p", "type": "number", "number": 1.1},
+            up.FIX_DUE_DATE: _date_prop(date(2030, 1, 1) + timedelta(days=rng.randint(0, 3650))),
+        },
+    }
+
+
+def make_contract_pages(i: int, rng: random.Random) -> tuple:
+    """Página do contrato e do aporte que o originou."""
+    contribution_date = date(2019, 1, 1) + timedelta(days=rng.randint(0, 2000))
+    last_rate = contribution_date + timedelta(days=rng.randint(0, 300))
+    contract_id = f"{i:08d}-0000-0000-0000-000000000000"
+    contribution = {
+        "object": "page",
+        "id": f"contribution-{i}",
+        "last_edited_time": "2024-01-01T00:00:00.000Z",
+        "properties": {
+            up.FIC_ASSET: _relation(f"asset-{i % ASSETS}"),
+            up.FIC_CONTRACT: _relation(contract_id),
+            up.FIC_AMOUNT: {"id": "m", "type": "number", "number": 1000.0 + i},
+            up.FIC_DATE: _date_prop(contribution_date),
+            up.FIC_ADDITIONAL_FIXED_RATE: {"id": "f", "type": "number", "number": 0.05},
+        },
+    }
+    contract = {
+        "object": "page",
+        "id": contract_id,
+        "created_time": "2024-01-01T00:00:00.000Z",
+        "last_edited_time": "2024-01-01T00:00:00.000Z",
+        "properties": {
+            "Name": {"id": "title", "type": "title", "title": [{"type": "text", "plain_text": f"Contract {i}", "text": {"content": f"Contract {i}"}}]},
+            up.FI_ASSET: _relation(f"asset-{i % ASSETS}"),
+            up.FIC_CONTRIBUTION_REL: _relation(f"contribution-{i}"),
+            up.FI_CONTRIBUTION_DATE: _date_prop(contribution_date),
+            up.FI_ADDITIONAL_FIXED_RATE: {"id": "f", "type": "number", "number": 0.05},
+            up.FI_BALANCE: {"id": "b", "type": "number", "number": 1234.56},
+            up.FI_LAST_UPDATE: _date_prop(last_rate),
+            up.FI_LAST_RATE_DATE: _date_prop(last_rate),
+            up.FI_CLOSED: {"id": "x", "type": "checkbox", "checkbox": False},
+            up.FI_CONTRACT_UNIQUE_ID: {"id": "n", "type": "unique_id", "unique_id": {"prefix": "FI", "number": i}},
+            up.FI_VARIATION: {"id": "v", "type": "formula", "formula": {"type": "number", "number": 0.2345}},
+        },
+        "url": f"https://www.notion.so/{i}",
+    }
+    return contract, contribution
+
+
+def _related(props: dict, name: str, pages_by_id: dict) -> dict:
+    return pages_by_id[props[name]["relation"][0]["id"]]["properties"]
+
+
+def legacy_pass(data: tuple) -> float:
+    """Reproduz o acesso antigo: JSON bruto percorrido e datas reparseadas com dateutil em cada etapa."""
+    pages, assets, contributions = data
+    total = 0.0
+    for page in pages:  # prefetch_bcb_data_for_contracts
+        props = page["properties"]
+        asset = _related(props, up.FI_ASSET, assets)
+        parser.parse(props[up.FI_CONTRIBUTION_DATE]["date"]["start"]).date()
+        parser.parse(asset[up.FIX_DUE_DATE]["date"]["start"]).date()
+        asset[up.FIX_INDEXER]["select"]["name"]
+    for page in pages:  # update_fixed_income_contracts
+        props = page["properties"]
+        asset = _related(props, up.FI_ASSET, assets)
+        contribution = _related(props, up.FIC_CONTRIBUTION_REL, contributions)
+        parser.parse(props[up.FI_CONTRIBUTION_DATE]["date"]["start"]).date()
+        parser.parse(asset[up.FIX_DUE_DATE]["date"]["start"]).date()
+        asset[up.FIX_INDEXER]["select"]["name"], asset[up.FIX_INDEXER_PCT]["number"]
+        parser.parse(props[up.FI_LAST_UPDATE]["date"]["start"]).date()
+        parser.parse(props[up.FI_LAST_RATE_DATE]["date"]["start"]).date()
+        parser.parse(contribution[up.FIC_DATE]["date"]["start"]).date()  # timeline/alocações
+        total += (props[up.FI_BALANCE]["number"] or 0) + contribution[up.FIC_AMOUNT]["number"]
+    return total
+
+
+def records_pass(data: tuple) -> float:
+    contracts = data[0]
+    total = 0.0
+    for contract in contracts:
+        contract.contribution_date, contract.due_date, contract.indexer
+    for contract in contracts:
+        contract.contribution_date, contract.due_date, contract.indexer, contract.indexer_pct
+        contract.last_update, contract.last_rate_date
+        total += contract.balance + (contract.principal or 0)
+    return total
+
+
+def measure(label: str, build, run) -> float:
+    gc.collect()
+    started = time.perf_counter()
+    data = build()
+    parsed_at = time.perf_counter()
+    total = run(data)
+    finished = time.perf_counter()
+    del data
+
+    # Memória medida em uma segunda execução: o tracemalloc distorce os tempos.
+    gc.collect()
+    tracemalloc.start()
+    data = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    print(
+        f"{label:<10} carga={parsed_at - started:7.3f}s processamento={finished - parsed_at:7.3f}s "
+        f"memória retida={retained / 1e6:7.1f} MB pico={peak / 1e6:7.1f} MB"
+    )
+    return total
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    print(f"{count} contratos sintéticos")
+
+    def build_raw():
+        rng = random.Random(42)
+        assets = {page["id"]: page for page in map(make_asset_page, range(ASSETS))}
+        contracts, contributions = zip(*(make_contract_pages(i, rng) for i in range(count)))
+        return list(contracts), assets, {page["id"]: page for page in contributions}
+
+    def build_records():
+        # Mesmo fluxo de load_fixed_income_reference_data + get_all_pages_from_notion(record_parser=...):
+        # cada página é convertida e descartada; os contratos resolvem os termos pelos mapas da carteira.
+        rng = random.Random(42)
+        portfolio = up.current_portfolio()
+        portfolio.fi_assets_by_id = {
+            asset.id: asset for asset in (up.parse_fixed_income_asset(make_asset_page(j)) for j in range(ASSETS))
+        }
+        portfolio.fi_contributions_by_id = {}
+        contracts = []
+        for i in range(count):
+            contract_page, contribution_page = make_contract_pages(i, rng)
+            contribution = up.parse_fixed_income_contribution(contribution_page)
+            portfolio.fi_contributions_by_id[contribution.id] = contribution
+            contracts.append(up.parse_fixed_income_contract(contract_page))
+        return contracts, portfolio.fi_assets_by_id, portfolio.fi_contributions_by_id
+
+    legacy_total = measure("json bruto", build_raw, legacy_pass)
+    records_total = measure("registros", build_records, records_pass)
+    # Os dois caminhos leem os mesmos valores (inclusive o principal, pelo aporte)
+    assert round(legacy_total, 2) == round(records_total, 2), (legacy_total, records_total)
+
+
+if __name__ == "__main__":
+    with Engine(EngineConfig()).activate():
+        main()
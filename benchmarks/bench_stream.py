@@ -0,0 +1,165 @@
+"""
+Benchmark: streaming com escritas coalescidas vs. polling periódico (modo daemon) em um pregão simulado.
+
+Uso: python benchmarks/bench_stream.py [tickers] [trades_por_segundo] [horas_de_pregão]
+
+Não faz chamadas de rede: os trades vêm de um passeio aleatório entregue direto ao CoalescingQuoteWriter
+com relógio simulado, e as escritas no Notion são apenas contadas. Em seguida, uma execução curta de ponta a ponta
+roda Engine.run_stream com FakeQuoteFeed contra um Notion simulado em memória (thread do feed -> on_trade -> flush,
+releitura dos tickers com novo ativo assinado) e encerra com Engine.shutdown().
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from notion_finance import Engine, EngineConfig  # noqa: E402
+from notion_finance import core as up  # noqa: E402
+
+
+class StubNotionSession:
+    """Database de renda variável em memória: esquema, consulta (sem paginação) e PATCH de preço."""
+
+    def __init__(self, database_id: str, prices: dict):
+        self.database_id = database_id
+        self.prices = dict(prices)
+        self.queries = 0
+        self.patches = []
+        self._lock = threading.Lock()
+
+    def add_asset(self, ticker: str, price: float) -> None:
+        with self._lock:
+            self.prices[ticker] = price
+
+    def _response(self, data: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(data).encode()
+        return response
+
+    def request(self, method: str, url: str, json: dict = None, **kwargs) -> requests.Response:
+        with self._lock:
+            if method == "GET":
+                names = [up.VI_TICKER, up.VI_UNIT_PRICE, up.VI_UPDATE_DATE]
+                return self._response({"properties": {name: {"id": f"p{i}"} for i, name in enumerate(names)}})
+            if method == "POST":
+                self.queries += 1
+                pages = [
+                    {
+                        "id": f"page-{ticker}",
+                        "last_edited_time": "2024-01-01T00:00:00.000Z",
+                        "properties": {
+                            up.VI_TICKER: {"type": "title", "title": [{"plain_text": ticker}]},
+                            up.VI_UNIT_PRICE: {"type": "number", "number": price},
+                        },
+                    }
+                    for ticker, price in self.prices.items()
+                ]
+                return self._response({"results": pages, "has_more": False, "next_cursor": None})
+            self.patches.append(url.rsplit("/", 1)[-1])
+            return self._response({"id": url.rsplit("/", 1)[-1]})
+
+
+def end_to_end(tickers: int) -> None:
+    """Engine.run_stream com FakeQuoteFeed e Notion simulado; STREAM_TARGETS_REFRESH_MINUTES=0 relê a cada tick."""
+    rng = random.Random(7)
+    names = [f"TCK{i:03d}3" for i in range(tickers)]
+    prices = {name: round(rng.uniform(10, 100), 2) for name in names}
+    session = StubNotionSession("vi-assets", prices)
+    feed = up.FakeQuoteFeed()
+    with tempfile.TemporaryDirectory() as workdir:
+        config = EngineConfig(
+            notion_token="stub", vi_assets_database_id=session.database_id, notion_requests_per_second=10_000,
+            stream_flush_seconds=0.2, stream_targets_refresh_minutes=0, echo=False,
+            **{
+                field: os.path.join(workdir, getattr(EngineConfig, field))
+                for field in ("api_quota_file", "run_stats_file", "query_snapshot_file", "summary_state_file")
+            },
+        )
+        engine = Engine(config, http=session)
+        stream = threading.Thread(target=engine.run_stream, kwargs={"feed": feed, "portfolio": ""})
+        started = time.perf_counter()
+        stream.start()
+        while set(names) - feed.subscribed:
+            time.sleep(0.01)
+        for name in names:
+            feed.push(name, round(prices[name] * 1.01, 2))
+        session.add_asset("NEW0003", 50.0)
+        while "NEW0003" not in feed.subscribed:
+            time.sleep(0.01)
+        feed.push("NEW0003", 55.0)
+        while "page-NEW0003" not in session.patches and time.perf_counter() - started < 10:
+            time.sleep(0.01)
+        engine.shutdown()
+        stream.join()
+    print(
+        f"ponta a ponta  {tickers + 1} trades pelo FakeQuoteFeed, escritas no Notion={len(session.patches)}, "
+        f"releituras dos tickers={session.queries - 1}, novo ativo gravado={'page-NEW0003' in session.patches}, "
+        f"{time.perf_counter() - started:.2f}s até o shutdown()"
+    )
+
+
+def main() -> None:
+    tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    trades_per_second = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    hours = float(sys.argv[3]) if len(sys.argv) > 3 else 7.0
+    session_seconds = int(hours * 3600)
+    print(f"{tickers} tickers, {trades_per_second} trades/s, pregão de {hours:g}h")
+
+    rng = random.Random(42)
+    names = [f"TCK{i:03d}3" for i in range(tickers)]
+    prices = {name: rng.uniform(10, 100) for name in names}
+    targets = {
+        name: [{"portfolio": "", "page_id": f"page-{name}", "currency": None, "convert_to_brl": False, "unit_price": prices[name]}]
+        for name in names
+    }
+
+    writes = []
+    write_price = up.update_variable_income_asset_price_in_notion
+    up.update_variable_income_asset_price_in_notion = lambda page_id, price, brl_price=None: writes.append(page_id)
+    clock = [0.0]
+    writer = up.CoalescingQuoteWriter(targets, clock=lambda: clock[0])
+
+    trade_time = 0.0
+    started = time.perf_counter()
+    for second in range(session_seconds):
+        for _ in range(trades_per_second):
+            name = names[rng.randrange(tickers)]
+            prices[name] *= 1 + rng.gauss(0, 0.0002)
+            writer.on_trade(name, round(prices[name], 2))
+        trade_time += time.perf_counter() - started
+        clock[0] = float(second + 1)
+        if (second + 1) % up.STREAM_TICK_SECONDS == 0:
+            writer.flush()
+        started = time.perf_counter()
+    writer.flush(force=True)
+    up.update_variable_income_asset_price_in_notion = write_price
+
+    total_trades = trades_per_second * session_seconds
+    polls = session_seconds // (up.current_config().daemon_vi_interval_minutes * 60)
+    print(
+        f"streaming  trades={total_trades:,} ({total_trades / trade_time:,.0f} trades/s no writer) "
+        f"escritas no Notion={len(writes):,} chamadas a provedores=0 (1 conexão)"
+    )
+    print(
+        f"polling    a cada {up.current_config().daemon_vi_interval_minutes} min: chamadas a provedores={polls * tickers:,} "
+        f"escritas no Notion={polls * tickers:,}"
+    )
+    fast_polls = int(session_seconds // up.current_config().stream_flush_seconds)
+    print(
+        f"polling    a cada {up.current_config().stream_flush_seconds:.0f}s (mesma defasagem do streaming): "
+        f"chamadas a provedores={fast_polls * tickers:,} escritas no Notion={fast_polls * tickers:,}"
+    )
+
+
+if __name__ == "__main__":
+    with Engine(EngineConfig()).activate():
+        main()
+    end_to_end(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
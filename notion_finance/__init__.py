@@ -0,0 +1,16 @@
+"""
+notion_finance: atualização de preços e saldos de investimentos no Notion.
+
+    from notion_finance import Engine, EngineConfig
+
+    engine = Engine(EngineConfig.from_env())
+    engine.update_variable_income()
+    engine.run()
+
+Importar o pacote não lê o ambiente, não configura o log e não toca em arquivos; o script update_prices.py é a
+linha de comando sobre o Engine.
+"""
+from .config import ConfigError, EngineConfig
+from .engine import Engine
+
+__all__ = ["ConfigError", "Engine", "EngineConfig"]
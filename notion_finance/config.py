@@ -0,0 +1,195 @@
+"""
+Configuração explícita do Engine.
+EngineConfig.from_env() lê as mesmas variáveis de ambiente do script (ver .env.example); serviços que embutem o
+Engine podem montar o EngineConfig diretamente. Nada aqui lê arquivos ou o ambiente na importação.
+"""
+import os
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Mapping, Optional
+
+
+class ConfigError(ValueError):
+    """Configuração incompleta ou inválida (ex.: variável obrigatória ausente)."""
+
+
+# Limites padrão do plano gratuito de cada provedor de cotação, por janela
+DEFAULT_PROVIDER_LIMITS: Dict[str, Dict[str, int]] = {
+    "eod": {"per_day": 20},
+    "brapi": {"per_month": 15000},
+    "twelve_data": {"per_minute": 8, "per_day": 800},
+    "alpha_vantage": {"per_minute": 5, "per_day": 25},
+    "finnhub": {"per_minute": 60},
+    "yahoo": {"per_month": 500},
+}
+# Prefixo das variáveis <PREFIXO>_MINUTE_LIMIT/_DAILY_LIMIT/_MONTHLY_LIMIT de cada provedor
+PROVIDER_LIMIT_ENV_PREFIXES = {
+    "eod": "EOD_HISTORICAL_DATA",
+    "brapi": "BRAPI",
+    "twelve_data": "TWELVE_DATA",
+    "alpha_vantage": "ALPHA_VANTAGE",
+    "finnhub": "FINNHUB",
+    "yahoo": "YAHOO_FINANCE",
+}
+
+# Chaves das APIs de cotação e databases da carteira do .env: obrigatórias no modo de carteira única
+_REQUIRED_API_KEYS = [
+    "twelve_data_api_key", "yahoo_finance_api_key", "brapi_token",
+    "eod_historical_data_api_token", "alpha_vantage_api_key", "finnhub_api_key",
+]
+_REQUIRED_PORTFOLIO = [
+    "notion_token", "vi_assets_database_id", "vi_foreign_assets_database_id", "fi_contracts_database_id",
+    "fi_contributions_database_id", "fi_assets_database_id", "fi_withdrawals_database_id", "fi_allocations_database_id",
+]
+
+
+def _csv(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@dataclass
+class EngineConfig:
+    """Parâmetros do Engine. Cada campo corresponde à variável de ambiente de mesmo nome em maiúsculas."""
+    # Carteira do .env (ignorada com portfolios_file) e chaves das APIs de cotação (várias chaves separadas por vírgula)
+    notion_token: Optional[str] = None
+    vi_assets_database_id: Optional[str] = None
+    vi_foreign_assets_database_id: Optional[str] = None
+    fi_contracts_database_id: Optional[str] = None
+    fi_contributions_database_id: Optional[str] = None
+    fi_assets_database_id: Optional[str] = None
+    fi_withdrawals_database_id: Optional[str] = None
+    fi_allocations_database_id: Optional[str] = None
+    summary_database_id: Optional[str] = None  # Opcional: database de resumo da carteira (agregados)
+    twelve_data_api_key: Optional[str] = None
+    yahoo_finance_api_key: Optional[str] = None
+    brapi_token: Optional[str] = None
+    eod_historical_data_api_token: Optional[str] = None
+    alpha_vantage_api_key: Optional[str] = None
+    finnhub_api_key: Optional[str] = None
+    # Limites de cota por provedor: {"per_minute"|"per_day"|"per_month": chamadas} (0 = sem limite)
+    provider_limits: Dict[str, Dict[str, int]] = field(default_factory=lambda: {
+        provider: dict(limits) for provider, limits in DEFAULT_PROVIDER_LIMITS.items()
+    })
+
+    # Modo residente (daemon)
+    quote_cache_ttl_seconds: int = 300
+    daemon_vi_interval_minutes: int = 15
+    daemon_fi_run_after: str = "10:00"  # Horário de Brasília, após a publicação diária do BCB
+
+    # Câmbio: moedas buscadas em lote uma vez por run para converter ativos no exterior em BRL
+    fx_currencies: List[str] = field(default_factory=lambda: ["USD", "EUR"])
+    fx_default_currency: str = "USD"
+    fx_cache_ttl_seconds: int = 3600
+
+    # Arquivos de estado (journal, cota, histórico, medições, resumo, caches e snapshots)
+    api_quota_file: str = "api_quota.json"
+    run_journal_file: str = "run_journal.jsonl"
+    fi_history_file: str = "fi_history.bin"
+    fi_history_rewrite_days: int = 7  # Dias finais recalculados a cada run (taxas publicadas com atraso)
+    run_stats_file: str = "run_stats.json"
+    summary_state_file: str = "portfolio_summary.json"
+    query_snapshot_file: str = "query_snapshot.json"
+
+    # Modo --time-budget: margem de segurança antes do prazo e fração do orçamento reservada à renda fixa
+    time_budget_safety_seconds: float = 15
+    time_budget_fi_share: float = 0.25
+
+    # API local de consulta: 0 = desligada junto do updater (daemon/stream); --serve usa a porta padrão
+    query_api_port: int = 0
+    query_api_host: str = "127.0.0.1"
+
+    # Motor de renda fixa em lote (requer numpy)
+    fi_batch_engine: bool = False
+
+    # Busca das séries do BCB em blocos anuais, concorrentes, com novas tentativas em caso de falha
+    bcb_fetch_workers: int = 4
+    bcb_fetch_retries: int = 3
+    bcb_retry_backoff_seconds: float = 1
+
+    # Saques processados em paralelo entre ativos; o limite do token do Notion vale para todos
+    withdrawal_workers: int = 4
+
+    # Execução offline (--export / --compute / --apply)
+    offline_snapshot_file: str = "offline_snapshot.json"
+    patch_bundle_file: str = "patch_bundle.jsonl"
+    apply_workers: int = 8
+
+    # Várias carteiras (tenants) em um só processo: arquivo JSON com a lista de carteiras
+    portfolios_file: Optional[str] = None
+    portfolio_workers: int = 4
+    # Limite de requisições ao Notion por token (o Notion aceita em média 3 req/s por integração)
+    notion_requests_per_second: float = 3
+
+    # Fila de jobs local (modos --coordinator/--worker)
+    job_queue_file: str = "job_queue.sqlite3"
+    job_lease_seconds: float = 300
+    job_max_attempts: int = 5
+    job_poll_seconds: float = 2
+    job_worker_idle_exit_seconds: float = 0  # 0 = worker aguarda jobs indefinidamente
+
+    # Streaming de cotações (--stream)
+    stream_flush_seconds: float = 60
+    stream_min_change: float = 0.001
+    stream_targets_refresh_minutes: int = 15
+
+    # Projeção Monte Carlo dos saldos de renda fixa (--projection; requer numpy)
+    projection_file: str = "fi_projection.json"
+    projection_scenarios: int = 1000
+    projection_max_years: int = 10
+    projection_calibration_years: int = 5
+    projection_percentiles: List[float] = field(default_factory=lambda: [5.0, 25.0, 50.0, 75.0, 95.0])
+    projection_seed: Optional[int] = None
+
+    # Relatório de bytes economizados pela projeção de propriedades (opcional: amostra cada database sem projeção)
+    notion_payload_report: bool = False
+
+    # Mensagens também no stdout (além do logger "notion_finance")
+    echo: bool = True
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "EngineConfig":
+        """Configuração a partir das variáveis de ambiente (padrão: os.environ); ausentes ficam com o valor padrão."""
+        environ = os.environ if environ is None else environ
+        parsers = {
+            "fx_currencies": lambda raw: [currency.upper() for currency in _csv(raw)],
+            "fx_default_currency": str.upper,
+            "projection_percentiles": lambda raw: [float(q) for q in raw.split(",")],
+            "projection_seed": lambda raw: int(raw) if raw.strip() else None,
+        }
+        by_type = {int: int, float: float, bool: lambda raw: raw == "1"}
+        values: dict = {}
+        for config_field in fields(cls):
+            raw = environ.get(config_field.name.upper())
+            if raw is None or config_field.name in ("provider_limits", "echo"):
+                continue
+            parse = parsers.get(config_field.name) or by_type.get(config_field.type, str)
+            values[config_field.name] = parse(raw)
+
+        provider_limits = {provider: dict(limits) for provider, limits in DEFAULT_PROVIDER_LIMITS.items()}
+        for provider, env_prefix in PROVIDER_LIMIT_ENV_PREFIXES.items():
+            for limit_name, suffix in (("per_minute", "MINUTE_LIMIT"), ("per_day", "DAILY_LIMIT"), ("per_month", "MONTHLY_LIMIT")):
+                value = environ.get(f"{env_prefix}_{suffix}")
+                if value is not None and value.strip():
+                    provider_limits[provider][limit_name] = int(value)
+        return cls(provider_limits=provider_limits, **values)
+
+    def api_keys(self, provider: str) -> List[str]:
+        """Chaves configuradas para o provedor de cotação (o campo aceita várias, separadas por vírgula)."""
+        value = {
+            "eod": self.eod_historical_data_api_token,
+            "brapi": self.brapi_token,
+            "twelve_data": self.twelve_data_api_key,
+            "alpha_vantage": self.alpha_vantage_api_key,
+            "finnhub": self.finnhub_api_key,
+            "yahoo": self.yahoo_finance_api_key,
+        }[provider]
+        return _csv(value or "")
+
+    def validate(self) -> None:
+        """
+        Exige as chaves das APIs de cotação e, sem portfolios_file, o token e os databases da carteira do .env.
+        Levanta ConfigError com os nomes das variáveis ausentes.
+        """
+        required = _REQUIRED_API_KEYS + ([] if self.portfolios_file else _REQUIRED_PORTFOLIO)
+        missing = [name.upper() for name in required if not getattr(self, name)]
+        if missing:
+            raise ConfigError(f"Variáveis de ambiente não definidas: {', '.join(missing)}.")
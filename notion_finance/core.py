@@ -0,0 +1,5866 @@
+"""
+Núcleo do notion_finance: estágios da atualização (renda variável, aportes, saques, contratos), modos residentes
+e auxiliares. Configuração, sessão HTTP, caches e carteiras pertencem ao Engine ativo no contexto (ver engine.py);
+importar este módulo não lê o ambiente, não configura o log nem toca em arquivos.
+"""
+import requests
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, date, timedelta, time as dtime
+from dateutil import parser
+import os
+import holidays
+from typing import Optional, Tuple, Dict, List, Callable, Iterator, Any, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+import re
+import functools
+import hashlib
+import itertools
+import json
+import signal
+import socket
+import sqlite3
+import queue
+import struct
+import sys
+import zlib
+from array import array
+import uuid
+import threading
+import contextvars
+import time
+from zoneinfo import ZoneInfo
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+try:
+    import numpy as np
+except ImportError:  # opcional: usado pela projeção Monte Carlo (--projection) e pelo motor em lote (FI_BATCH_ENGINE)
+    np = None
+try:
+    import websocket
+except ImportError:  # opcional: usado apenas pelo streaming de cotações do Finnhub (--stream)
+    websocket = None
+
+from .config import EngineConfig
+if TYPE_CHECKING:
+    from .engine import Engine
+
+# CONFIGURAÇÕES ----------------------
+# Parâmetros ajustáveis ficam no EngineConfig (config.py) e são lidos com current_config(); aqui, só constantes.
+DAEMON_TICK_SECONDS = 30
+PROVIDER_NAMES = {
+    "eod": "EOD Historical Data",
+    "brapi": "BRAPI",
+    "twelve_data": "Twelve Data",
+    "alpha_vantage": "Alpha Vantage",
+    "finnhub": "Finnhub",
+    "yahoo": "Yahoo Finance",
+}
+QUERY_API_DEFAULT_PORT = 8765 # Porta do --serve quando QUERY_API_PORT não está definida
+NOTION_MAX_RETRIES = 3
+STREAM_TICK_SECONDS = 1
+PAYLOAD_SAMPLE_PAGE_SIZE = 10
+QUOTA_SAVE_SECONDS = 30 # Gravação periódica do API_QUOTA_FILE (além do fim do run e de cada ciclo do daemon)
+# -------------------------------------
+
+# Propriedades dos ativos de renda variável
+VI_TICKER = 'Ticker'
+VI_TYPE = 'Type'
+VI_UNIT_PRICE = 'Unit Price'
+VI_UPDATE_DATE = 'Last Update'
+VI_CURRENCY = 'Currency' # Select opcional (ativos no exterior); padrão FX_DEFAULT_CURRENCY
+VI_BRL_PRICE = 'Unit Price (BRL)' # Preço convertido para reais (ativos no exterior), se a propriedade existir
+VI_QUANTITY = 'Quantity' # Opcional: tamanho da posição, usado para priorizar no modo --time-budget
+
+# Propriedades dos contratos de renda fixa
+FI_TYPE = "Type" # Tipo de investimento (Tesouro Direto, Renda Fixa, etc)
+FI_INDEXER = "Indexer" # Indexador (SELIC, IPCA, CDI)
+FI_INDEXER_PCT = "Indexer %" # Percentual do indexador (ex: 100% do CDI)
+FI_ADDITIONAL_FIXED_RATE = "Additional Fixed Rate" # Taxa fixa adicional (para IPCA+ ou pré-fixado)
+FI_BALANCE = "Balance" # Saldo atual com juros compostos
+FI_PRINCIPAL_AMOUNT = "Principal Amount" # Valor aportado
+FI_VARIATION = "Variation" # Percentual de variação do saldo
+FI_LAST_UPDATE = "Last Update" # Data da última atualização
+FI_CONTRIBUTION_DATE = "Contribution Date" # Data da compra
+FI_DUE_DATE = "Due Date" # Data de vencimento
+FI_INFLATION = "Inflation" # Inflação (IPCA)
+FI_CLOSED = "Closed" # Fechado
+FI_CONTRACT_UNIQUE_ID = "ID" # Propriedade unique id on contracts (tie-breaker)
+FI_LAST_RATE_DATE = "Last Rate Date" # Data da última taxa diária utilizada no cálculo dos juros compostos
+FI_ASSET = "Asset" # Relation → Fixed Income Assets
+FI_PRICING_FINGERPRINT = "Pricing Fingerprint" # Texto (opcional): hash das entradas de preço usadas no último cálculo
+
+# Propriedades dos ativos de renda fixa (origem dos rollups Indexer, Indexer % e Due Date dos contratos)
+FIX_INDEXER = "Indexer"       # Select
+FIX_INDEXER_PCT = "Indexer %" # Number
+FIX_DUE_DATE = "Due Date"     # Date
+
+# Propriedades dos aportes de renda fixa
+FIC_ASSET = "Asset"                     # Relation → Fixed Income Assets
+FIC_CONTRACT = "Contract"               # Relation → Fixed Income Contracts
+FIC_AMOUNT = "Amount"                   # Number
+FIC_DATE = "Date"                       # Date
+FIC_ADDITIONAL_FIXED_RATE = "Additional Fixed Rate"  # Number
+FIC_CONTRIBUTION_REL = "Contribution"  # Relation
+
+# Propriedades da tabela de saques de renda fixa
+FIW_ASSET = "Asset"
+FIW_AMOUNT = "Amount"
+FIW_DATE = "Date"  # Data em que o saque ocorreu (para timeline de juros)
+FIW_PROCESSED = "Processed"
+FIW_PROCESSING_DATE = "Processing Date"
+FIW_ALLOCATIONS_REL = "Allocations"
+FIW_PROCESSED_AMOUNT = "Processed Amount"
+
+# Propriedades de Allocation table
+FIA_WITHDRAWAL_REL = "Withdrawal"
+FIA_CONTRACT_REL = "Contract"
+FIA_AMOUNT = "Amount"
+FIA_OPERATION_DATE = "Date"
+
+# Propriedades do database de resumo da carteira (uma linha por agregado)
+SUM_NAME = "Name"                # Title: chave da linha (total, type:<tipo>, indexer:<indexador>, asset:<page id>)
+SUM_SCOPE = "Scope"              # Select: total, type, indexer, asset
+SUM_BALANCE = "Balance"          # Number: saldo em BRL
+SUM_PRINCIPAL = "Principal"      # Number: valor aportado (renda fixa)
+SUM_VARIATION = "Variation"      # Number: saldo / principal - 1
+SUM_REAL_RETURN = "Real Return"  # Number: retorno descontada a inflação acumulada (IPCA)
+SUM_POSITIONS = "Positions"      # Number: contratos e ativos agregados
+SUM_UPDATED_AT = "Updated At"    # Date
+
+BUSY_DAYS_IN_YEAR = 252
+
+@functools.lru_cache(maxsize=None)
+def br_holidays() -> holidays.HolidayBase:
+    """Feriados nacionais, montados no primeiro uso e compartilhados entre Engines (não dependem da configuração)."""
+    return holidays.country_holidays('BR')
+
+@functools.lru_cache(maxsize=None)
+def market_sessions() -> Dict[str, tuple]:
+    """Pregão regular: (fuso, abertura, fechamento, calendário de feriados da bolsa)."""
+    return {
+        "B3": (ZoneInfo("America/Sao_Paulo"), dtime(10, 0), dtime(17, 0), holidays.financial_holidays('BVMF')),
+        "NYSE": (ZoneInfo("America/New_York"), dtime(9, 30), dtime(16, 0), holidays.financial_holidays('NYSE')),
+    }
+
+BRT = ZoneInfo("America/Sao_Paulo")
+
+BCB_DAILY_SERIES_MAP = {
+    "SELIC": 1178,
+    "CDI": 4389,
+}
+IPCA_SERIES_ID = 433
+
+# Engine (configuração, sessão HTTP, caches e carteiras) em uso no contexto atual (ver Engine.activate)
+_current_engine: contextvars.ContextVar["Engine"] = contextvars.ContextVar("engine")
+# Carteira (tenant) em processamento no contexto atual; sem valor, a carteira configurada no .env
+_current_portfolio: contextvars.ContextVar["Portfolio"] = contextvars.ContextVar("portfolio")
+# Journal do job da fila em execução (modo worker); sem valor, o journal do run da carteira
+_current_job_journal: contextvars.ContextVar[Optional["JobJournal"]] = contextvars.ContextVar("job_journal")
+# Provedores chamados na cotação em andamento (ver RunStats); sem valor, as chamadas não são registradas
+_quote_trace: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("quote_trace")
+# Identity map da cadeia de renda fixa em andamento (ver RunRepository); sem valor, cada estágio consulta o Notion
+_current_repository: contextvars.ContextVar[Optional["RunRepository"]] = contextvars.ContextVar("run_repository")
+
+logger = logging.getLogger("notion_finance")
+# Sem handler próprio: quem embute o Engine decide o destino do log (o script grava em update_prices.log)
+logger.addHandler(logging.NullHandler())
+
+def current_engine() -> "Engine":
+    engine = _current_engine.get(None)
+    if engine is None:
+        raise RuntimeError("Nenhum Engine ativo neste contexto: use os métodos do Engine ou Engine.activate().")
+    return engine
+
+def current_config() -> EngineConfig:
+    return current_engine().config
+
+def log_and_print(message: str, level='info'):
+    portfolio = _current_portfolio.get(None)
+    if portfolio is not None and portfolio.name:
+        message = f"[{portfolio.name}] {message}"
+    engine = _current_engine.get(None)
+    if engine is None or engine.config.echo:
+        print(message)
+    if level == 'info':
+        logger.info(message)
+    elif level == 'error':
+        logger.error(message)
+    elif level == 'warning':
+        logger.warning(message)
+        
+# ------------------ FUNÇÕES GERAIS -------------------------
+
+def get_net_workdays(start_date: date, end_date: date) -> int:
+    """Conta dias úteis entre duas datas excluindo feriados e fins de semana"""
+    # Se usar numpy: return np.busday_count(start_date, end_date)
+    # Implementação simples com loop (para volumes pequenos de dados é ok):
+    calendar = br_holidays()
+    days = 0
+    current_date = start_date
+    while current_date < end_date:
+        current_date += timedelta(days=1)
+        if current_date.weekday() < 5 and current_date not in calendar:
+            days += 1
+    return days
+
+class NotionRateLimiter:
+    """Espaça as requisições de um token do Notion para no máximo `requests_per_second` em média."""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """Adia as próximas requisições do token (resposta 429 com Retry-After)."""
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+def notion_rate_limiter(token: Optional[str]) -> NotionRateLimiter:
+    """Limitador compartilhado por todas as carteiras do Engine que usam o mesmo token."""
+    engine = current_engine()
+    with engine.notion_rate_limiters_lock:
+        limiter = engine.notion_rate_limiters.get(token or "")
+        if limiter is None:
+            limiter = engine.notion_rate_limiters[token or ""] = NotionRateLimiter(engine.config.notion_requests_per_second)
+        return limiter
+
+def notion_request(method: str, url: str, **kwargs) -> requests.Response:
+    """Requisição à API do Notion com o token da carteira atual, respeitando o limite do token e o Retry-After de 429."""
+    engine = current_engine()
+    portfolio = current_portfolio()
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        portfolio.rate_limiter.wait()
+        started = time.monotonic()
+        response = engine.notion_http.request(method, url, headers=portfolio.notion_headers, **kwargs)
+        engine.run_stats.record_latency("notion", time.monotonic() - started)
+        if response.status_code != 429 or attempt == NOTION_MAX_RETRIES:
+            return response
+        retry_after = float(response.headers.get("Retry-After") or 1)
+        log_and_print(f"Limite de requisições do Notion atingido. Aguardando {retry_after:.0f}s.", level='warning')
+        portfolio.rate_limiter.pause(retry_after)
+    return response
+
+def get_database_property_ids(database_id: str) -> Dict[str, str]:
+    """Mapa nome -> id das propriedades do database (GET databases/{id}), em cache no Engine."""
+    engine = current_engine()
+    with engine.notion_schema_lock:
+        cached = engine.notion_property_ids.get(database_id)
+    if cached is not None:
+        return cached
+    try:
+        response = notion_request("GET", f"https://api.notion.com/v1/databases/{database_id}", timeout=20)
+        response.raise_for_status()
+        property_ids = {name: prop["id"] for name, prop in response.json().get("properties", {}).items()}
+    except Exception as e:
+        log_and_print(f"Erro ao buscar esquema do database {database_id}: {e}. Consultas sem projeção.", level='warning')
+        property_ids = {}
+    with engine.notion_schema_lock:
+        engine.notion_property_ids[database_id] = property_ids
+    return property_ids
+
+def _projection_query_string(database_id: str, properties: Optional[List[str]]) -> str:
+    """
+    Monta `?filter_properties=...` para que o Notion devolva apenas as propriedades informadas.
+    Os ids do esquema já vêm codificados para URL, por isso são concatenados sem nova codificação.
+    Propriedades opcionais que não existem no database são ignoradas (também não viriam no payload completo).
+    Sem esquema disponível, não projeta: antes o payload completo que um campo faltando.
+    """
+    if not properties:
+        return ""
+    property_ids = get_database_property_ids(database_id)
+    present = [name for name in properties if name in property_ids]
+    if not present:
+        return ""
+    return "?" + "&".join(f"filter_properties={property_ids[name]}" for name in present)
+
+def _record_notion_payload(database_id: str, page_count: int, byte_count: int, projected: bool) -> None:
+    with current_engine().notion_schema_lock:
+        stats = current_portfolio().payload_stats.setdefault(database_id, {"pages": 0, "bytes": 0, "projected_pages": 0})
+        stats["pages"] += page_count
+        stats["bytes"] += byte_count
+        if projected:
+            stats["projected_pages"] += page_count
+
+def get_notion_page(page_id: str, database_id: Optional[str] = None, properties: Optional[List[str]] = None) -> dict:
+    """GET pages/{id}, projetando as propriedades informadas (ids resolvidos pelo esquema de database_id)."""
+    query_string = _projection_query_string(database_id, properties) if database_id else ""
+    response = notion_request("GET", f"https://api.notion.com/v1/pages/{page_id}{query_string}", timeout=20)
+    response.raise_for_status()
+    if database_id:
+        _record_notion_payload(database_id, 1, len(response.content), bool(query_string))
+    return response.json()
+
+def _sample_bytes_per_page(database_id: str, query_string: str) -> Optional[float]:
+    response = notion_request(
+        "POST", f"https://api.notion.com/v1/databases/{database_id}/query{query_string}",
+        json={"page_size": PAYLOAD_SAMPLE_PAGE_SIZE}, timeout=30,
+    )
+    response.raise_for_status()
+    results = response.json().get("results", [])
+    return len(response.content) / len(results) if results else None
+
+def report_notion_payload_savings() -> None:
+    """
+    Registra, por database, os bytes recebidos do Notion no run e a economia estimada pela projeção.
+    A estimativa usa uma amostra de PAYLOAD_SAMPLE_PAGE_SIZE páginas consultada com e sem projeção, uma vez por
+    database e projeção enquanto a carteira existir (runs seguintes do mesmo Engine reaproveitam a amostra).
+    """
+    if not current_config().notion_payload_report:
+        return
+    total_saved = 0.0
+    portfolio = current_portfolio()
+    for database_id, stats in portfolio.payload_stats.items():
+        saved = 0.0
+        query_string = _projection_query_string(database_id, portfolio.projected_properties.get(database_id))
+        if stats["projected_pages"] and query_string:
+            try:
+                sample_key = (database_id, query_string)
+                if sample_key not in portfolio.payload_samples:
+                    portfolio.payload_samples[sample_key] = (
+                        _sample_bytes_per_page(database_id, ""), _sample_bytes_per_page(database_id, query_string)
+                    )
+                full_per_page, projected_per_page = portfolio.payload_samples[sample_key]
+                if full_per_page and projected_per_page:
+                    saved = max(0.0, (full_per_page - projected_per_page) * stats["projected_pages"])
+            except Exception as e:
+                log_and_print(f"Erro ao amostrar payload do database {database_id}: {e}", level='warning')
+        total_saved += saved
+        received = stats["bytes"]
+        pct = saved / (saved + received) * 100 if saved + received else 0.0
+        log_and_print(
+            f"Payload Notion {database_id}: {stats['pages']} páginas, {received / 1024:.1f} KB recebidos, "
+            f"~{saved / 1024:.1f} KB economizados pela projeção ({pct:.0f}%)."
+        )
+    if portfolio.payload_stats:
+        log_and_print(f"Payload Notion: ~{total_saved / 1024:.1f} KB economizados no total.")
+
+def iter_page_batches_from_notion(
+    DATABASE_ID: Optional[str],
+    filter_payload: Optional[dict] = None,
+    sorts: Optional[list] = None,
+    record_parser: Optional[Callable[[dict], Any]] = None,
+    properties: Optional[List[str]] = None,
+) -> Iterator[list]:
+    """
+    Versão em streaming da consulta paginada: produz um lote (até 100 registros) assim que cada página da API chega.
+    A requisição do próximo cursor é disparada em segundo plano antes de o lote atual ser entregue,
+    de modo que o processamento de um lote se sobrepõe ao download do seguinte. Erros de rede são propagados.
+    record_parser: converte cada página em um registro tipado assim que o lote chega, descartando o JSON bruto.
+    properties: nomes das propriedades que o chamador lê; as demais (rollups, fórmulas...) não são trafegadas.
+    """
+    if not DATABASE_ID:
+        return
+    query_string = _projection_query_string(DATABASE_ID, properties)
+    if query_string:
+        current_portfolio().projected_properties[DATABASE_ID] = properties
+    url = f"https://api.notion.com/v1/databases/{DATABASE_ID}/query{query_string}"
+
+    def fetch(start_cursor: Optional[str]) -> dict:
+        payload: dict = {"page_size": 100}
+        if filter_payload:
+            payload["filter"] = filter_payload
+        if sorts:
+            payload["sorts"] = sorts
+        if start_cursor:
+            payload["start_cursor"] = start_cursor
+        response = notion_request("POST", url, json=payload, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        _record_notion_payload(DATABASE_ID, len(data.get("results", [])), len(response.content), bool(query_string))
+        return data
+
+    # O worker roda no contexto da carteira atual (token e estatísticas de payload)
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending: Optional[Future] = executor.submit(context.run, fetch, None)
+        while pending is not None:
+            data = pending.result()
+            next_cursor = data.get("next_cursor") if data.get("has_more", False) else None
+            pending = executor.submit(context.run, fetch, next_cursor) if next_cursor else None
+
+            pages = data.get("results", [])
+            if record_parser is None:
+                yield pages
+                continue
+            batch = []
+            for page in pages:
+                try:
+                    batch.append(record_parser(page))
+                except Exception as parse_error:
+                    log_and_print(f"Erro ao interpretar página {page.get('id')} do Notion: {parse_error}", level='error')
+            yield batch
+
+def iter_pages_from_notion(
+    DATABASE_ID: Optional[str],
+    filter_payload: Optional[dict] = None,
+    sorts: Optional[list] = None,
+    record_parser: Optional[Callable[[dict], Any]] = None,
+    properties: Optional[List[str]] = None,
+) -> Iterator[Any]:
+    """Como iter_page_batches_from_notion, mas produz um registro por vez."""
+    for batch in iter_page_batches_from_notion(DATABASE_ID, filter_payload, sorts, record_parser, properties):
+        yield from batch
+
+def get_all_pages_from_notion(
+    DATABASE_ID: Optional[str],
+    filter_payload: Optional[dict] = None,
+    sorts: Optional[list] = None,
+    record_parser: Optional[Callable[[dict], Any]] = None,
+    properties: Optional[List[str]] = None,
+) -> Optional[list]:
+    """
+    Busca TODOS os registros de um database do Notion, tratando paginação automaticamente (Notion retorna no máximo 100 registros por requisição).
+    Suporta filtros, ordenações e projeção de propriedades opcionais. Em caso de erro retorna lista vazia (nunca um resultado parcial).
+    record_parser: converte cada página em um registro tipado assim que o lote chega, descartando o JSON bruto.
+    """
+    try:
+        return list(iter_pages_from_notion(DATABASE_ID, filter_payload, sorts, record_parser, properties))
+    except Exception as e:
+        log_and_print(f"Erro ao buscar dados do Notion: {e}", level='error')
+        return []
+
+def extract_asset_name_from_title(page: dict) -> Optional[str]:
+    try:
+        properties = page['properties'] # Pega as propriedades da página
+        title_field = properties[VI_TICKER] # Pega o campo do título
+        title_content = title_field.get("title", []) # O title_content é um array de objetos com o texto do título
+
+        if title_content:
+            return title_content[0].get("plain_text", "").strip() # Pega o texto do título
+        else:
+            return None
+    except Exception as e:
+        log_and_print(f"Erro ao extrair título da página: {e}", level='error')
+        return None
+    
+def is_brazilian_ticker(ticker: str) -> bool:
+    if not ticker:
+        return False
+
+    ticker = ticker.upper().strip()
+
+    pattern = r"^[A-Z0-9]{4}\d{1,2}$"
+    return bool(re.match(pattern, ticker))    
+
+def get_ticker_market(ticker: str) -> str:
+    """Bolsa de referência do ticker: B3 para tickers brasileiros, NYSE para os demais."""
+    return "B3" if is_brazilian_ticker(ticker) else "NYSE"
+
+def is_market_open(market: str, now: Optional[datetime] = None) -> bool:
+    """Indica se o pregão regular da bolsa está aberto no instante informado (padrão: agora)."""
+    tz, opens_at, closes_at, market_holidays = market_sessions()[market]
+    local_now = (now or datetime.now(tz)).astimezone(tz)
+    if local_now.weekday() >= 5 or local_now.date() in market_holidays:
+        return False
+    return opens_at <= local_now.time() < closes_at
+
+def is_any_market_open(now: Optional[datetime] = None) -> bool:
+    return any(is_market_open(market, now) for market in market_sessions())
+
+# ------------------ REGISTROS TIPADOS ------------------
+# As páginas do Notion são convertidas uma única vez em registros compactos (dataclasses com __slots__)
+# assim que chegam da API; o JSON bruto é descartado em seguida.
+
+def parse_iso_date(value: Optional[str]) -> Optional[date]:
+    """Converte datas ISO do Notion ('2024-01-31' ou '2024-01-31T10:00:00.000-03:00') sem passar pelo dateutil."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return parser.parse(value).date()
+
+def _prop_number(props: dict, name: str) -> Optional[float]:
+    value = (props.get(name) or {}).get("number")
+    return float(value) if value is not None else None
+
+def _prop_date(props: dict, name: str) -> Optional[date]:
+    date_obj = (props.get(name) or {}).get("date") or {}
+    return parse_iso_date(date_obj.get("start"))
+
+def _prop_checkbox(props: dict, name: str) -> bool:
+    return bool((props.get(name) or {}).get("checkbox"))
+
+def _prop_relation_ids(props: dict, name: str) -> List[str]:
+    return [item["id"] for item in (props.get(name) or {}).get("relation", [])]
+
+def _prop_first_relation_id(props: dict, name: str) -> Optional[str]:
+    ids = _prop_relation_ids(props, name)
+    return ids[0] if ids else None
+
+def _prop_unique_id(props: dict, name: str) -> int:
+    return ((props.get(name) or {}).get("unique_id") or {}).get("number") or 0
+
+def _prop_rich_text(props: dict, name: str) -> Optional[str]:
+    text = "".join(item.get("plain_text", "") for item in (props.get(name) or {}).get("rich_text", []))
+    return text or None
+
+def _prop_select(props: dict, name: str) -> Optional[str]:
+    select = (props.get(name) or {}).get("select")
+    return select["name"].upper() if select else None
+
+@dataclass(slots=True)
+class VariableIncomeAsset:
+    id: str
+    ticker: Optional[str]
+    unit_price: Optional[float]
+    last_update: Optional[date]
+    currency: Optional[str]
+    quantity: Optional[float] = None
+
+@dataclass(slots=True)
+class FixedIncomeAsset:
+    id: str
+    indexer: Optional[str]
+    indexer_pct: float
+    due_date: Optional[date]
+
+@dataclass(slots=True)
+class FixedIncomeContract:
+    id: str
+    asset_id: Optional[str]
+    contribution_id: Optional[str]
+    contribution_date: Optional[date]
+    indexer: Optional[str]
+    indexer_pct: float
+    fixed_rate: float
+    due_date: Optional[date]
+    principal: Optional[float]
+    balance: float
+    last_update: Optional[date]
+    last_rate_date: Optional[date]
+    closed: bool
+    unique_id: int
+    pricing_fingerprint: Optional[str] = None
+
+@dataclass(slots=True)
+class FixedIncomeContribution:
+    id: str
+    asset_id: Optional[str]
+    contract_id: Optional[str]
+    amount: Optional[float]
+    date: Optional[date]
+    fixed_rate: float
+
+@dataclass(slots=True)
+class FixedIncomeWithdrawal:
+    id: str
+    asset_id: Optional[str]
+    amount: float
+    date: Optional[date]
+    processed: bool
+
+@dataclass(slots=True)
+class WithdrawalAllocation:
+    id: str
+    withdrawal_id: Optional[str]
+    contract_id: Optional[str]
+    amount: Optional[float]
+    date: Optional[date]
+
+# Propriedades lidas por cada parser: as consultas projetam apenas estas (filter_properties)
+VI_ASSET_PROPERTIES = [VI_TICKER]
+VI_FOREIGN_ASSET_PROPERTIES = [VI_TICKER, VI_CURRENCY]
+# Propriedades extras lidas para ordenar o trabalho no modo --time-budget
+VI_PRIORITY_PROPERTIES = [VI_UPDATE_DATE, VI_UNIT_PRICE, VI_QUANTITY]
+# Contratos não trafegam os rollups (Indexer, Indexer %, Due Date, Principal Amount): são resolvidos localmente
+# a partir dos caches de ativos e aportes (ver load_fixed_income_reference_data).
+FI_CONTRACT_PROPERTIES = [
+    FI_ASSET, FIC_CONTRIBUTION_REL, FI_CONTRIBUTION_DATE, FI_ADDITIONAL_FIXED_RATE,
+    FI_BALANCE, FI_LAST_UPDATE, FI_LAST_RATE_DATE, FI_CLOSED, FI_CONTRACT_UNIQUE_ID, FI_PRICING_FINGERPRINT,
+]
+FI_ASSET_PROPERTIES = [FIX_INDEXER, FIX_INDEXER_PCT, FIX_DUE_DATE]
+FI_CONTRIBUTION_PROPERTIES = [FIC_ASSET, FIC_CONTRACT, FIC_AMOUNT, FIC_DATE, FIC_ADDITIONAL_FIXED_RATE]
+FI_WITHDRAWAL_PROPERTIES = [FIW_ASSET, FIW_AMOUNT, FIW_DATE, FIW_PROCESSED]
+FI_ALLOCATION_PROPERTIES = [FIA_WITHDRAWAL_REL, FIA_CONTRACT_REL, FIA_AMOUNT, FIA_OPERATION_DATE]
+
+def parse_variable_income_asset(page: dict) -> VariableIncomeAsset:
+    props = page.get("properties", {})
+    return VariableIncomeAsset(
+        id=page["id"],
+        ticker=extract_asset_name_from_title(page),
+        unit_price=_prop_number(props, VI_UNIT_PRICE),
+        last_update=_prop_date(props, VI_UPDATE_DATE),
+        currency=_prop_select(props, VI_CURRENCY),
+        quantity=_prop_number(props, VI_QUANTITY),
+    )
+
+def parse_fixed_income_asset(page: dict) -> FixedIncomeAsset:
+    props = page.get("properties", {})
+    return FixedIncomeAsset(
+        id=page["id"],
+        indexer=_prop_select(props, FIX_INDEXER),
+        indexer_pct=_prop_number(props, FIX_INDEXER_PCT) or 1.0,
+        due_date=_prop_date(props, FIX_DUE_DATE),
+    )
+
+def parse_fixed_income_contract(page: dict) -> FixedIncomeContract:
+    """
+    Converte a página do contrato e resolve localmente (join por relação) os termos que antes vinham de rollups:
+    indexador, percentual e vencimento do ativo; valor principal do aporte.
+    Depende de load_fixed_income_reference_data() ter sido chamado no run; sem ele, os termos ficam vazios.
+    """
+    props = page.get("properties", {})
+    asset_id = _prop_first_relation_id(props, FI_ASSET)
+    contribution_id = _prop_first_relation_id(props, FIC_CONTRIBUTION_REL)
+    asset = current_portfolio().fi_assets_by_id.get(asset_id) if asset_id else None
+    contribution = current_portfolio().fi_contributions_by_id.get(contribution_id) if contribution_id else None
+    return FixedIncomeContract(
+        id=page["id"],
+        asset_id=asset_id,
+        contribution_id=contribution_id,
+        contribution_date=_prop_date(props, FI_CONTRIBUTION_DATE),
+        indexer=asset.indexer if asset else None,
+        indexer_pct=asset.indexer_pct if asset else 1.0,
+        fixed_rate=_prop_number(props, FI_ADDITIONAL_FIXED_RATE) or 0.0,
+        due_date=asset.due_date if asset else None,
+        principal=contribution.amount if contribution else None,
+        balance=_prop_number(props, FI_BALANCE) or 0.0,
+        last_update=_prop_date(props, FI_LAST_UPDATE),
+        last_rate_date=_prop_date(props, FI_LAST_RATE_DATE),
+        closed=_prop_checkbox(props, FI_CLOSED),
+        unique_id=_prop_unique_id(props, FI_CONTRACT_UNIQUE_ID),
+        pricing_fingerprint=_prop_rich_text(props, FI_PRICING_FINGERPRINT),
+    )
+
+def parse_fixed_income_contribution(page: dict) -> FixedIncomeContribution:
+    props = page.get("properties", {})
+    return FixedIncomeContribution(
+        id=page["id"],
+        asset_id=_prop_first_relation_id(props, FIC_ASSET),
+        contract_id=_prop_first_relation_id(props, FIC_CONTRACT),
+        amount=_prop_number(props, FIC_AMOUNT),
+        date=_prop_date(props, FIC_DATE),
+        fixed_rate=_prop_number(props, FIC_ADDITIONAL_FIXED_RATE) or 0.0,
+    )
+
+def parse_fixed_income_withdrawal(page: dict) -> FixedIncomeWithdrawal:
+    props = page.get("properties", {})
+    return FixedIncomeWithdrawal(
+        id=page["id"],
+        asset_id=_prop_first_relation_id(props, FIW_ASSET),
+        amount=_prop_number(props, FIW_AMOUNT) or 0.0,
+        date=_prop_date(props, FIW_DATE),
+        processed=_prop_checkbox(props, FIW_PROCESSED),
+    )
+
+def parse_withdrawal_allocation(page: dict) -> WithdrawalAllocation:
+    props = page.get("properties", {})
+    return WithdrawalAllocation(
+        id=page["id"],
+        withdrawal_id=_prop_first_relation_id(props, FIA_WITHDRAWAL_REL),
+        contract_id=_prop_first_relation_id(props, FIA_CONTRACT_REL),
+        amount=_prop_number(props, FIA_AMOUNT),
+        date=_prop_date(props, FIA_OPERATION_DATE),
+    )
+
+def load_fixed_income_reference_data() -> bool:
+    """
+    Carrega (uma consulta paginada cada) os ativos de renda fixa e os aportes, indexados por page id.
+    Os contratos resolvem indexador, percentual, vencimento e principal por esses caches,
+    sem depender dos rollups que o Notion recalcula (e trunca) a cada consulta.
+    Retorna False se algum dos databases não pôde ser lido.
+    """
+    portfolio = current_portfolio()
+    try:
+        assets = list(iter_pages_from_notion(
+            portfolio.fi_assets_database_id, record_parser=parse_fixed_income_asset, properties=FI_ASSET_PROPERTIES
+        ))
+        contributions = list(iter_pages_from_notion(
+            portfolio.fi_contributions_database_id, record_parser=parse_fixed_income_contribution, properties=FI_CONTRIBUTION_PROPERTIES
+        ))
+    except Exception as e:
+        log_and_print(f"Erro ao carregar ativos/aportes de renda fixa: {e}", level="error")
+        return False
+
+    portfolio.fi_assets_by_id.clear()
+    portfolio.fi_assets_by_id.update((asset.id, asset) for asset in assets)
+    portfolio.fi_contributions_by_id.clear()
+    portfolio.fi_contributions_by_id.update((contribution.id, contribution) for contribution in contributions)
+    portfolio.reference_loaded_at = time.monotonic()
+    log_and_print(f"Dados de referência carregados: {len(assets)} ativos, {len(contributions)} aportes.")
+    return True
+
+# ------------------ COTA DAS APIs DE COTAÇÃO ------------------
+
+class ApiQuotaLedger:
+    """
+    Contabilidade de chamadas por provedor e por chave, persistida em API_QUOTA_FILE entre execuções.
+    Cada provedor pode ter várias chaves (variável de ambiente separada por vírgulas); acquire() escolhe a chave
+    menos usada que ainda tem cota no minuto, no dia e no mês, e devolve None quando nenhuma tem.
+    As chaves não são gravadas no arquivo, apenas uma impressão digital (sha256 truncado).
+    """
+
+    def __init__(self, path: str, keys: Dict[str, List[str]], limits: Dict[str, Dict[str, int]]):
+        self.path = path
+        self.keys = keys
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._minute_calls: Dict[Tuple[str, str], deque] = {}
+        # Chave recusada por limite de curto prazo: fora de uso até o instante (time.monotonic()) registrado
+        self._cooldown_until: Dict[Tuple[str, str], float] = {}
+        self._state = self._load()
+        self._changed = False
+        self._saved_at = time.monotonic()
+
+    @staticmethod
+    def _fingerprint(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _periods() -> Tuple[str, str]:
+        today = datetime.now(ZoneInfo("UTC")).date()
+        return today.isoformat(), today.strftime("%Y-%m")
+
+    def _load(self) -> dict:
+        state: dict = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_and_print(f"Erro ao ler {self.path}: {e}. Iniciando contabilidade de cota vazia.", level='warning')
+        state.setdefault("providers", {})
+        return state
+
+    def _roll_periods(self) -> None:
+        """Zera contadores diários/mensais quando o dia/mês (UTC) mudou desde a última gravação."""
+        day, month = self._periods()
+        for provider_state in self._state["providers"].values():
+            for key_state in provider_state.values():
+                if key_state.get("day") != day:
+                    key_state.update(day=day, day_calls=0, exhausted=False)
+                if key_state.get("month") != month:
+                    key_state.update(month=month, month_calls=0)
+
+    def _key_state(self, provider: str, key: str) -> dict:
+        day, month = self._periods()
+        return self._state["providers"].setdefault(provider, {}).setdefault(
+            self._fingerprint(key), {"day": day, "day_calls": 0, "month": month, "month_calls": 0, "exhausted": False}
+        )
+
+    def _minute_window(self, provider: str, key: str) -> deque:
+        window = self._minute_calls.setdefault((provider, key), deque())
+        now = time.monotonic()
+        while window and now - window[0] >= 60:
+            window.popleft()
+        return window
+
+    def _key_remaining(self, provider: str, key: str) -> Optional[int]:
+        """Chamadas restantes para a chave (None = ilimitado). Considera minuto, dia e mês."""
+        limits = self.limits.get(provider, {})
+        key_state = self._key_state(provider, key)
+        if key_state.get("exhausted") or self._cooldown_until.get((provider, key), 0.0) > time.monotonic():
+            return 0
+        remaining: Optional[int] = None
+        for limit_name, used in (
+            ("per_minute", len(self._minute_window(provider, key))),
+            ("per_day", key_state["day_calls"]),
+            ("per_month", key_state["month_calls"]),
+        ):
+            limit = limits.get(limit_name)
+            if limit:
+                left = max(0, limit - used)
+                remaining = left if remaining is None else min(remaining, left)
+        return remaining
+
+    def save(self) -> None:
+        """Grava os contadores, se mudaram (ao fim do run, a cada ciclo do daemon e a cada QUOTA_SAVE_SECONDS)."""
+        with self._lock:
+            if not self._changed:
+                return
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._state, f)
+                os.replace(tmp_path, self.path)
+                self._changed = False
+                self._saved_at = time.monotonic()
+            except Exception as e:
+                log_and_print(f"Erro ao gravar {self.path}: {e}", level='warning')
+
+    def acquire(self, provider: str) -> Optional[str]:
+        """Reserva uma chamada: devolve a chave a usar (já contabilizada) ou None se o provedor está sem cota."""
+        with self._lock:
+            self._roll_periods()
+            best_key = None
+            best_calls = None
+            for key in self.keys.get(provider, []):
+                remaining = self._key_remaining(provider, key)
+                if remaining == 0:
+                    continue
+                calls = self._key_state(provider, key)["day_calls"]
+                if best_calls is None or calls < best_calls:
+                    best_key, best_calls = key, calls
+            if best_key is None:
+                return None
+            key_state = self._key_state(provider, best_key)
+            key_state["day_calls"] += 1
+            key_state["month_calls"] += 1
+            self._minute_window(provider, best_key).append(time.monotonic())
+            self._changed = True
+            save_due = time.monotonic() - self._saved_at >= QUOTA_SAVE_SECONDS
+        if save_due:
+            self.save()
+        return best_key
+
+    def mark_exhausted(self, provider: str, key: str) -> None:
+        """O provedor recusou a chave pela cota diária ou mensal: não é mais usada até o próximo dia (UTC)."""
+        with self._lock:
+            self._key_state(provider, key)["exhausted"] = True
+            self._changed = True
+
+    def cool_down(self, provider: str, key: str, seconds: float) -> None:
+        """O provedor recusou a chave por limite de curto prazo (por minuto): volta a ser usada após `seconds`."""
+        with self._lock:
+            self._cooldown_until[(provider, key)] = time.monotonic() + seconds
+
+    def remaining(self, provider: str) -> Optional[int]:
+        """Soma das chamadas restantes agora em todas as chaves do provedor (None = sem limite configurado)."""
+        with self._lock:
+            self._roll_periods()
+            total = 0
+            for key in self.keys.get(provider, []):
+                remaining = self._key_remaining(provider, key)
+                if remaining is None:
+                    return None
+                total += remaining
+            return total
+
+    def has_budget(self, provider: str) -> bool:
+        remaining = self.remaining(provider)
+        return remaining is None or remaining > 0
+
+    def has_any_budget(self) -> bool:
+        """True se ao menos um provedor da cascata ainda pode ser chamado agora."""
+        return any(self.has_budget(provider) for provider in self.keys)
+
+    def summary(self) -> str:
+        with self._lock:
+            self._roll_periods()
+            parts = []
+            for provider, keys in self.keys.items():
+                calls = sum(self._key_state(provider, key)["day_calls"] for key in keys)
+                limit = self.limits.get(provider, {}).get("per_day")
+                parts.append(f"{PROVIDER_NAMES[provider]} {calls}/{limit * len(keys) if limit else '∞'}")
+            return ", ".join(parts)
+
+def build_quota_ledger(config: EngineConfig) -> ApiQuotaLedger:
+    """Ledger de cota com as chaves e os limites por provedor da configuração."""
+    return ApiQuotaLedger(
+        config.api_quota_file,
+        keys={provider: config.api_keys(provider) for provider in PROVIDER_NAMES},
+        limits=config.provider_limits,
+    )
+
+def _quota_refusal(provider: str, response: requests.Response) -> Optional[str]:
+    """
+    Classifica a recusa por limite, inclusive quando o provedor responde 200 com mensagem de limite no corpo:
+    "day" para cota diária/mensal esgotada (402 ou mensagem que cita dia/mês sem citar minuto), "minute" para
+    os demais limites (por minuto, rajadas), None se a resposta não é uma recusa por limite.
+    """
+    message = ""
+    if provider in ("twelve_data", "alpha_vantage"):
+        try:
+            data = response.json()
+        except Exception:
+            data = None
+        if isinstance(data, dict):
+            if provider == "twelve_data" and data.get("code") == 429:
+                message = str(data.get("message", "")) or "429"
+            elif provider == "alpha_vantage" and ("Note" in data or "rate limit" in str(data.get("Information", "")).lower()):
+                message = str(data.get("Note") or data.get("Information"))
+    if response.status_code == 402:
+        return "day"
+    if response.status_code != 429 and not message:
+        return None
+    message = (message or response.text[:500]).lower()
+    if "minute" in message:
+        return "minute"
+    return "day" if re.search(r"\b(day|daily|month|monthly)\b", message) else "minute"
+
+def _retry_after_seconds(response: requests.Response) -> float:
+    """Espera indicada pelo provedor (Retry-After em segundos); sem ela, até a janela de um minuto expirar."""
+    try:
+        return max(1.0, float(response.headers.get("Retry-After") or 60))
+    except ValueError:
+        return 60.0
+
+def _call_provider(provider: str, send: Callable[[str], requests.Response]) -> Optional[requests.Response]:
+    """
+    Executa `send(chave)` com uma chave do provedor que ainda tem cota, contabilizando a chamada no ledger.
+    Se o provedor recusar a chave por limite, a próxima chave é tentada; a recusada fica de fora até o próximo dia
+    (cota diária/mensal) ou só até a janela do limite de curto prazo expirar (Retry-After ou 60s).
+    Retorna None quando nenhuma chave tem cota (o chamador segue para o próximo provedor da cascata).
+    """
+    engine = current_engine()
+    for _ in range(len(engine.quota_ledger.keys.get(provider, [])) or 1):
+        key = engine.quota_ledger.acquire(provider)
+        if key is None:
+            log_and_print(f"{PROVIDER_NAMES[provider]} sem cota disponível. Pulando.", level='warning')
+            return None
+        trace = _quote_trace.get(None)
+        if trace is not None:
+            trace.append(provider)
+        started = time.monotonic()
+        response = send(key)
+        engine.run_stats.record_latency(provider, time.monotonic() - started)
+        refusal = _quota_refusal(provider, response)
+        if refusal is None:
+            return response
+        if refusal == "day":
+            log_and_print(f"{PROVIDER_NAMES[provider]} recusou uma chave pela cota diária. Chave suspensa até amanhã (UTC).", level='warning')
+            engine.quota_ledger.mark_exhausted(provider, key)
+        else:
+            seconds = _retry_after_seconds(response)
+            log_and_print(f"{PROVIDER_NAMES[provider]} recusou uma chave por limite de curto prazo. Chave em espera por {seconds:.0f}s.", level='warning')
+            engine.quota_ledger.cool_down(provider, key, seconds)
+    return None
+
+def _yahoo_headers(key: str) -> dict:
+    return {
+        "X-RapidAPI-Key": key,
+        "X-RapidAPI-Host": "apidojo-yahoo-finance-v1.p.rapidapi.com"
+    }
+
+# ------------------ ORÇAMENTO DE TEMPO ------------------
+
+class RefreshDeadline:
+    """
+    Prazo do modo --time-budget.
+    Mede o custo médio (média móvel exponencial) de cada tipo de item ("vi", "fi") e indica quando
+    parar: antes do próximo item que não caberia no tempo restante menos a margem e a reserva pedida.
+    """
+
+    def __init__(self, budget_seconds: float, safety_seconds: Optional[float] = None):
+        self.budget_seconds = budget_seconds
+        self.safety_seconds = current_config().time_budget_safety_seconds if safety_seconds is None else safety_seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + budget_seconds
+        self._item_cost: Dict[str, float] = {}
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def record(self, kind: str, seconds_per_item: float) -> None:
+        previous = self._item_cost.get(kind)
+        self._item_cost[kind] = seconds_per_item if previous is None else 0.3 * seconds_per_item + 0.7 * previous
+
+    def should_stop(self, kind: str, reserve_seconds: float = 0.0) -> bool:
+        expected = self._item_cost.get(kind, 0.0)
+        return self.remaining() - reserve_seconds - self.safety_seconds < expected
+
+def variable_income_priority(asset: VariableIncomeAsset, today: date) -> tuple:
+    """
+    Chave de ordenação do modo --time-budget (menor = antes):
+    preço mais defasado primeiro (nunca atualizado = máximo), depois pregão aberto, depois maior posição.
+    """
+    staleness = (today - asset.last_update).days if asset.last_update else 10**6
+    market_open = bool(asset.ticker) and is_market_open(get_ticker_market(asset.ticker))
+    position = (asset.quantity or 0.0) * (asset.unit_price or 0.0)
+    return (-staleness, not market_open, -position)
+
+def fixed_income_priority(contract: FixedIncomeContract) -> date:
+    """Contratos com taxa aplicada há mais tempo primeiro (sem taxa aplicada: desde o aporte)."""
+    return contract.last_rate_date or contract.contribution_date or date.min
+
+def iter_prioritized_variable_income_batches(
+    sources: List["VariableIncomeSource"], batch_size: int = 25
+) -> Iterator[List[Tuple[VariableIncomeAsset, "VariableIncomeSource"]]]:
+    """
+    Lê todos os ativos dos databases (B3 e exterior), ordena tudo junto por prioridade (como o planejador do run)
+    e devolve lotes pequenos para que as gravações acompanhem as buscas.
+    """
+    entries: List[Tuple[VariableIncomeAsset, VariableIncomeSource]] = []
+    for source in sources:
+        assets = get_all_pages_from_notion(
+            source.database_id, record_parser=parse_variable_income_asset,
+            properties=list(dict.fromkeys(source.properties + VI_PRIORITY_PROPERTIES)),
+        ) or []
+        entries.extend((asset, source) for asset in assets)
+    today = date.today()
+    entries.sort(key=lambda entry: variable_income_priority(entry[0], today))
+    for start in range(0, len(entries), batch_size):
+        yield entries[start:start + batch_size]
+
+# ---------------- FUNÇÕES RENDA VARIÁVEL -------------------
+
+def get_price_from_apis(ticker: str) -> Optional[float]:
+    """
+    Retorna o preço do ticker, reaproveitando cotações recentes do cache (QUOTE_CACHE_TTL_SECONDS).
+    Se outra carteira já está buscando o mesmo ticker, aguarda o resultado em vez de chamar os provedores de novo.
+    """
+    engine = current_engine()
+    with engine.quote_lock:
+        cached = engine.quote_cache.get(ticker)
+        if cached and (
+            time.monotonic() - cached[1] < current_config().quote_cache_ttl_seconds
+            or (engine.quote_fresh_since is not None and cached[1] >= engine.quote_fresh_since)
+        ):
+            log_and_print(f"Usando cotação em cache para {ticker}: {cached[0]}")
+            return cached[0]
+        inflight = engine.quote_inflight.get(ticker)
+        owner = inflight is None
+        if owner:
+            inflight = engine.quote_inflight[ticker] = Future()
+
+    if not owner:
+        log_and_print(f"Aguardando cotação de {ticker} já em busca por outra carteira...")
+        return inflight.result()
+
+    trace_token = _quote_trace.set([])
+    try:
+        price = _fetch_price_cascade(ticker)
+        if price:
+            with engine.quote_lock:
+                engine.quote_cache[ticker] = (price, time.monotonic())
+            if _quote_trace.get():
+                engine.run_stats.record_quote_trace(ticker, _quote_trace.get())
+        inflight.set_result(price)
+        return price
+    except BaseException as e:
+        inflight.set_exception(e)
+        raise
+    finally:
+        _quote_trace.reset(trace_token)
+        with engine.quote_lock:
+            engine.quote_inflight.pop(ticker, None)
+
+def _fetch_price_cascade(ticker: str) -> Optional[float]:
+    """Lógica de cascata priorizando APIs com maior cobertura de ativos e número de requisições gratuitas"""
+
+    # 1) EOD Historical Data (forte global + BR)
+    log_and_print("Buscando preço no EOD Historical Data...")
+    eod_variations = []
+    
+    # Se parecer um ticker brasileiro, adiciona .SA
+    if is_brazilian_ticker(ticker):
+        eod_variations.append(f"{ticker}.SA")
+    
+    # Adiciona variação com .US
+    eod_variations.append(f"{ticker}.US")
+    
+    # Adiciona variação sem sufixo
+    eod_variations.append(ticker)
+    
+    for eod_ticker in eod_variations:
+        price = get_from_eod(eod_ticker)
+        if price:
+            return price
+
+    # 2) BRAPI (forte para Brasil)
+    log_and_print(f"EOD Historical Data não encontrou {ticker}, tentando BRAPI...")
+    price = get_from_brapi(ticker)
+    if price:
+        return price
+
+    # 3) Twelve Data (global)
+    log_and_print(f"BRAPI não encontrou {ticker}, tentando Twelve Data...")
+    price = get_from_twelve_data(ticker)
+    if price:
+        return price
+
+    # 4) Alpha Vantage (fallback global)
+    log_and_print(f"Twelve Data não encontrou {ticker}, tentando Alpha Vantage...")
+    price = get_from_alpha_vantage(ticker)
+    if price:
+        return price
+
+    # 5) Finnhub (fallback global)
+    log_and_print(f"Alpha Vantage não encontrou {ticker}, tentando Finnhub...")
+    price = get_from_finnhub(ticker)
+    if price:
+        return price
+
+    # 6) Yahoo Finance (fallback final) - tenta múltiplas variações de ticker
+    log_and_print(f"Finnhub não encontrou {ticker}, tentando Yahoo Finance...")
+    yahoo_variations = [
+        (ticker, "US"),  # Tenta primeiro com o ticker original (US)
+    ]
+    
+    # Se parecer um ticker brasileiro, adiciona .SA
+    if is_brazilian_ticker(ticker):
+        yahoo_variations.append((f"{ticker}.SA", "BR"))
+    
+    # Adiciona variação com .US
+    yahoo_variations.append((f"{ticker}.US", "US"))
+    
+    for eod_ticker, region in yahoo_variations:
+        price = get_from_yahoo_finance(eod_ticker, region=region)
+        if price:
+            return price
+
+    log_and_print(f"Não foi possível encontrar preço para {ticker} em nenhuma API.", level='warning')
+    return None
+
+# Twelve Data API para buscar o preço dos ativos dos EUA
+# https://twelvedata.com/docs/api/price
+def get_from_twelve_data(ticker: str) -> Optional[float]:
+    try:
+        response = _call_provider(
+            "twelve_data",
+            lambda key: current_engine().http.get(f"https://api.twelvedata.com/price?symbol={ticker}&apikey={key}", timeout=10),
+        )
+        if response is None:
+            return None
+        response.raise_for_status()
+        price_info = response.json()
+        if "price" in price_info:
+            return float(price_info["price"])
+        else:
+            return None
+    except Exception as e:
+        log_and_print(f"Erro ao buscar preço de {ticker} na Twelve Data: {e}", level='error')
+        return None
+
+def get_from_yahoo_finance(ticker: str, region: str) -> Optional[float]:
+    try:
+        # URL da API do Yahoo Finance
+        #url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-timeseries"
+        url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-summary"
+
+        querystring = {"symbol": ticker, "region": region}
+
+        response = _call_provider(
+            "yahoo",
+            lambda key: current_engine().http.get(url, headers=_yahoo_headers(key), params=querystring, timeout=10),
+        )
+        if response is None:
+            return None
+        response.raise_for_status()
+        
+        data = response.json()
+        market_price = data.get("price", {}).get("regularMarketPrice", {}).get("raw", None)
+        
+        if market_price:
+            return float(market_price)        
+        else:
+            
+            log_and_print(f"Preço não encontrado para {ticker} no Yahoo Finance: {data}", level='warning')
+            return None
+    except Exception as e:
+        log_and_print(f"Erro ao buscar preço de {ticker} no Yahoo Finance: {e}", level='error')
+        return None
+
+def get_from_brapi(ticker: str) -> Optional[float]:
+    try:
+        response = _call_provider(
+            "brapi",
+            lambda key: current_engine().http.get(f"https://brapi.dev/api/quote/{ticker.upper()}?token={key}", timeout=10),
+        )
+        if response is None:
+            return None
+        response.raise_for_status()
+        data = response.json()
+
+        results = data.get("results", [])
+        if results and "regularMarketPrice" in results[0]:
+            return float(results[0]["regularMarketPrice"])
+        else:
+            log_and_print(f"Preço não encontrado para {ticker} na Brapi: {data}", level='warning')
+            return None
+    except Exception as e:
+        log_and_print(f"Erro ao buscar {ticker} na Brapi: {e}", level='error')
+        return None
+
+def get_from_eod(ticker: str) -> Optional[float]:
+    try:
+        resp = _call_provider(
+            "eod",
+            lambda key: current_engine().http.get(f"https://eodhistoricaldata.com/api/eod/{ticker}?api_token={key}&fmt=json", timeout=10),
+        )
+        if resp is None:
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        if not data:
+            log_and_print("EOD retornou lista vazia")
+            return None
+        last = data[-1]
+        price = last.get("close")
+        if price:
+            return float(price)
+    except Exception as e:
+        log_and_print(f"Erro EOD Historical para {ticker}: {e}", level='error')
+    return None
+
+def get_from_alpha_vantage(ticker: str) -> Optional[float]:
+    try:
+        resp = _call_provider(
+            "alpha_vantage",
+            lambda key: current_engine().http.get(
+                f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={key}", timeout=10
+            ),
+        )
+        if resp is None:
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        price_str = data.get("Global Quote", {}).get("05. price")
+        if price_str:
+            return float(price_str)
+    except Exception as e:
+        log_and_print(f"Erro AlphaVantage {ticker}: {e}", level='error')
+    return None
+
+def get_from_finnhub(ticker: str) -> Optional[float]:
+    try:
+        query_ticker = _finnhub_symbol(ticker)
+        resp = _call_provider(
+            "finnhub",
+            lambda key: current_engine().http.get(f"https://finnhub.io/api/v1/quote?symbol={query_ticker}&token={key}", timeout=10),
+        )
+        if resp is None:
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        price = data.get("c")
+        if price:
+            return float(price)
+    except Exception as e:
+        log_and_print(f"Erro Finnhub {ticker}: {e}", level='error')
+    return None
+
+
+def update_variable_income_asset_price_in_notion(page_id: str, price: float, brl_price: Optional[float] = None):
+    try:
+        url = f"https://api.notion.com/v1/pages/{page_id}"
+        data = {
+            "properties": {
+                VI_UNIT_PRICE: {"number": float(price)},
+                VI_UPDATE_DATE: {
+                    "date": {
+                        "start": datetime.now().isoformat()
+                    }
+                }
+            }
+        }
+        if brl_price is not None:
+            data["properties"][VI_BRL_PRICE] = {"number": round(brl_price, 4)}
+        response = notion_request("PATCH", url, json=data)
+        
+        if response.status_code == 200:
+            log_and_print(f"Preço atualizado com sucesso no Notion para {page_id}.")
+            portfolio = current_portfolio()
+            portfolio.query_snapshot.record_price(page_id, float(price), brl_price)
+            if portfolio.summary is not None:
+                portfolio.summary.record_price(page_id, float(price), brl_price)
+        else:
+            log_and_print(f"Erro ao atualizar o preço no Notion: {response.status_code} - {response.text}", level='error')
+        
+    except Exception as e:
+        log_and_print(f"Erro ao atualizar preço no Notion para {page_id}: {e}", level='error')
+
+@dataclass(slots=True)
+class VariableIncomeSource:
+    """Database de renda variável de um run: propriedades lidas e tratamento dos preços (exterior/BRL)."""
+    database_id: str
+    properties: List[str]
+    foreign: bool
+    write_brl: bool
+
+def variable_income_source(database_id: str, convert_to_brl: bool = False) -> VariableIncomeSource:
+    write_brl = convert_to_brl and VI_BRL_PRICE in get_database_property_ids(database_id)
+    if convert_to_brl and not write_brl:
+        log_and_print(f"Database {database_id} sem a propriedade '{VI_BRL_PRICE}'. Conversão para BRL desativada.", level='warning')
+    properties = VI_FOREIGN_ASSET_PROPERTIES if convert_to_brl else VI_ASSET_PROPERTIES
+    if current_portfolio().summary is not None:
+        # Quantidade e último preço alimentam o valor das posições no resumo da carteira
+        properties = properties + [VI_UNIT_PRICE, VI_QUANTITY]
+    return VariableIncomeSource(database_id, properties, convert_to_brl, write_brl)
+
+def update_variable_income_assets(database_id: str, only_open_markets: bool = False, convert_to_brl: bool = False):
+    """
+    Atualiza o preço de todos os ativos do database, à medida que cada lote de 100 páginas chega.
+    only_open_markets: se True, atualiza apenas tickers cuja bolsa (B3/NYSE) está em pregão (usado pelo modo daemon).
+    convert_to_brl: converte os preços do lote para BRL (uma busca de câmbio por run) e grava VI_BRL_PRICE.
+    """
+    log_and_print("Atualizando valores dos ativos de renda variável...")
+    source = variable_income_source(database_id, convert_to_brl)
+    batches = (
+        [(asset, source) for asset in batch]
+        for batch in iter_page_batches_from_notion(database_id, record_parser=parse_variable_income_asset, properties=source.properties)
+    )
+    _update_variable_income_batches(batches, only_open_markets)
+
+def update_variable_income_assets_prioritized(sources: List[VariableIncomeSource], only_open_markets: bool = False):
+    """Com prazo (--time-budget): ativos de todos os databases lidos e ordenados por prioridade antes das buscas."""
+    log_and_print("Atualizando valores dos ativos de renda variável (por prioridade)...")
+    _update_variable_income_batches(iter_prioritized_variable_income_batches(sources), only_open_markets)
+
+def _update_variable_income_batches(
+    batches: Iterator[List[Tuple[VariableIncomeAsset, VariableIncomeSource]]], only_open_markets: bool
+) -> None:
+    """Busca e grava os preços lote a lote, parando no prazo (--time-budget), na cota das APIs ou no encerramento."""
+    engine = current_engine()
+    summary = current_portfolio().summary
+    deadline = engine.run_deadline
+    fi_reserve = deadline.budget_seconds * current_config().time_budget_fi_share if deadline is not None else 0.0
+    assets_seen = 0
+    stop_reason = None
+    try:
+        for batch in batches:
+            batch_started = time.monotonic()
+            processed = 0
+            quotes: List[Tuple[VariableIncomeAsset, VariableIncomeSource, float]] = []
+            for asset, source in batch:
+                if engine.shutdown_event.is_set():
+                    log_and_print("Encerramento solicitado. Interrompendo atualização de renda variável.", level='warning')
+                    break
+                if deadline is not None:
+                    if deadline.should_stop("vi", reserve_seconds=fi_reserve):
+                        stop_reason = "prazo"
+                        break
+                    if not engine.quota_ledger.has_any_budget():
+                        stop_reason = "cota das APIs esgotada"
+                        break
+
+                if asset.ticker in current_portfolio().skip_tickers:
+                    continue
+                processed += 1
+                assets_seen += 1
+                current_portfolio().query_snapshot.observe_variable_income_asset(asset, foreign=source.foreign)
+                if summary is not None:
+                    summary.observe_variable_income_asset(asset, foreign=source.foreign)
+                price = fetch_variable_income_price(asset, only_open_markets=only_open_markets)
+                if price:
+                    quotes.append((asset, source, price))
+
+            brl_quotes = [(asset, price) for asset, source, price in quotes if source.write_brl]
+            brl_prices = convert_prices_to_brl(brl_quotes) if brl_quotes else {}
+            for asset, _, price in quotes:
+                update_variable_income_asset_price_in_notion(asset.id, price, brl_price=brl_prices.get(asset.id))
+                log_and_print(f"Preço atualizado: {asset.ticker} -> {price}")
+
+            # Custo por item efetivamente processado (um lote interrompido no meio não dilui a média)
+            if deadline is not None and processed:
+                deadline.record("vi", (time.monotonic() - batch_started) / processed)
+            if engine.shutdown_event.is_set():
+                return
+            if stop_reason:
+                log_and_print(
+                    f"Renda variável interrompida ({stop_reason}) após {assets_seen} ativos e "
+                    f"{deadline.elapsed():.0f}s; os demais ficam para o próximo run.",
+                    level='warning'
+                )
+                return
+    except Exception as e:
+        log_and_print(f"Erro ao buscar dados do Notion: {e}", level='error')
+
+    if not assets_seen:
+        log_and_print("Nenhum ativo encontrado ou erro na consulta!", level='warning')
+
+def fetch_variable_income_price(asset: VariableIncomeAsset, only_open_markets: bool = False) -> Optional[float]:
+    """Busca o preço do ativo (sem gravar). Retorna None se não houver ticker, pregão fechado ou nenhuma cotação."""
+    page_id = asset.id
+    ticker = asset.ticker
+
+    if not ticker:
+        log_and_print(f"Página {page_id} sem título (Ticker), pulando.", level='warning')
+        return None
+
+    if only_open_markets and not is_market_open(get_ticker_market(ticker)):
+        return None
+
+    log_and_print(f"Encontrado ticker: {ticker}")
+
+    log_and_print(f"Atualizando {ticker}...")
+    price = get_price_from_apis(ticker)
+    if not price:
+        log_and_print(f"Não foi possível atualizar {ticker}.", level='warning')
+    return price
+
+# ------------------ CÂMBIO ------------------
+
+def _fetch_fx_rates_twelve_data(currencies: List[str]) -> Dict[str, float]:
+    """Uma única requisição com todos os pares (symbol=USD/BRL,EUR/BRL,...)."""
+    symbols = ",".join(f"{currency}/BRL" for currency in currencies)
+    response = _call_provider(
+        "twelve_data",
+        lambda key: current_engine().http.get("https://api.twelvedata.com/price", params={"symbol": symbols, "apikey": key}, timeout=10),
+    )
+    if response is None:
+        return {}
+    response.raise_for_status()
+    data = response.json()
+    # Com um único símbolo a API devolve {"price": ...}; com vários, {"USD/BRL": {"price": ...}, ...}
+    if len(currencies) == 1:
+        data = {f"{currencies[0]}/BRL": data}
+    rates = {}
+    for currency in currencies:
+        price = (data.get(f"{currency}/BRL") or {}).get("price")
+        if price:
+            rates[currency] = float(price)
+    return rates
+
+def _fetch_fx_rates_yahoo(currencies: List[str]) -> Dict[str, float]:
+    """Uma única requisição get-quotes com todos os pares (symbols=USDBRL=X,EURBRL=X,...)."""
+    querystring = {"symbols": ",".join(f"{currency}BRL=X" for currency in currencies), "region": "BR"}
+    response = _call_provider(
+        "yahoo",
+        lambda key: current_engine().http.get(
+            "https://apidojo-yahoo-finance-v1.p.rapidapi.com/market/v2/get-quotes",
+            headers=_yahoo_headers(key), params=querystring, timeout=10,
+        ),
+    )
+    if response is None:
+        return {}
+    response.raise_for_status()
+    rates = {}
+    for quote in response.json().get("quoteResponse", {}).get("result", []):
+        symbol = quote.get("symbol", "")
+        price = quote.get("regularMarketPrice")
+        if symbol.endswith("BRL=X") and price:
+            rates[symbol[:-len("BRL=X")]] = float(price)
+    return rates
+
+def get_fx_rates(currencies: List[str]) -> Dict[str, float]:
+    """
+    Retorna {moeda: cotação em BRL}. As moedas ausentes ou vencidas no cache (FX_CACHE_TTL_SECONDS) são buscadas
+    junto com FX_CURRENCIES em uma única requisição em lote, com cascata Twelve Data -> Yahoo Finance.
+    """
+    # Uma busca por vez: carteiras concorrentes reaproveitam o cache preenchido pela primeira
+    with current_engine().fx_lock:
+        return _get_fx_rates_locked({currency.upper() for currency in currencies})
+
+def _get_fx_rates_locked(wanted: set) -> Dict[str, float]:
+    engine = current_engine()
+    config = current_config()
+    now = time.monotonic()
+    rates = {"BRL": 1.0}
+    for currency in wanted - {"BRL"}:
+        cached = engine.fx_rates.get(currency)
+        if cached and now - cached[1] < config.fx_cache_ttl_seconds:
+            rates[currency] = cached[0]
+
+    missing = sorted(wanted - rates.keys())
+    if not missing:
+        return {currency: rates[currency] for currency in wanted if currency in rates}
+
+    to_fetch = sorted((set(missing) | set(config.fx_currencies)) - {"BRL"})
+    log_and_print(f"Buscando câmbio para BRL: {', '.join(to_fetch)}...")
+    for provider_name, fetch in (("Twelve Data", _fetch_fx_rates_twelve_data), ("Yahoo Finance", _fetch_fx_rates_yahoo)):
+        pending = [currency for currency in to_fetch if currency not in rates]
+        if not pending:
+            break
+        try:
+            fetched = fetch(pending)
+        except Exception as e:
+            log_and_print(f"Erro {provider_name} câmbio: {e}", level='error')
+            continue
+        for currency, rate in fetched.items():
+            engine.fx_rates[currency] = (rate, time.monotonic())
+            rates[currency] = rate
+
+    not_found = [currency for currency in missing if currency not in rates]
+    if not_found:
+        log_and_print(f"Não foi possível obter câmbio para: {', '.join(not_found)}.", level='warning')
+    return {currency: rates[currency] for currency in wanted if currency in rates}
+
+def get_usd_brl_rate() -> Optional[float]:
+    """Busca cotação USD/BRL (via get_fx_rates, com cache)."""
+    return get_fx_rates(["USD"]).get("USD")
+
+def convert_prices_to_brl(quotes: List[Tuple[VariableIncomeAsset, float]]) -> Dict[str, float]:
+    """Converte em lote {page_id: preço em BRL}; todas as moedas do lote saem de uma única consulta de câmbio."""
+    config = current_config()
+    if not quotes:
+        return {}
+    rates = get_fx_rates([asset.currency or config.fx_default_currency for asset, _ in quotes])
+    brl_prices = {}
+    for asset, price in quotes:
+        rate = rates.get(asset.currency or config.fx_default_currency)
+        if rate is not None:
+            brl_prices[asset.id] = price * rate
+    return brl_prices
+
+# ------------------ API Banco Central ------------------
+
+def _fetch_bcb_series_data(serie_id: int, start_date: date, end_date: date, timeout: int = 20) -> list:
+    """Busca uma série do BCB em um intervalo de datas."""
+    if start_date > end_date:
+        return []
+
+    url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados"
+    params = {
+        "formato": "json",
+        "dataInicial": start_date.strftime("%d/%m/%Y"),
+        "dataFinal": end_date.strftime("%d/%m/%Y"),
+    }
+    response = current_engine().http.get(url, params=params, timeout=timeout)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, list):
+        return []
+    return data
+
+
+def _bcb_year_chunks(start_date: date, end_date: date) -> List[Tuple[date, date]]:
+    """Blocos anuais (1º de janeiro até 31/12 ou end_date) que cobrem o intervalo."""
+    return [
+        (date(year, 1, 1), min(date(year, 12, 31), end_date))
+        for year in range(start_date.year, end_date.year + 1)
+    ]
+
+def _missing_bcb_chunks(serie_id: int, start_date: date, end_date: date) -> List[Tuple[date, date]]:
+    coverage = current_engine().bcb_chunk_coverage.get(serie_id, {})
+    return [
+        (chunk_start, chunk_end)
+        for chunk_start, chunk_end in _bcb_year_chunks(start_date, end_date)
+        if coverage.get(chunk_start, date.min) < chunk_end
+    ]
+
+def _fetch_bcb_chunk_with_retry(serie_id: int, chunk_start: date, chunk_end: date) -> list:
+    """Busca um bloco da série, repetindo com espera exponencial (BCB_RETRY_BACKOFF_SECONDS * 2^tentativa)."""
+    engine = current_engine()
+    config = current_config()
+    for attempt in range(config.bcb_fetch_retries + 1):
+        try:
+            started = time.monotonic()
+            data = _fetch_bcb_series_data(serie_id, chunk_start, chunk_end, timeout=20)
+            engine.run_stats.record_latency("bcb", time.monotonic() - started)
+            return data
+        except Exception as e:
+            if attempt == config.bcb_fetch_retries or engine.shutdown_event.is_set():
+                raise
+            delay = config.bcb_retry_backoff_seconds * 2 ** attempt
+            log_and_print(
+                f"Falha ao buscar série {serie_id} do BCB ({chunk_start} a {chunk_end}): {e}. Nova tentativa em {delay:.0f}s.",
+                level="warning"
+            )
+            engine.shutdown_event.wait(delay)
+    return []
+
+def _store_bcb_series_data(serie_id: int, data: list) -> None:
+    """Grava no cache os itens de uma série do BCB (BCB retorna DD/MM/YYYY; valores em %)."""
+    engine = current_engine()
+    if serie_id == IPCA_SERIES_ID:
+        cache = engine.ipca_monthly
+        label = "IPCA"
+    else:
+        label = next(name for name, series in BCB_DAILY_SERIES_MAP.items() if series == serie_id)
+        cache = engine.bcb_daily_rates.setdefault(label, {})
+    for item in data:
+        try:
+            # Parser genérico pode inverter dia/mês quando dia <= 12.
+            item_date = datetime.strptime(item["data"], "%d/%m/%Y").date()
+            cache[item_date] = float(item["valor"].replace(",", ".")) / 100  # Ex: 11.15 vira 0.1115
+        except Exception as parse_error:
+            log_and_print(f"Erro ao processar entrada do BCB para {label}: {parse_error}", level="error")
+
+def fetch_bcb_series(windows: List[Tuple[int, date, date]]) -> set:
+    """
+    Garante no cache as séries pedidas [(serie_id, início, fim), ...].
+    Cada janela é dividida em blocos anuais; só os blocos ainda não cobertos são buscados, em paralelo
+    (BCB_FETCH_WORKERS threads, entre séries e blocos). Um bloco só é marcado como coberto após sucesso,
+    então uma falha parcial faz o próximo pedido buscar apenas os blocos que faltam.
+    Retorna o conjunto de séries com algum bloco que falhou após as novas tentativas.
+    """
+    with current_engine().bcb_lock:
+        return _fetch_bcb_series_locked(windows)
+
+def _fetch_bcb_series_locked(windows: List[Tuple[int, date, date]]) -> set:
+    missing = []
+    for serie_id, start_date, end_date in windows:
+        if start_date > end_date:
+            continue
+        for chunk in _missing_bcb_chunks(serie_id, start_date, end_date):
+            if (serie_id, *chunk) not in missing:
+                missing.append((serie_id, *chunk))
+    if not missing:
+        return set()
+
+    failed: set = set()
+
+    def store(serie_id: int, chunk_start: date, chunk_end: date, data: list) -> None:
+        _store_bcb_series_data(serie_id, data)
+        coverage = current_engine().bcb_chunk_coverage.setdefault(serie_id, {})
+        coverage[chunk_start] = max(coverage.get(chunk_start, date.min), chunk_end)
+
+    if len(missing) == 1:
+        serie_id, chunk_start, chunk_end = missing[0]
+        try:
+            store(serie_id, chunk_start, chunk_end, _fetch_bcb_chunk_with_retry(serie_id, chunk_start, chunk_end))
+        except Exception as e:
+            log_and_print(f"Erro ao buscar série {serie_id} do BCB ({chunk_start} a {chunk_end}): {e}", level="error")
+            failed.add(serie_id)
+        return failed
+
+    # As respostas são gravadas no cache pela thread chamadora; os workers só fazem as requisições.
+    with ThreadPoolExecutor(max_workers=min(current_config().bcb_fetch_workers, len(missing)), thread_name_prefix="bcb") as pool:
+        futures = {pool.submit(contextvars.copy_context().run, _fetch_bcb_chunk_with_retry, *chunk): chunk for chunk in missing}
+        for future in as_completed(futures):
+            serie_id, chunk_start, chunk_end = futures[future]
+            try:
+                store(serie_id, chunk_start, chunk_end, future.result())
+            except Exception as e:
+                log_and_print(f"Erro ao buscar série {serie_id} do BCB ({chunk_start} a {chunk_end}): {e}", level="error")
+                failed.add(serie_id)
+    return failed
+
+def get_bcb_daily_rates(indexer: str, start_date: date, end_date: date) -> dict:
+    """
+    Retorna taxas diárias do BCB.
+    Cada item: {date: annual_rate_decimal}
+    Se algum bloco do intervalo não pôde ser buscado, retorna {} (juros parciais deixariam o saldo errado).
+    """
+    engine = current_engine()
+    if start_date > end_date:
+        return {}
+    indexer_norm = (indexer or "").strip().upper()
+    serie_id = BCB_DAILY_SERIES_MAP.get(indexer_norm)
+    if not serie_id:
+        log_and_print(f"Indexador inválido: {indexer}. Retornando dicionário vazio.", level="warning")
+        return {}
+
+    if serie_id in fetch_bcb_series([(serie_id, start_date, end_date)]):
+        log_and_print(f"Série {indexer_norm} incompleta no intervalo {start_date} a {end_date}. Retornando dicionário vazio.", level="error")
+        return {}
+
+    with engine.bcb_lock:
+        cache = engine.bcb_daily_rates.get(indexer_norm, {})
+        return {
+            rate_date: annual_rate
+            for rate_date, annual_rate in cache.items()
+            if start_date <= rate_date <= end_date
+        }
+
+def _ensure_ipca_cache(start_date: date, end_date: date) -> bool:
+    """Garante cache de IPCA mensal para o intervalo informado."""
+    if start_date > end_date:
+        return True
+    if IPCA_SERIES_ID in fetch_bcb_series([(IPCA_SERIES_ID, start_date, end_date)]):
+        log_and_print(f"IPCA incompleto no intervalo {start_date} a {end_date}.", level="error")
+        return False
+    return True
+
+
+def get_accumulated_ipca(purchase_date: date, end_date: date) -> float:
+    """Calcula o IPCA acumulado (composto) entre purchase_date e end_date"""
+    engine = current_engine()
+    if purchase_date > end_date:
+        return 0.0
+
+    # Força o dia 1 para garantir que a API retorne o índice do mês da compra
+    # O BCB registra o IPCA sempre no dia 01/MM/AAAA
+    start_query = purchase_date.replace(day=1)
+
+    if not _ensure_ipca_cache(start_query, end_date):
+        return 0.0
+
+    # Ordem cronológica: os blocos chegam ao cache em ordem arbitrária quando buscados em paralelo
+    with engine.bcb_lock:
+        month_rates = [
+            monthly_rate
+            for month_date, monthly_rate in sorted(engine.ipca_monthly.items())
+            if start_query <= month_date <= end_date
+        ]
+    if not month_rates:
+        log_and_print(f"Nenhum dado IPCA disponível entre {start_query} e {end_date}. Retornando 0.", level="warning")
+        return 0.0
+
+    accumulated = 1.0
+    for month_rate in month_rates:
+        accumulated *= (1 + month_rate)
+    return accumulated - 1  # retorna em decimal
+
+
+def prefetch_bcb_data_for_contracts(contracts: List[FixedIncomeContract], today: date) -> None:
+    """
+    Faz prefetch das séries do BCB para o maior intervalo necessário por indexador.
+    Isso reduz drasticamente o número de chamadas durante o processamento dos contratos.
+    """
+    # Todas as séries e blocos de uma vez, em paralelo; blocos que falharem são buscados de novo sob demanda
+    failed = fetch_bcb_series(bcb_windows_for_contracts(contracts, today))
+    if failed:
+        log_and_print(f"Prefetch do BCB incompleto para as séries {sorted(failed)}.", level="warning")
+
+def bcb_windows_for_contracts(contracts: List[FixedIncomeContract], today: date) -> List[Tuple[int, date, date]]:
+    """Janelas (série, início, fim) que cobrem os contratos: do aporte mais antigo ao fim mais tardio, por indexador."""
+    daily_windows: Dict[str, Tuple[date, date]] = {}
+    ipca_start: Optional[date] = None
+    ipca_end: Optional[date] = None
+
+    for contract in contracts:
+        contribution_date = contract.contribution_date
+        if contribution_date is None:
+            log_and_print(f"Contrato {contract.id} sem data de aporte. Pulando.", level="warning")
+            continue
+
+        due_date = contract.due_date
+        end_date_cap = min(today, due_date) if due_date else today
+        if contribution_date > end_date_cap:
+            continue
+
+        indexer = contract.indexer
+        if indexer in BCB_DAILY_SERIES_MAP:
+            current_window = daily_windows.get(indexer)
+            if current_window is None:
+                daily_windows[indexer] = (contribution_date, end_date_cap)
+            else:
+                cur_start, cur_end = current_window
+                daily_windows[indexer] = (
+                    min(cur_start, contribution_date),
+                    max(cur_end, end_date_cap),
+                )
+
+        ipca_query_start = contribution_date.replace(day=1)
+        ipca_start = ipca_query_start if ipca_start is None else min(ipca_start, ipca_query_start)
+        ipca_end = end_date_cap if ipca_end is None else max(ipca_end, end_date_cap)
+
+    windows = [
+        (BCB_DAILY_SERIES_MAP[indexer], range_start, range_end)
+        for indexer, (range_start, range_end) in daily_windows.items()
+    ]
+    if ipca_start is not None and ipca_end is not None:
+        windows.append((IPCA_SERIES_ID, ipca_start, ipca_end))
+    return windows
+
+def invalidate_bcb_cache_tail(daily_days: int = 7, ipca_days: int = 62) -> None:
+    """
+    Recua a cobertura dos blocos mais recentes do cache do BCB para que os últimos dias sejam buscados de novo.
+    O cache considera coberto todo o intervalo consultado, inclusive dias ainda não publicados;
+    em um processo residente, as taxas publicadas depois da consulta nunca seriam lidas.
+    """
+    with current_engine().bcb_lock:
+        _invalidate_bcb_coverage_tail(daily_days, ipca_days)
+
+def _invalidate_bcb_coverage_tail(daily_days: int, ipca_days: int) -> None:
+    for serie_id, coverage in current_engine().bcb_chunk_coverage.items():
+        if not coverage:
+            continue
+        days = ipca_days if serie_id == IPCA_SERIES_ID else daily_days
+        cutoff = max(coverage.values()) - timedelta(days=days)
+        for chunk_start, covered_until in list(coverage.items()):
+            if covered_until > cutoff:
+                if cutoff < chunk_start:
+                    del coverage[chunk_start]
+                else:
+                    coverage[chunk_start] = cutoff
+
+# ------------------ JOURNAL DE EXECUÇÃO ------------------
+
+class RunJournal:
+    """
+    Journal (write-ahead, JSONL) das escritas de um run, para retomar sem duplicar após uma queda do processo.
+    - plan(key, data) é gravado (com fsync) ANTES do efeito colateral; complete(key, result) depois dele.
+    - Uma chave planejada e não concluída indica que o efeito pode ou não ter chegado ao Notion:
+      o chamador reconcilia consultando o Notion antes de repetir.
+    - Estágios concluídos são registrados e pulados quando o mesmo run é retomado.
+    Um run sem `run_end` no arquivo é retomado pelo próximo begin_run(); um run encerrado é descartado.
+    Fora de um run (run_id None) o journal é inerte.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.run_id: Optional[str] = None
+        self.resumed = False
+        self._lock = threading.Lock()
+        self._planned: Dict[str, Any] = {}
+        self._done: Dict[str, Any] = {}
+        self._stages: set = set()
+
+    def _read_entries(self) -> List[dict]:
+        entries = []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Linha truncada por queda durante a escrita: a operação correspondente não foi confirmada.
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _append(self, entry: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def begin_run(self) -> None:
+        with self._lock:
+            entries = self._read_entries()
+            run_entries: List[dict] = []
+            open_run_id = None
+            for entry in entries:
+                if entry.get("type") == "run_start":
+                    open_run_id, run_entries = entry["run_id"], []
+                elif entry.get("type") == "run_end" and entry.get("run_id") == open_run_id:
+                    open_run_id, run_entries = None, []
+                elif open_run_id is not None and entry.get("run_id") == open_run_id:
+                    run_entries.append(entry)
+
+            self._planned, self._done, self._stages = {}, {}, set()
+            if open_run_id is not None:
+                self.run_id, self.resumed = open_run_id, True
+                for entry in run_entries:
+                    if entry["type"] == "planned":
+                        self._planned[entry["key"]] = entry.get("data")
+                    elif entry["type"] == "done":
+                        self._done[entry["key"]] = entry.get("result")
+                    elif entry["type"] == "stage_done":
+                        self._stages.add(entry["stage"])
+                log_and_print(
+                    f"Retomando run {self.run_id} interrompido: {len(self._stages)} estágios e "
+                    f"{len(self._done)} operações já concluídos."
+                )
+                return
+
+            # Run anterior encerrado: o journal é compactado e recomeça apenas com o novo run.
+            self.run_id, self.resumed = uuid.uuid4().hex, False
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"type": "run_start", "run_id": self.run_id, "ts": datetime.now().isoformat()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def end_run(self) -> None:
+        with self._lock:
+            if self.run_id is None:
+                return
+            self._append({"type": "run_end", "run_id": self.run_id, "ts": datetime.now().isoformat()})
+            self.run_id, self.resumed = None, False
+            self._planned, self._done, self._stages = {}, {}, set()
+
+    def stage_done(self, stage: str) -> bool:
+        return stage in self._stages
+
+    def mark_stage_done(self, stage: str) -> None:
+        with self._lock:
+            if self.run_id is None:
+                return
+            self._stages.add(stage)
+            self._append({"type": "stage_done", "run_id": self.run_id, "stage": stage})
+
+    def plan(self, key: str, data: Any = None) -> None:
+        with self._lock:
+            if self.run_id is None:
+                return
+            self._planned[key] = data
+            self._append({"type": "planned", "run_id": self.run_id, "key": key, "data": data})
+
+    def complete(self, key: str, result: Any = None) -> None:
+        with self._lock:
+            if self.run_id is None:
+                return
+            self._done[key] = result
+            self._append({"type": "done", "run_id": self.run_id, "key": key, "result": result})
+
+    def planned(self, key: str) -> Any:
+        """Dados do plano da chave (None se nunca planejada neste run)."""
+        return self._planned.get(key)
+
+    def is_planned(self, key: str) -> bool:
+        return key in self._planned
+
+    def is_done(self, key: str) -> bool:
+        return key in self._done
+
+    def result(self, key: str) -> Any:
+        return self._done.get(key)
+
+def run_stage(stage: str, func: Callable[[], Any]) -> None:
+    """Executa um estágio do run, pulando-o se já foi concluído no run retomado."""
+    journal = current_journal()
+    if journal.stage_done(stage):
+        log_and_print(f"Estágio '{stage}' já concluído neste run. Pulando.")
+        return
+    func()
+    # Um estágio interrompido por encerramento não é marcado: a retomada o executa de novo (pulando o que já foi feito).
+    if not current_engine().shutdown_event.is_set():
+        journal.mark_stage_done(stage)
+
+# ------------------ RESUMO DA CARTEIRA ------------------
+
+SUMMARY_SCOPES = ("total", "type", "indexer", "asset")
+
+def _summary_row_keys(position: dict) -> List[str]:
+    """Linhas do resumo afetadas por uma posição: total, tipo, indexador (renda fixa) e ativo."""
+    keys = ["total", f"type:{position['type']}"]
+    if position.get("indexer"):
+        keys.append(f"indexer:{position['indexer']}")
+    if position.get("asset"):
+        keys.append(f"asset:{position['asset']}")
+    return keys
+
+class PortfolioSummary:
+    """
+    Agregados da carteira (saldo, principal, variação e retorno real) por ativo, indexador, tipo e total,
+    mantidos localmente e gravados em um database de resumo do Notion (SUMMARY_DATABASE_ID).
+    - Posições: uma por contrato de renda fixa e por ativo de renda variável com quantidade, persistidas em JSON.
+    - Cada escrita de contrato ou preço atualiza a posição e ajusta as somas das linhas afetadas (delta);
+      as somas são reconstruídas a partir das posições ao carregar, sem acumular erro entre runs.
+    - flush() grava só as linhas cujos valores (arredondados) mudaram desde a última gravação.
+    Retorno real: saldo de cada contrato deflacionado pela inflação acumulada desde o aporte (FI_INFLATION).
+    """
+
+    def __init__(self, path: str, database_id: str):
+        self.path = path
+        self.database_id = database_id
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._positions: Dict[str, dict] = {}
+        self._rows: Dict[str, dict] = {}   # chave -> {"page_id": ..., "values": {...}} da última gravação
+        self._sums: Dict[str, Dict[str, float]] = {}
+        self._dirty: set = set()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self._positions = state.get("positions", {})
+            self._rows = state.get("rows", {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            log_and_print(f"Resumo da carteira ilegível ({e}); recomeçando do zero.", level="warning")
+        for position in self._positions.values():
+            self._apply(position, 1)
+
+    def _save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"positions": self._positions, "rows": self._rows}, f)
+        os.replace(tmp_path, self.path)
+
+    def _apply(self, position: dict, sign: int) -> None:
+        principal = position.get("principal")
+        for key in _summary_row_keys(position):
+            sums = self._sums.setdefault(key, {"balance": 0.0, "principal": 0.0, "priced_balance": 0.0, "deflated": 0.0, "positions": 0})
+            sums["balance"] += sign * position["balance"]
+            sums["positions"] += sign
+            if principal:
+                sums["principal"] += sign * principal
+                sums["priced_balance"] += sign * position["balance"]
+                sums["deflated"] += sign * position["deflated"]
+            self._dirty.add(key)
+
+    def _set_position(self, position_key: str, position: Optional[dict]) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            previous = self._positions.pop(position_key, None)
+            if previous is not None:
+                self._apply(previous, -1)
+            if position is not None:
+                self._positions[position_key] = position
+                self._apply(position, 1)
+
+    def record_contract(self, contract: FixedIncomeContract, balance: float, acc_ipca: float, closed: bool) -> None:
+        if closed:
+            self._set_position(f"fi:{contract.id}", None)
+            return
+        self._set_position(f"fi:{contract.id}", {
+            "type": "fixed_income",
+            "asset": contract.asset_id,
+            "indexer": contract.indexer,
+            "balance": balance,
+            "principal": contract.principal,
+            "deflated": balance / (1 + acc_ipca),
+        })
+
+    def observe_variable_income_asset(self, asset: VariableIncomeAsset, foreign: bool) -> None:
+        """Registra quantidade e moeda do ativo lido do Notion; ativos sem quantidade ficam fora do resumo."""
+        position_key = f"vi:{asset.id}"
+        with self._lock:
+            self._ensure_loaded()
+            previous = self._positions.get(position_key)
+        if not asset.quantity:
+            if previous is not None:
+                self._set_position(position_key, None)
+            return
+        unit_brl = previous.get("unit_brl") if previous else None
+        if not foreign and asset.unit_price is not None:
+            unit_brl = asset.unit_price
+        self._set_position(position_key, self._variable_income_position(asset.id, asset.quantity, foreign, unit_brl))
+
+    def record_price(self, page_id: str, price: float, brl_price: Optional[float]) -> None:
+        """Preço gravado no Notion: atualiza o valor da posição (ativos do exterior, pelo preço em BRL)."""
+        position_key = f"vi:{page_id}"
+        with self._lock:
+            self._ensure_loaded()
+            previous = self._positions.get(position_key)
+        if previous is None:
+            return
+        unit_brl = brl_price if previous["foreign"] else price
+        if unit_brl is None:
+            return
+        self._set_position(position_key, self._variable_income_position(page_id, previous["quantity"], previous["foreign"], unit_brl))
+
+    @staticmethod
+    def _variable_income_position(page_id: str, quantity: float, foreign: bool, unit_brl: Optional[float]) -> dict:
+        return {
+            "type": "variable_income",
+            "asset": page_id,
+            "indexer": None,
+            "balance": quantity * unit_brl if unit_brl is not None else 0.0,
+            "principal": None,
+            "deflated": 0.0,
+            "quantity": quantity,
+            "foreign": foreign,
+            "unit_brl": unit_brl,
+        }
+
+    def row_values(self, key: str) -> Optional[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            sums = self._sums.get(key)
+            if not sums or sums["positions"] <= 0:
+                return None
+            principal = sums["principal"]
+            return {
+                "balance": round(sums["balance"], 2),
+                "principal": round(principal, 2) if principal else None,
+                "variation": round(sums["priced_balance"] / principal - 1, 4) if principal else None,
+                "real_return": round(sums["deflated"] / principal - 1, 4) if principal else None,
+                "positions": sums["positions"],
+            }
+
+    def _existing_row_pages(self) -> Dict[str, str]:
+        """Linhas já presentes no database de resumo (título -> page id), para não duplicar após perda do estado."""
+        pages = get_all_pages_from_notion(self.database_id, properties=[SUM_NAME])
+        return {title: page["id"] for page in pages or [] if (title := extract_asset_name_from_title(page))}
+
+    def flush(self) -> int:
+        """Grava as linhas alteradas no Notion (PATCH, POST para linhas novas, arquivamento das esvaziadas) e salva o estado."""
+        with self._lock:
+            self._ensure_loaded()
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        existing: Optional[Dict[str, str]] = None
+        written = 0
+        for key in sorted(dirty):
+            values = self.row_values(key)
+            row = self._rows.get(key)
+            if row is not None and row.get("values") == values:
+                continue
+            page_id = row.get("page_id") if row else None
+            if page_id is None:
+                if values is None:
+                    continue
+                if existing is None:
+                    existing = self._existing_row_pages()
+                page_id = existing.get(key)
+            try:
+                if values is None:
+                    notion_request("PATCH", f"https://api.notion.com/v1/pages/{page_id}", json={"archived": True}, timeout=20).raise_for_status()
+                    self._rows.pop(key, None)
+                else:
+                    page_id = self._write_row(key, values, page_id)
+                    self._rows[key] = {"page_id": page_id, "values": values}
+                written += 1
+            except Exception as e:
+                log_and_print(f"Erro ao gravar linha '{key}' do resumo: {e}", level="error")
+                with self._lock:
+                    self._dirty.add(key)
+        with self._lock:
+            self._save()
+        return written
+
+    def _write_row(self, key: str, values: dict, page_id: Optional[str]) -> str:
+        properties = {
+            SUM_NAME: {"title": [{"text": {"content": key}}]},
+            SUM_SCOPE: {"select": {"name": key.split(":", 1)[0]}},
+            SUM_BALANCE: {"number": values["balance"]},
+            SUM_PRINCIPAL: {"number": values["principal"]},
+            SUM_VARIATION: {"number": values["variation"]},
+            SUM_REAL_RETURN: {"number": values["real_return"]},
+            SUM_POSITIONS: {"number": values["positions"]},
+            SUM_UPDATED_AT: {"date": {"start": datetime.now().isoformat()}},
+        }
+        if page_id is not None:
+            notion_request("PATCH", f"https://api.notion.com/v1/pages/{page_id}", json={"properties": properties}, timeout=20).raise_for_status()
+            return page_id
+        response = notion_request(
+            "POST", "https://api.notion.com/v1/pages",
+            json={"parent": {"database_id": self.database_id}, "properties": properties}, timeout=20,
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+def flush_portfolio_summary() -> None:
+    """Grava no database de resumo as linhas da carteira atual que mudaram no run."""
+    summary = current_portfolio().summary
+    if summary is None:
+        return
+    try:
+        written = summary.flush()
+        if written:
+            log_and_print(f"Resumo da carteira: {written} linhas atualizadas.")
+    except Exception as e:
+        log_and_print(f"Erro ao gravar o resumo da carteira: {e}", level="error")
+
+# ------------------ SNAPSHOT DE CONSULTA ------------------
+
+class QuerySnapshot:
+    """
+    Último estado gravado no Notion pelo updater (preços de renda variável, saldos de contratos e suas alocações),
+    servido pela API local de consulta (ver start_query_api) sem tráfego com o Notion.
+    - Atualizado nas mesmas escritas que alimentam o Notion; salvo em JSON ao fim de cada run (QUERY_SNAPSHOT_FILE),
+      junto com as taxas do BCB em cache, para que `--serve` em outro processo sirva o último run.
+    - `version` muda a cada alteração e identifica o conteúdo nas respostas condicionais (ETag).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._mtime: Optional[float] = None
+        self._changed = False
+        self.version = 0
+        self.prices: Dict[str, dict] = {}
+        self.contracts: Dict[str, dict] = {}
+        self.allocations: Dict[str, List[dict]] = {}
+        self.rates: Dict[str, Dict[str, float]] = {}
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            log_and_print(f"Snapshot de consulta ilegível ({e}); recomeçando do zero.", level="warning")
+            return
+        self.prices = state.get("prices", {})
+        self.contracts = state.get("contracts", {})
+        self.allocations = state.get("allocations", {})
+        self.rates = state.get("rates", {})
+        self.version += 1
+
+    def reload_if_changed(self) -> None:
+        """Relê o arquivo se outro processo (o updater) o regravou; usado pelo modo `--serve`."""
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load()
+                return
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._load()
+
+    def _touch(self) -> None:
+        self.version += 1
+        self._changed = True
+
+    def observe_variable_income_asset(self, asset: VariableIncomeAsset, foreign: bool) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self.prices.setdefault(asset.id, {"price": asset.unit_price, "brl_price": None, "updated_at": None})
+            if entry.get("ticker") == asset.ticker and entry.get("currency") == asset.currency and entry.get("foreign") == foreign:
+                return
+            entry.update(ticker=asset.ticker, currency=asset.currency, foreign=foreign)
+            self._touch()
+
+    def record_price(self, page_id: str, price: float, brl_price: Optional[float]) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self.prices.setdefault(page_id, {"ticker": None, "currency": None, "foreign": brl_price is not None})
+            entry.update(price=price, brl_price=brl_price, updated_at=datetime.now().isoformat(timespec="seconds"))
+            self._touch()
+
+    def record_contract(self, contract: FixedIncomeContract, acc_ipca: float,
+                        allocations: Optional[List[WithdrawalAllocation]] = None) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self.contracts[contract.id] = {
+                "asset": contract.asset_id,
+                "indexer": contract.indexer,
+                "indexer_pct": contract.indexer_pct,
+                "fixed_rate": contract.fixed_rate,
+                "contribution_date": contract.contribution_date.isoformat() if contract.contribution_date else None,
+                "due_date": contract.due_date.isoformat() if contract.due_date else None,
+                "principal": contract.principal,
+                "balance": contract.balance,
+                "inflation": round(acc_ipca, 4),
+                "last_rate_date": contract.last_rate_date.isoformat() if contract.last_rate_date else None,
+                "last_update": contract.last_update.isoformat() if contract.last_update else None,
+                "closed": contract.closed,
+            }
+            if allocations is not None:
+                self.allocations[contract.id] = [
+                    {
+                        "id": alloc.id,
+                        "withdrawal": alloc.withdrawal_id,
+                        "amount": alloc.amount,
+                        "date": alloc.date.isoformat() if alloc.date else None,
+                    }
+                    for alloc in allocations
+                ]
+            self._touch()
+
+    def save(self) -> None:
+        """Grava o snapshot (com as taxas do BCB em cache) se algo mudou desde a última gravação."""
+        engine = current_engine()
+        with engine.bcb_lock:
+            rates = {label: {day.isoformat(): rate for day, rate in cache.items()} for label, cache in engine.bcb_daily_rates.items()}
+            if engine.ipca_monthly:
+                rates["IPCA"] = {day.isoformat(): rate for day, rate in engine.ipca_monthly.items()}
+        with self._lock:
+            self._ensure_loaded()
+            for label, series in rates.items():
+                stored = self.rates.setdefault(label, {})
+                if any(stored.get(day) != rate for day, rate in series.items()):
+                    stored.update(series)
+                    self._touch()
+            if not self._changed:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"prices": self.prices, "contracts": self.contracts, "allocations": self.allocations, "rates": self.rates}, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+            self._changed = False
+
+    def query(self, resource: str, params: Dict[str, str]) -> Optional[Any]:
+        """Conteúdo de um recurso da API (prices, contracts, allocations, rates), filtrado pelos parâmetros; None se desconhecido."""
+        with self._lock:
+            self._ensure_loaded()
+            asset = params.get("asset")
+            if resource == "prices":
+                return [
+                    {"page_id": page_id, **entry} for page_id, entry in self.prices.items()
+                    if not asset or asset in (page_id, entry.get("ticker"))
+                ]
+            if resource == "contracts":
+                include_closed = params.get("include_closed") == "1"
+                return [
+                    {"id": contract_id, **entry} for contract_id, entry in self.contracts.items()
+                    if (not asset or entry["asset"] == asset) and (include_closed or not entry["closed"])
+                ]
+            if resource == "allocations":
+                contract_filter = params.get("contract")
+                return [
+                    {"contract": contract_id, "asset": self.contracts.get(contract_id, {}).get("asset"), **alloc}
+                    for contract_id, allocations in self.allocations.items()
+                    if (not contract_filter or contract_id == contract_filter)
+                    and (not asset or self.contracts.get(contract_id, {}).get("asset") == asset)
+                    for alloc in allocations
+                ]
+            if resource == "rates":
+                labels = [params["series"].upper()] if params.get("series") else sorted(self.rates)
+                start, end = params.get("start", ""), params.get("end", "9999-12-31")
+                return {
+                    label: {day: rate for day, rate in sorted(self.rates.get(label, {}).items()) if start <= day <= end}
+                    for label in labels
+                }
+            return None
+
+# ------------------ CARTEIRAS (MULTI-TENANT) ------------------
+
+@dataclass
+class Portfolio:
+    """
+    Carteira (tenant): token do Notion, databases e o estado do run que pertence só a ela
+    (journal, join local de renda fixa, estatísticas de payload).
+    Dados independentes de carteira (BCB, IPCA, cotações, câmbio, cota das APIs) ficam nos caches do Engine
+    e são compartilhados entre as carteiras que ele processa.
+    """
+    name: str
+    notion_token: Optional[str]
+    vi_assets_database_id: Optional[str] = None
+    vi_foreign_assets_database_id: Optional[str] = None
+    fi_contracts_database_id: Optional[str] = None
+    fi_contributions_database_id: Optional[str] = None
+    fi_assets_database_id: Optional[str] = None
+    fi_withdrawals_database_id: Optional[str] = None
+    fi_allocations_database_id: Optional[str] = None
+    run_journal_file: Optional[str] = None
+    fi_history_file: Optional[str] = None
+    summary_database_id: Optional[str] = None
+    summary_state_file: Optional[str] = None
+    query_snapshot_file: Optional[str] = None
+    notion_headers: Dict[str, str] = field(init=False)
+    rate_limiter: NotionRateLimiter = field(init=False)
+    journal: RunJournal = field(init=False)
+    # Agregados da carteira, com summary_database_id (ver PortfolioSummary)
+    summary: Optional[PortfolioSummary] = field(init=False, default=None)
+    # Último estado gravado, servido pela API local de consulta
+    query_snapshot: QuerySnapshot = field(init=False)
+    # Join local de renda fixa: ativos e aportes por page id (substitui os rollups dos contratos)
+    fi_assets_by_id: Dict[str, FixedIncomeAsset] = field(init=False, default_factory=dict)
+    fi_contributions_by_id: Dict[str, FixedIncomeContribution] = field(init=False, default_factory=dict)
+    # Bytes recebidos por database e propriedades projetadas, para o relatório de payload
+    payload_stats: Dict[str, Dict[str, int]] = field(init=False, default_factory=dict)
+    # (database, projeção) -> bytes por página com e sem projeção, amostrados uma vez por processo
+    payload_samples: Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]] = field(init=False, default_factory=dict)
+    projected_properties: Dict[str, List[str]] = field(init=False, default_factory=dict)
+    reference_loaded_at: Optional[float] = field(init=False, default=None)
+    # Tickers deixados para o próximo run pelo --auto-scale
+    skip_tickers: set = field(init=False, default_factory=set)
+
+    def __post_init__(self):
+        # Arquivos não informados: os da configuração do Engine ativo
+        config = current_config()
+        for name in ("run_journal_file", "fi_history_file", "summary_state_file", "query_snapshot_file"):
+            if getattr(self, name) is None:
+                setattr(self, name, getattr(config, name))
+        self.notion_headers = {
+            "Authorization": f"Bearer {self.notion_token}",
+            "Notion-Version": "2022-06-28",
+            "Content-Type": "application/json"
+        }
+        self.rate_limiter = notion_rate_limiter(self.notion_token)
+        self.journal = RunJournal(self.run_journal_file)
+        if self.summary_database_id:
+            self.summary = PortfolioSummary(self.summary_state_file, self.summary_database_id)
+        self.query_snapshot = QuerySnapshot(self.query_snapshot_file)
+
+def env_portfolio(config: EngineConfig) -> Portfolio:
+    """Carteira única da configuração (modo padrão, sem PORTFOLIOS_FILE)."""
+    return Portfolio(
+        name="",
+        notion_token=config.notion_token,
+        vi_assets_database_id=config.vi_assets_database_id,
+        vi_foreign_assets_database_id=config.vi_foreign_assets_database_id,
+        fi_contracts_database_id=config.fi_contracts_database_id,
+        fi_contributions_database_id=config.fi_contributions_database_id,
+        fi_assets_database_id=config.fi_assets_database_id,
+        fi_withdrawals_database_id=config.fi_withdrawals_database_id,
+        fi_allocations_database_id=config.fi_allocations_database_id,
+        summary_database_id=config.summary_database_id,
+    )
+
+def current_portfolio() -> Portfolio:
+    return _current_portfolio.get(None) or current_engine().env_portfolio
+
+def current_journal():
+    """Journal das escritas em andamento: o do job da fila (modo worker) ou o do run da carteira."""
+    return _current_job_journal.get(None) or current_portfolio().journal
+
+@contextmanager
+def use_portfolio(portfolio: Portfolio) -> Iterator[Portfolio]:
+    token = _current_portfolio.set(portfolio)
+    try:
+        yield portfolio
+    finally:
+        _current_portfolio.reset(token)
+
+def load_portfolios(path: str) -> List[Portfolio]:
+    """
+    Lê a lista de carteiras de um arquivo JSON:
+    [{"name": "ana", "notion_token": "...", "vi_assets_database_id": "...", "fi_contracts_database_id": "...", ...}, ...]
+    Journal, histórico, resumo e snapshot são separados por carteira (run_journal.<name>.jsonl,
+    fi_history.<name>.bin, portfolio_summary.<name>.json, query_snapshot.<name>.json),
+    salvo se informados.
+    """
+    config = current_config()
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} deve conter uma lista não vazia de carteiras.")
+
+    portfolios = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name")
+        if not name or not entry.get("notion_token"):
+            raise ValueError(f"Carteira sem 'name' ou 'notion_token' em {path}.")
+        if name in names:
+            raise ValueError(f"Carteira '{name}' repetida em {path}.")
+        names.add(name)
+        entry = dict(entry)
+        journal_root, journal_ext = os.path.splitext(config.run_journal_file)
+        history_root, history_ext = os.path.splitext(config.fi_history_file)
+        summary_root, summary_ext = os.path.splitext(config.summary_state_file)
+        snapshot_root, snapshot_ext = os.path.splitext(config.query_snapshot_file)
+        entry.setdefault("run_journal_file", f"{journal_root}.{name}{journal_ext}")
+        entry.setdefault("fi_history_file", f"{history_root}.{name}{history_ext}")
+        entry.setdefault("summary_state_file", f"{summary_root}.{name}{summary_ext}")
+        entry.setdefault("query_snapshot_file", f"{snapshot_root}.{name}{snapshot_ext}")
+        portfolios.append(Portfolio(**entry))
+    return portfolios
+
+def get_portfolios() -> List[Portfolio]:
+    """Carteiras do PORTFOLIOS_FILE, carregadas uma vez por Engine (o daemon reaproveita journal e estado)."""
+    engine = current_engine()
+    with engine.portfolios_lock:
+        if engine.portfolios is None:
+            engine.portfolios = load_portfolios(engine.config.portfolios_file)
+        return engine.portfolios
+
+def all_portfolios() -> List[Portfolio]:
+    """Carteiras do PORTFOLIOS_FILE ou, sem ele, a carteira do .env."""
+    return get_portfolios() if current_config().portfolios_file else [current_engine().env_portfolio]
+
+def run_portfolios(portfolios: List[Portfolio], task: Callable[[], Any]) -> None:
+    """
+    Executa `task` para cada carteira, em paralelo (PORTFOLIO_WORKERS), cada uma em seu próprio contexto.
+    Cotações buscadas durante a chamada valem para todas as carteiras (uma busca por ticker único).
+    """
+    engine = current_engine()
+    engine.quote_fresh_since = time.monotonic()
+
+    def run_one(portfolio: Portfolio) -> None:
+        _current_portfolio.set(portfolio)
+        task()
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(engine.config.portfolio_workers, len(portfolios)), thread_name_prefix="portfolio") as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, run_one, portfolio): portfolio
+                for portfolio in portfolios
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    log_and_print(f"Erro na carteira {futures[future].name}: {e}", level="error")
+    finally:
+        engine.quote_fresh_since = None
+
+def for_each_portfolio(task: Callable[[], Any]) -> None:
+    """Executa `task` para a carteira do .env ou, com PORTFOLIOS_FILE, para todas as carteiras em paralelo."""
+    if current_config().portfolios_file:
+        run_portfolios(get_portfolios(), task)
+    else:
+        task()
+
+# ------------------ REPOSITÓRIO DO RUN (IDENTITY MAP) ------------------
+
+class RunRepository:
+    """
+    Identity map da cadeia de renda fixa de um run: um único objeto por page id para contratos e alocações.
+    Os estágios seguintes leem daqui em vez de consultar o Notion de novo, e as criações e PATCHes do próprio run
+    atualizam os objetos no lugar (ex.: o saldo de um contrato já reduzido por um saque anterior do mesmo ativo).
+    Cada coleção é consultada no máximo uma vez por run; só páginas ainda não vistas são buscadas.
+    """
+
+    def __init__(self):
+        self.contracts: Dict[str, FixedIncomeContract] = {}
+        self._lock = threading.RLock()
+        self._reference_loaded = False
+        self._all_contracts_loaded = False
+        self._open_contracts_loaded = False
+        self._allocations_by_contract: Optional[Dict[str, List[WithdrawalAllocation]]] = None
+        self._allocation_ids: set = set()
+
+    def ensure_reference_data(self) -> bool:
+        """Ativos e aportes da carteira, carregados uma vez por run."""
+        with self._lock:
+            if not self._reference_loaded:
+                self._reference_loaded = load_fixed_income_reference_data()
+            return self._reference_loaded
+
+    def merge_contract(self, contract: FixedIncomeContract) -> FixedIncomeContract:
+        """Registra o contrato lido do Notion; se já está no mapa, devolve o objeto do run (com as escritas aplicadas)."""
+        with self._lock:
+            return self.contracts.setdefault(contract.id, contract)
+
+    def _load_contracts(self, filter_payload: Optional[dict]) -> None:
+        """
+        Traz os contratos do Notion para o mapa. Uma consulta que falha levanta RuntimeError em vez de parecer
+        "nenhum contrato": o estágio não é marcado como concluído e o run é retomado pelo journal.
+        """
+        try:
+            contracts = list(iter_pages_from_notion(
+                current_portfolio().fi_contracts_database_id,
+                filter_payload,
+                record_parser=parse_fixed_income_contract,
+                properties=FI_CONTRACT_PROPERTIES,
+            ))
+        except Exception as e:
+            log_and_print(f"Erro ao carregar contratos de renda fixa: {e}", level="error")
+            raise RuntimeError("Não foi possível carregar os contratos de renda fixa.") from e
+        for contract in contracts:
+            self.merge_contract(contract)
+
+    def all_contracts(self) -> List[FixedIncomeContract]:
+        with self._lock:
+            if not self._all_contracts_loaded:
+                self._load_contracts(None)
+                self._all_contracts_loaded = True
+            return list(self.contracts.values())
+
+    def open_contracts(self) -> List[FixedIncomeContract]:
+        """Contratos abertos com aporte (mesmo critério de OPEN_CONTRACTS_FILTER), em ordem de data de aporte."""
+        with self._lock:
+            if not self._all_contracts_loaded and not self._open_contracts_loaded:
+                self._load_contracts(OPEN_CONTRACTS_FILTER)
+                self._open_contracts_loaded = True
+            contracts = [c for c in self.contracts.values() if not c.closed and c.contribution_id]
+        contracts.sort(key=lambda c: c.contribution_date or date.min)
+        return contracts
+
+    def contracts_for_asset_lifo(self, asset_id: str) -> List[FixedIncomeContract]:
+        """Contratos do ativo por data de aporte e ID decrescentes (LIFO), como get_contracts_lifo_for_asset."""
+        contracts = [contract for contract in self.all_contracts() if contract.asset_id == asset_id]
+        contracts.sort(key=lambda c: (c.contribution_date or date.min, c.unique_id or 0), reverse=True)
+        return contracts
+
+    def allocations_by_contract(self) -> Dict[str, List[WithdrawalAllocation]]:
+        with self._lock:
+            if self._allocations_by_contract is None:
+                self._allocations_by_contract = get_all_allocations_by_contract()
+                self._allocation_ids = {
+                    alloc.id for allocations in self._allocations_by_contract.values() for alloc in allocations
+                }
+            return self._allocations_by_contract
+
+    def allocations_for_contract(self, contract_id: str) -> List[WithdrawalAllocation]:
+        return list(self.allocations_by_contract().get(contract_id, []))
+
+    def record_allocation(self, allocation: WithdrawalAllocation) -> None:
+        """Alocação criada (ou confirmada) no run: entra no mapa e reduz o saldo em memória do contrato."""
+        with self._lock:
+            by_contract = self.allocations_by_contract()
+            if allocation.id not in self._allocation_ids:
+                self._allocation_ids.add(allocation.id)
+                allocations = by_contract.setdefault(allocation.contract_id, [])
+                allocations.append(allocation)
+                allocations.sort(key=lambda alloc: alloc.date)
+            # O saldo no Notion só reflete o saque após o estágio de contratos; até lá, o mapa desconta a alocação
+            contract = self.contracts.get(allocation.contract_id)
+            if contract is not None:
+                contract.balance = max(0.0, round(contract.balance - allocation.amount, 2))
+
+def current_repository() -> Optional[RunRepository]:
+    return _current_repository.get(None)
+
+@contextmanager
+def run_repository() -> Iterator[RunRepository]:
+    """Abre um identity map para a cadeia de renda fixa no contexto atual (fora dele, cada estágio consulta o Notion)."""
+    repository = RunRepository()
+    token = _current_repository.set(repository)
+    try:
+        yield repository
+    finally:
+        _current_repository.reset(token)
+
+# ---------------- FUNÇÕES RENDA FIXA -------------------
+
+def compound_balance_period(
+    balance: float,
+    start_date: date,
+    end_date: date,
+    indexer: str,
+    indexer_pct: float,
+    fixed_rate: float,
+) -> Optional[Tuple[float, date]]:
+    """
+    Aplica juros compostos ao saldo em um período [start_date, end_date] (ambos inclusivos).
+    Retorna (novo_saldo, last_rate_date). Retorna None se não houver dados de taxa (ex.: SELIC/CDI vazios).
+    start_date == end_date aplica um único dia útil (quando houver cotação no BCB); se for fim de semana/sem série, mantém o saldo.
+    """
+    if start_date > end_date:
+        return (balance, start_date)
+    new_balance = balance
+    last_rate_date = start_date
+    if indexer in ("SELIC", "CDI"):
+        rates = get_bcb_daily_rates(indexer, start_date, end_date)
+        if not rates:
+            if start_date == end_date:
+                return (balance, start_date)
+            log_and_print(f"Pulando período: {indexer} entre {start_date} e {end_date}.", level="warning")
+            return (balance, start_date)
+        
+        # BCB já retorna apenas dias úteis, então não filtramos fins de semana/feriados aqui
+        for rate_date in sorted(rates.keys()):
+            annual_rate = rates[rate_date]
+            effective_annual_rate = (annual_rate * indexer_pct) + fixed_rate
+            daily_factor = (1 + effective_annual_rate) ** (1 / BUSY_DAYS_IN_YEAR)
+            new_balance *= daily_factor
+            last_rate_date = rate_date
+    elif indexer == "IPCA":
+        acc_ipca = get_accumulated_ipca(start_date, end_date)
+        interval_workdays = get_net_workdays(start_date, end_date)
+        real_factor = (1 + fixed_rate) ** (interval_workdays / BUSY_DAYS_IN_YEAR)
+        factor = (1 + acc_ipca) * real_factor
+        new_balance *= factor
+        last_rate_date = end_date
+    else:
+        log_and_print(f"Indexador desconhecido: {indexer}", level="warning")
+        return None
+    return (new_balance, last_rate_date)
+
+
+def recompute_contract_balance_from_timeline(
+    contract: FixedIncomeContract,
+    indexer: str,
+    indexer_pct: float,
+    fixed_rate: float,
+    due_date: Optional[date],
+    today: date,
+    allocations: Optional[List[WithdrawalAllocation]] = None,
+) -> Optional[Tuple[float, date, date, float]]:
+    """
+    Recalcula o saldo do contrato a partir da timeline: aporte inicial + saques em ordem cronológica.
+    Convenção: compõe juros até a data do saque (inclusive) e só então subtrai o valor.
+    Após o saque, o próximo período começa no dia seguinte ao saque.
+    Juros só são compostos até min(today, due_date); após vencimento, apenas deduz saques (sem novos juros).
+    Retorna (novo_saldo, last_rate_date, end_date, acc_ipca) ou None se não for possível (ex.: sem aporte).
+    """
+    if not contract.contribution_id:
+        log_and_print(f"O contrato {contract.id} não tem aporte vinculado. Pulando.", level="warning")
+        return None
+
+    if contract.contribution_date is None:
+        log_and_print(f"O contrato {contract.id} não tem data de aporte. Pulando.", level="warning")
+        return None
+
+    if contract.principal is None:
+        log_and_print(f"O contrato {contract.id} não tem valor de aporte. Pulando.", level="warning")
+        return None
+
+    contribution_date = contract.contribution_date
+    contribution_amount = contract.principal
+    if allocations is None:
+        allocations = get_allocations_for_contract(contract.id)
+    balance = contribution_amount
+    last_date = contribution_date
+    last_rate_date = contribution_date
+    compounding_end = min(today, due_date) if due_date else today
+    timeline_end = today
+
+    # Períodos: juros até a data do saque (inclusive), depois deduz saque, próximo período começa no dia seguinte.
+    post_due_mode = False  # quando True: subtrai saques sem mais compor juros
+    for alloc in allocations:
+        event_date = alloc.date
+        if event_date > timeline_end:
+            break
+
+        if not post_due_mode:
+            if event_date <= compounding_end:
+                # Juros até a data do saque (inclusive) e então subtrai.
+                period_end = event_date
+                if last_date <= period_end:
+                    result = compound_balance_period(
+                        balance,
+                        last_date,
+                        period_end,
+                        indexer,
+                        indexer_pct,
+                        fixed_rate,
+                    )
+                    if result is None:
+                        return None
+                    balance, last_rate_date = result
+
+                balance = max(0.0, balance - alloc.amount)
+                if balance <= 0:
+                    break
+
+                # Próximo período começa no dia seguinte ao saque.
+                last_date = event_date + timedelta(days=1)
+            else:
+                # Primeiro saque após expiração: compor uma única vez até `due_date`,
+                # depois aplicar saques como dedução (sem mais juros).
+                if last_date <= compounding_end:
+                    result = compound_balance_period(
+                        balance,
+                        last_date,
+                        compounding_end,
+                        indexer,
+                        indexer_pct,
+                        fixed_rate,
+                    )
+                    if result is None:
+                        return None
+                    balance, last_rate_date = result
+                last_date = compounding_end + timedelta(days=1)
+                post_due_mode = True
+
+                balance = max(0.0, balance - alloc.amount)
+                if balance <= 0:
+                    break
+        else:
+            # Após vencimento: apenas deduz saques.
+            balance = max(0.0, balance - alloc.amount)
+            if balance <= 0:
+                break
+
+    # Último período de juros: até min(today, due_date)
+    if balance > 0 and not post_due_mode and last_date <= compounding_end:
+        result = compound_balance_period(
+            balance, last_date, compounding_end, indexer, indexer_pct, fixed_rate
+        )
+        if result is None:
+            return None
+        balance, last_rate_date = result
+    acc_ipca = get_accumulated_ipca(contribution_date, compounding_end)
+    return (balance, last_rate_date, timeline_end, acc_ipca)
+
+
+def update_fixed_income_contracts():
+    engine = current_engine()
+    if current_portfolio().fi_contracts_database_id is None:
+        log_and_print("FI_CONTRACTS_DATABASE_ID não definido. Pulando renda fixa.", level="warning")
+        return
+    
+    log_and_print("Atualizando contratos de renda fixa...")
+
+    today = date.today()
+    repository = current_repository()
+    loaded = repository.ensure_reference_data() if repository is not None else load_fixed_income_reference_data()
+    if not loaded:
+        log_and_print("Sem ativos/aportes de referência. Pulando renda fixa.", level="warning")
+        return
+
+    filter_payload = OPEN_CONTRACTS_FILTER
+    if engine.run_deadline is not None:
+        update_fixed_income_contracts_prioritized(filter_payload, today, engine.run_deadline)
+        return
+    if current_config().fi_batch_engine:
+        if np is not None:
+            update_fixed_income_contracts_batch(filter_payload, today)
+            return
+        log_and_print("FI_BATCH_ENGINE requer o pacote numpy. Usando o cálculo por contrato.", level="warning")
+    if repository is not None:
+        # Lista fixa do identity map (contratos lidos ou criados pelos estágios anteriores)
+        contracts = repository.open_contracts()
+        if not contracts:
+            log_and_print("Nenhum contrato de renda fixa encontrado.", level="warning")
+            return
+        prefetch_bcb_data_for_contracts(contracts, today)
+        for contract in contracts:
+            if engine.shutdown_event.is_set():
+                log_and_print("Encerramento solicitado. Interrompendo atualização de renda fixa.", level="warning")
+                return
+            update_fixed_income_contract(contract, today)
+        return
+
+    # Ordenado por data de aporte: o primeiro lote já determina o início das janelas do BCB,
+    # e os lotes seguintes só estendem o cache quando aparece um indexador novo.
+    sorts = [{"property": FI_CONTRIBUTION_DATE, "direction": "ascending"}]
+    attempted: set = set()
+    while True:
+        new_in_pass = 0
+        closed_in_pass = False
+        try:
+            for batch in iter_page_batches_from_notion(
+                current_portfolio().fi_contracts_database_id,
+                filter_payload=filter_payload,
+                sorts=sorts,
+                record_parser=parse_fixed_income_contract,
+                properties=FI_CONTRACT_PROPERTIES,
+            ):
+                batch = [contract for contract in batch if contract.id not in attempted]
+                prefetch_bcb_data_for_contracts(batch, today)
+
+                for contract in batch:
+                    if engine.shutdown_event.is_set():
+                        log_and_print("Encerramento solicitado. Interrompendo atualização de renda fixa.", level="warning")
+                        return
+
+                    attempted.add(contract.id)
+                    new_in_pass += 1
+                    if update_fixed_income_contract(contract, today):
+                        closed_in_pass = True
+        except Exception as e:
+            log_and_print(f"Erro ao buscar dados do Notion: {e}", level='error')
+            return
+
+        if not attempted:
+            log_and_print("Nenhum contrato de renda fixa encontrado.", level="warning")
+            return
+        # Contratos fechados saem do filtro durante a paginação e podem deslocar o cursor;
+        # uma nova passada recolhe contratos eventualmente pulados.
+        if not closed_in_pass or not new_in_pass:
+            return
+
+def get_open_fixed_income_contracts(filter_payload: dict) -> List[FixedIncomeContract]:
+    """Contratos abertos: do identity map do run, se houver, ou de uma consulta paginada."""
+    repository = current_repository()
+    if repository is not None:
+        return repository.open_contracts()
+    return get_all_pages_from_notion(
+        current_portfolio().fi_contracts_database_id,
+        filter_payload,
+        record_parser=parse_fixed_income_contract,
+        properties=FI_CONTRACT_PROPERTIES,
+    )
+
+def update_fixed_income_contracts_prioritized(filter_payload: dict, today: date, deadline: RefreshDeadline):
+    """
+    Modo --time-budget: lê todos os contratos abertos, ordena pela idade de FI_LAST_RATE_DATE
+    (mais defasado primeiro) e atualiza até o prazo. Lista fixa: não há cursor a ser deslocado por fechamentos.
+    """
+    contracts = get_open_fixed_income_contracts(filter_payload)
+    if not contracts:
+        log_and_print("Nenhum contrato de renda fixa encontrado.", level="warning")
+        return
+    contracts.sort(key=fixed_income_priority)
+    prefetch_bcb_data_for_contracts(contracts, today)
+
+    for done, contract in enumerate(contracts):
+        if current_engine().shutdown_event.is_set():
+            log_and_print("Encerramento solicitado. Interrompendo atualização de renda fixa.", level="warning")
+            return
+        if deadline.should_stop("fi"):
+            log_and_print(
+                f"Renda fixa interrompida (prazo) após {done} de {len(contracts)} contratos e "
+                f"{deadline.elapsed():.0f}s; os demais ficam para o próximo run.",
+                level="warning"
+            )
+            return
+        started = time.monotonic()
+        update_fixed_income_contract(contract, today)
+        deadline.record("fi", time.monotonic() - started)
+
+@dataclass(slots=True)
+class ContractUpdate:
+    """
+    Novo estado de um contrato, calculado antes da escrita no Notion.
+    period_start: início do período ainda a compor (contratos sem saques); None quando não há período a compor.
+    zeroed: contrato com saldo já zerado, fechado sem recalcular.
+    fingerprint: hash das entradas de preço (contract_pricing_fingerprint), gravado junto com o saldo.
+    """
+    previous_balance: float
+    balance: float
+    last_rate_date: date
+    end_date: date
+    acc_ipca: float
+    timeline: bool = False
+    zeroed: bool = False
+    period_start: Optional[date] = None
+    fingerprint: Optional[str] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.zeroed or self.balance <= 0
+
+def plan_contract_update(
+    contract: FixedIncomeContract, today: date, allocations: List[WithdrawalAllocation]
+) -> Optional[ContractUpdate]:
+    """
+    Tudo o que antecede a composição de juros: validações, timeline de contratos com saques e o período
+    a compor dos demais (period_start..end_date). Retorna None se o contrato deve ser pulado.
+    Contratos sem saques também refazem a timeline quando a impressão digital das entradas de preço
+    (aporte, indexador, taxas, vencimento) difere da gravada no último cálculo.
+    """
+    contract_id = contract.id
+    # Indexadores
+    indexer = contract.indexer
+    if not indexer:
+        log_and_print(f"Contrato {contract_id} sem indexador. Pulando.")
+        return None
+
+    indexer_pct = contract.indexer_pct
+    fixed_rate = contract.fixed_rate
+
+    # Datas
+    contribution_date = contract.contribution_date
+    if contribution_date is None:
+        log_and_print(f"Contrato {contract_id} sem data de aporte. Pulando.")
+        return None
+    due_date = contract.due_date
+
+    end_date_cap = min(today, due_date) if due_date else today
+
+    fingerprint = contract_pricing_fingerprint(contract, allocations) if contract_fingerprint_enabled() else None
+    # Sem impressão gravada (contrato anterior à propriedade), o caminho incremental apenas passa a gravá-la.
+    inputs_changed = contract.pricing_fingerprint is not None and contract.pricing_fingerprint != fingerprint
+    if inputs_changed and not allocations:
+        log_and_print(f"Entradas de preço do contrato {contract_id} mudaram. Recalculando pela timeline.")
+
+    # Se o contrato tem alocações (saques) ou entradas alteradas, recalcular saldo pela timeline (histórico cronológico)
+    if allocations or inputs_changed:
+        result = recompute_contract_balance_from_timeline(
+            contract, indexer, indexer_pct, fixed_rate, due_date, today, allocations=allocations
+        )
+        if result is None:
+            log_and_print(f"Contrato {contract_id} sem aporte vinculado para recalcular a timeline. Pulando.", level="warning")
+            return None
+        new_balance, last_rate_date, end_date, acc_ipca = result
+        return ContractUpdate(
+            contract.balance, new_balance, last_rate_date, end_date, acc_ipca, timeline=True, fingerprint=fingerprint
+        )
+
+    # Contrato sem saques: compõe apenas o período ainda não processado.
+    # Para SELIC/CDI, o início deve ser a próxima data após a última taxa aplicada.
+    # FI_LAST_UPDATE permanece apenas como informação de quando o script rodou.
+    last_update_date = contract.last_update
+    last_rate_date = contract.last_rate_date or contribution_date
+
+    if last_rate_date > end_date_cap:
+        last_rate_date = end_date_cap
+
+    next_rate_start = last_rate_date
+    if contract.last_rate_date is not None:
+        next_rate_start = last_rate_date + timedelta(days=1)
+
+    if indexer in ("SELIC", "CDI"):
+        start_date = max(contribution_date, next_rate_start)
+    else:
+        # Para indexadores sem defasagem diária, mantém referência em Last Update.
+        start_date = last_update_date if last_update_date else contribution_date
+        start_date = max(contribution_date, start_date)
+
+    end_date = end_date_cap
+
+    balance = contract.balance
+    if balance <= 0:
+        return ContractUpdate(balance, 0.0, last_rate_date, end_date, 0.0, zeroed=True)
+
+    period_start = None
+    if start_date >= end_date:
+        log_and_print(f"Contrato {contract_id} vencido ou sem período para calcular.")
+    else:
+        period_start = start_date
+    acc_ipca = get_accumulated_ipca(contribution_date, end_date)
+    return ContractUpdate(
+        balance, balance, last_rate_date, end_date, acc_ipca, period_start=period_start, fingerprint=fingerprint
+    )
+
+def compute_contract_update(
+    contract: FixedIncomeContract, today: date, allocations: List[WithdrawalAllocation]
+) -> Optional[ContractUpdate]:
+    """Caminho por contrato: plano + composição do período com compound_balance_period."""
+    update = plan_contract_update(contract, today, allocations)
+    if update is None or update.period_start is None:
+        return update
+    result = compound_balance_period(
+        update.balance, update.period_start, update.end_date, contract.indexer, contract.indexer_pct, contract.fixed_rate
+    )
+    if result is None:
+        log_and_print(f"Pulando período: {contract.indexer} entre {update.period_start} e {update.end_date}.", level="warning")
+        return None
+    update.balance, update.last_rate_date = result
+    return update
+
+def write_contract_update(
+    contract: FixedIncomeContract, update: ContractUpdate, allocations: Optional[List[WithdrawalAllocation]] = None
+) -> bool:
+    """
+    Grava o novo estado do contrato no Notion e conclui a chave no journal. Retorna True se o contrato fechou.
+    allocations: saques usados no cálculo, guardados com o saldo no snapshot da API de consulta.
+    """
+    contract_id = contract.id
+    update_url = f"https://api.notion.com/v1/pages/{contract_id}"
+    if update.zeroed:
+        payload = {
+            "properties": {
+                FI_BALANCE: {"number": 0},
+                FI_CLOSED: {"checkbox": True},
+                FI_LAST_UPDATE: {"date": {"start": update.end_date.isoformat()}},
+            }
+        }
+    else:
+        payload = {
+            "properties": {
+                FI_BALANCE: {"number": round(update.balance, 2)},
+                FI_LAST_UPDATE: {"date": {"start": update.end_date.isoformat()}},
+                FI_LAST_RATE_DATE: {"date": {"start": update.last_rate_date.isoformat()}},
+                FI_INFLATION: {"number": round(update.acc_ipca, 4)},
+                FI_CLOSED: {"checkbox": update.closed},
+            }
+        }
+        if update.fingerprint is not None and update.fingerprint != contract.pricing_fingerprint:
+            payload["properties"][FI_PRICING_FINGERPRINT] = {"rich_text": [{"text": {"content": update.fingerprint}}]}
+    resp = notion_request("PATCH", update_url, json=payload, timeout=20)
+    resp.raise_for_status()
+    current_journal().complete(f"contract_update:{contract_id}", update.closed)
+
+    # O registro reflete o que foi gravado (no run com identity map, é o mesmo objeto lido pelos estágios seguintes)
+    contract.balance = 0.0 if update.zeroed else round(update.balance, 2)
+    contract.last_update = update.end_date
+    if not update.zeroed:
+        contract.last_rate_date = update.last_rate_date
+        contract.pricing_fingerprint = update.fingerprint or contract.pricing_fingerprint
+    contract.closed = update.closed
+    portfolio = current_portfolio()
+    portfolio.query_snapshot.record_contract(contract, update.acc_ipca, allocations)
+    if portfolio.summary is not None:
+        portfolio.summary.record_contract(contract, contract.balance, update.acc_ipca, update.zeroed or update.closed)
+
+    if update.zeroed:
+        log_and_print(f"Contrato {contract_id} fechado (saldo zerado).")
+    elif update.timeline:
+        log_and_print(f"Renda fixa (timeline) atualizada: {contract_id} -> R${round(update.balance, 2)}")
+    else:
+        log_and_print(f"Renda fixa atualizada: R${round(update.previous_balance, 2)} -> R${round(update.balance, 2)}")
+    return update.closed
+
+def update_fixed_income_contract(contract: FixedIncomeContract, today: date) -> bool:
+    """
+    Atualiza saldo, inflação e datas de um contrato no Notion.
+    Retorna True se o contrato foi marcado como fechado (saldo zerado).
+    """
+    contract_id = contract.id
+    journal = current_journal()
+    journal_key = f"contract_update:{contract_id}"
+    if journal.is_done(journal_key):
+        log_and_print(f"Contrato {contract_id} já atualizado neste run. Pulando.", level="debug")
+        return bool(journal.result(journal_key))
+
+    try:
+        log_and_print(f">> Processando contrato {contract_id}...", level="debug")
+        allocations = get_allocations_for_contract(contract_id)
+        update = compute_contract_update(contract, today, allocations)
+        if update is None:
+            return False
+        return write_contract_update(contract, update, allocations)
+    except Exception as e:
+        log_and_print(f"Erro ao atualizar renda fixa {contract_id}: {e}", level="error")
+        return False
+
+def compute_contract_updates_batch(
+    contracts: List[FixedIncomeContract],
+    today: date,
+    allocations_by_contract: Dict[str, List[WithdrawalAllocation]],
+) -> Dict[str, Optional[ContractUpdate]]:
+    """
+    Motor em lote (requer numpy): mesmo resultado de compute_contract_update, bit a bit.
+    Os planos são por contrato; a composição é feita por grupo (indexador, percentual, taxa):
+    - SELIC/CDI: uma consulta de taxas para a janela do grupo; o fator de cada dia é calculado uma vez
+      (mesma expressão de compound_balance_period) e multiplicado, em ordem cronológica, nos saldos dos
+      contratos cujo período contém o dia. Mesma sequência de multiplicações => mesmos bits.
+    - IPCA: fator de cada período (início, fim) calculado uma vez e aplicado a todos os contratos do período.
+    Contratos com saques seguem a timeline por contrato (dentro de plan_contract_update).
+    Sem numpy, calcula contrato a contrato (compute_contract_update).
+    """
+    if np is None:
+        log_and_print("FI_BATCH_ENGINE requer o pacote numpy (pip install numpy). Usando o cálculo por contrato.", level="warning")
+        return {
+            contract.id: compute_contract_update(contract, today, allocations_by_contract.get(contract.id, []))
+            for contract in contracts
+        }
+    updates: Dict[str, Optional[ContractUpdate]] = {}
+    groups: Dict[Tuple[str, float, float], List[Tuple[FixedIncomeContract, ContractUpdate]]] = {}
+    for contract in contracts:
+        update = plan_contract_update(contract, today, allocations_by_contract.get(contract.id, []))
+        updates[contract.id] = update
+        if update is not None and update.period_start is not None:
+            groups.setdefault((contract.indexer, contract.indexer_pct, contract.fixed_rate), []).append((contract, update))
+
+    for (indexer, indexer_pct, fixed_rate), members in groups.items():
+        balances = np.array([update.balance for _, update in members], dtype=float)
+        starts = np.array([update.period_start for _, update in members], dtype="datetime64[D]")
+        ends = np.array([update.end_date for _, update in members], dtype="datetime64[D]")
+
+        if indexer in ("SELIC", "CDI"):
+            rates = get_bcb_daily_rates(indexer, starts.min().astype(object), ends.max().astype(object))
+            if not rates:
+                log_and_print(f"Pulando período: {indexer} entre {starts.min()} e {ends.max()}.", level="warning")
+                for _, update in members:
+                    update.last_rate_date = update.period_start
+                continue
+            rate_days = np.array(sorted(rates), dtype="datetime64[D]")
+            for rate_day in rate_days:
+                annual_rate = rates[rate_day.astype(object)]
+                effective_annual_rate = (annual_rate * indexer_pct) + fixed_rate
+                daily_factor = (1 + effective_annual_rate) ** (1 / BUSY_DAYS_IN_YEAR)
+                np.multiply(balances, daily_factor, out=balances, where=(starts <= rate_day) & (rate_day <= ends))
+            # Último dia com taxa dentro do período de cada contrato (sem taxa no período: o início)
+            first_index = np.searchsorted(rate_days, starts, side="left")
+            last_index = np.searchsorted(rate_days, ends, side="right") - 1
+            has_rate = last_index >= first_index
+            last_rate_days = np.where(has_rate, rate_days[np.maximum(last_index, 0)], starts).astype(object)
+            for (_, update), balance, last_rate_day, rated in zip(members, balances.tolist(), last_rate_days, has_rate):
+                if not rated:
+                    # Período sem nenhuma taxa publicada: compound_balance_period devolve o saldo e o início
+                    log_and_print(f"Pulando período: {indexer} entre {update.period_start} e {update.end_date}.", level="warning")
+                update.balance, update.last_rate_date = balance, last_rate_day
+        elif indexer == "IPCA":
+            factors: Dict[Tuple[date, date], float] = {}
+            period_factors = []
+            for _, update in members:
+                period = (update.period_start, update.end_date)
+                if period not in factors:
+                    acc_ipca = get_accumulated_ipca(*period)
+                    interval_workdays = get_net_workdays(*period)
+                    real_factor = (1 + fixed_rate) ** (interval_workdays / BUSY_DAYS_IN_YEAR)
+                    factors[period] = (1 + acc_ipca) * real_factor
+                period_factors.append(factors[period])
+            balances *= np.array(period_factors)
+            for (_, update), balance in zip(members, balances.tolist()):
+                update.balance, update.last_rate_date = balance, update.end_date
+        else:
+            log_and_print(f"Indexador desconhecido: {indexer}", level="warning")
+            for contract, update in members:
+                log_and_print(f"Pulando período: {indexer} entre {update.period_start} e {update.end_date}.", level="warning")
+                updates[contract.id] = None
+    return updates
+
+def update_fixed_income_contracts_batch(filter_payload: dict, today: date):
+    """
+    Modo FI_BATCH_ENGINE: lê todos os contratos abertos e todas as alocações (uma consulta paginada cada),
+    calcula os novos saldos em lote e grava contrato a contrato. Lista fixa: não há cursor a ser deslocado por fechamentos.
+    """
+    contracts = get_open_fixed_income_contracts(filter_payload)
+    if not contracts:
+        log_and_print("Nenhum contrato de renda fixa encontrado.", level="warning")
+        return
+    journal = current_journal()
+    contracts = [contract for contract in contracts if not journal.is_done(f"contract_update:{contract.id}")]
+    prefetch_bcb_data_for_contracts(contracts, today)
+    started = time.monotonic()
+    repository = current_repository()
+    allocations_by_contract = repository.allocations_by_contract() if repository is not None else get_all_allocations_by_contract()
+    updates = compute_contract_updates_batch(contracts, today, allocations_by_contract)
+    log_and_print(f"Saldos de {len(contracts)} contratos calculados em lote em {time.monotonic() - started:.2f}s.")
+
+    for contract in contracts:
+        if current_engine().shutdown_event.is_set():
+            log_and_print("Encerramento solicitado. Interrompendo atualização de renda fixa.", level="warning")
+            return
+        update = updates.get(contract.id)
+        if update is None:
+            continue
+        try:
+            write_contract_update(contract, update, allocations_by_contract.get(contract.id, []))
+        except Exception as e:
+            log_and_print(f"Erro ao atualizar renda fixa {contract.id}: {e}", level="error")
+
+def get_contribution_for_contract(contract: FixedIncomeContract) -> Optional[Tuple[date, float]]:
+    """
+    Retorna (data_aporte, valor) do aporte vinculado ao contrato, ou None se não houver.
+    """
+    contribution_id = contract.contribution_id
+    if not contribution_id:
+        log_and_print(f"O contrato {contract.id} não tem aporte vinculado. Pulando.", level="warning")
+        return None
+
+    contribution = current_portfolio().fi_contributions_by_id.get(contribution_id)
+    if contribution is None:
+        try:
+            page = get_notion_page(contribution_id, current_portfolio().fi_contributions_database_id, FI_CONTRIBUTION_PROPERTIES)
+            contribution = parse_fixed_income_contribution(page)
+        except Exception as e:
+            log_and_print(f"Erro ao buscar página {contribution_id} do Notion: {e}", level='error')
+            return None
+        current_portfolio().fi_contributions_by_id[contribution_id] = contribution
+
+    if contribution.amount is None or contribution.date is None:
+        return None
+    return (contribution.date, contribution.amount)
+
+def get_allocations_for_contract(contract_id: str) -> List[WithdrawalAllocation]:
+    """
+    Retorna lista de alocações (saques) do contrato, ordenada por data (cronológica).
+    Alocações sem valor ou sem data são ignoradas.
+    """
+    repository = current_repository()
+    if repository is not None:
+        return repository.allocations_for_contract(contract_id)
+    filter_payload = {
+        "property": FIA_CONTRACT_REL,
+        "relation": {"contains": contract_id}
+    }
+    try:
+        results: List[WithdrawalAllocation] = get_all_pages_from_notion(
+            current_portfolio().fi_allocations_database_id,
+            filter_payload=filter_payload,
+            record_parser=parse_withdrawal_allocation,
+            properties=FI_ALLOCATION_PROPERTIES,
+        ) or []
+    except Exception as e:
+        log_and_print(f"Erro ao buscar alocações do contrato {contract_id}: {e}", level="error")
+        return []
+    out = [alloc for alloc in results if alloc.amount is not None and alloc.date is not None]
+    out.sort(key=lambda alloc: alloc.date)
+    return out
+
+def get_unlinked_fixed_income_contributions() -> List[FixedIncomeContribution]:
+    """
+    Retorna aportes de renda fixa que ainda não possuem contrato vinculado
+    """
+    repository = current_repository()
+    if repository is not None and repository.ensure_reference_data():
+        return [c for c in current_portfolio().fi_contributions_by_id.values() if not c.contract_id]
+    filter_payload = {
+        "property": FIC_CONTRACT,
+        "relation": {"is_empty": True}
+    }
+    contributions = get_all_pages_from_notion(
+        current_portfolio().fi_contributions_database_id,
+        filter_payload=filter_payload,
+        record_parser=parse_fixed_income_contribution,
+        properties=FI_CONTRIBUTION_PROPERTIES,
+    )
+    return contributions or []
+
+def create_contract_from_contribution(contribution: FixedIncomeContribution):
+    contribution_id = contribution.id
+
+    # --- Validações básicas ---
+    if not contribution.asset_id:
+        raise ValueError("Aporte sem ativo vinculado")
+
+    today = date.today()
+    asset_id = contribution.asset_id
+    amount = contribution.amount
+    contribution_date = contribution.date or today
+
+    additional_fixed_rate = contribution.fixed_rate
+
+    # --- Criação do contrato ---
+    payload = {
+        "parent": {
+            "database_id": current_portfolio().fi_contracts_database_id
+        },
+        "properties": {
+            "Name": {
+                "title": [
+                    {
+                        "text": {
+                            "content": f"Contract {contribution_date.strftime('%Y-%m-%d')}"
+                        }
+                    }
+                ]
+            },
+            FI_ASSET: {
+                "relation": [{"id": asset_id}]
+            },
+            FIC_CONTRIBUTION_REL: {
+                "relation": [{"id": contribution_id}]
+            },
+            FI_CONTRIBUTION_DATE: {
+                "date": {"start": contribution_date.isoformat()}
+            },
+            FI_ADDITIONAL_FIXED_RATE: {
+                "number": additional_fixed_rate
+            },
+            FI_BALANCE: {
+                "number": amount
+            }
+        }
+    }
+
+    journal = current_journal()
+    journal_key = f"contract:{contribution_id}"
+    if journal.is_planned(journal_key) and not journal.is_done(journal_key):
+        existing_id = find_contract_for_contribution(contribution_id)
+        if existing_id:
+            log_and_print(f"Contrato {existing_id} do aporte {contribution_id} já havia sido criado antes da interrupção.")
+            journal.complete(journal_key, existing_id)
+            return existing_id
+
+    journal.plan(journal_key)
+    response = notion_request(
+        "POST",
+        "https://api.notion.com/v1/pages",
+        json=payload,
+        timeout=20
+    )
+    response.raise_for_status()
+    page = response.json()
+    contract_id = page.get("id")
+    journal.complete(journal_key, contract_id)
+
+    repository = current_repository()
+    if repository is not None and repository.ensure_reference_data():
+        contribution.contract_id = contract_id
+        repository.merge_contract(parse_fixed_income_contract(page))
+    return contract_id
+
+def find_contract_for_contribution(contribution_id: str) -> Optional[str]:
+    """Procura no Notion um contrato já vinculado ao aporte (reconciliação após interrupção)."""
+    filter_payload = {
+        "property": FIC_CONTRIBUTION_REL,
+        "relation": {"contains": contribution_id}
+    }
+    pages = get_all_pages_from_notion(current_portfolio().fi_contracts_database_id, filter_payload, properties=[FIC_CONTRIBUTION_REL])
+    return pages[0]["id"] if pages else None
+
+def process_fixed_income_contributions():
+    """ 
+    Processa novos aportes de renda fixa que ainda não foram vinculadas a contratos.
+
+    Esta função busca todos os aportes de renda fixa não vinculados a um contrato do banco de dados do Notion,
+    cria um contrato correspondente para cada um e registra o resultado de cada operação.
+    """
+    log_and_print("Processando aportes de renda fixa...")
+
+    contributions = get_unlinked_fixed_income_contributions()
+
+    if not contributions:
+        log_and_print("Nenhum aporte novo para processar.")
+        return
+
+    for contribution in contributions:
+        try:
+            create_contract_from_contribution(contribution)
+
+            log_and_print(
+                f"Contrato criado e vinculado com sucesso para aporte {contribution.id}"
+            )
+
+        except Exception as e:
+            log_and_print(
+                f"Erro ao processar aporte {contribution.id}: {e}",
+                level="error"
+            )
+
+OPEN_CONTRACTS_FILTER = {
+    "and": [
+        {"property": FIC_CONTRIBUTION_REL, "relation": {"is_not_empty": True}},
+        {"property": FI_CLOSED, "checkbox": {"equals": False}},
+    ]
+}
+
+UNPROCESSED_WITHDRAWALS_FILTER = {
+    "property": FIW_PROCESSED,
+    "checkbox": {"equals": False}
+}
+
+def get_unprocessed_withdrawals() -> List[FixedIncomeWithdrawal]:
+    """
+    Retorna saques não processados (Processed checkbox == False)
+    """
+    withdrawals = get_all_pages_from_notion(
+        current_portfolio().fi_withdrawals_database_id,
+        filter_payload=UNPROCESSED_WITHDRAWALS_FILTER,
+        record_parser=parse_fixed_income_withdrawal,
+        properties=FI_WITHDRAWAL_PROPERTIES,
+    )
+    return withdrawals or []
+
+def get_contracts_lifo_for_asset(asset_id: str) -> List[FixedIncomeContract]:
+    """
+    Busca contratos do asset ordenados por Contribution Date desc e ID desc (LIFO).
+    """
+    repository = current_repository()
+    if repository is not None:
+        return repository.contracts_for_asset_lifo(asset_id)
+    filter_payload = {
+        "property": FI_ASSET,
+        "relation": {"contains": asset_id}
+    }
+    sorts = [
+        {"property": FI_CONTRIBUTION_DATE, "direction": "descending"},
+        {"property": FI_CONTRACT_UNIQUE_ID, "direction": "descending"}
+    ]
+    contracts = get_all_pages_from_notion(
+        current_portfolio().fi_contracts_database_id,
+        filter_payload=filter_payload,
+        sorts=sorts,
+        record_parser=parse_fixed_income_contract,
+        properties=FI_CONTRACT_PROPERTIES,
+    )
+    return contracts or []
+
+def compute_withdrawal_allocations_for_asset(asset_id: str, amount: float, exclude_contracts: Optional[set] = None) -> list:
+    """
+    Calcula (em memória) a lista de alocações (contract_id, deduction)
+    e verifica se há saldo suficiente. Não grava nada.
+    exclude_contracts: contratos que não recebem alocação (já alocados ao saque em uma tentativa anterior).
+    Retorna lista de dicts: [{"contract_id": id, "deduction": X}, ...]
+    """
+    contracts = get_contracts_lifo_for_asset(asset_id)
+    remaining = float(amount)
+    allocations = []
+
+    for contract in contracts:
+        if remaining <= 0:
+            break
+        if exclude_contracts and contract.id in exclude_contracts:
+            continue
+        balance = contract.balance
+        if balance <= 0:
+            continue
+        deduct = min(balance, remaining)
+        allocations.append({"contract_id": contract.id, "deduction": round(deduct, 2)})
+        remaining -= deduct
+
+    return allocations
+
+def create_allocation_record(withdrawal_id: str, contract_id: str, amount: float, operation_date: Optional[date] = None):
+    """
+    Cria um registro na tabela Withdrawal Allocations ligado ao saque e contrato.
+    operation_date: data em que o saque ocorreu (para timeline de juros). Se None, usa hoje.
+    Retorna allocation_id.
+    """
+    op_date = operation_date or date.today()
+    payload = {
+        "parent": {"database_id": current_portfolio().fi_allocations_database_id},
+        "properties": {
+            "Name": {
+                "title": [{"text": {"content": f"Allocation {withdrawal_id} -> {contract_id}"}}]
+            },
+            FIA_WITHDRAWAL_REL: {"relation": [{"id": withdrawal_id}]},
+            FIA_CONTRACT_REL: {"relation": [{"id": contract_id}]},
+            FIA_AMOUNT: {"number": round(amount, 2)},
+            FIA_OPERATION_DATE: {"date": {"start": op_date.isoformat()}}
+        }
+    }
+
+    response = notion_request("POST", "https://api.notion.com/v1/pages", json=payload, timeout=20)
+    response.raise_for_status()
+    data = response.json()
+    allocation_id = data["id"]
+    return allocation_id
+
+def get_withdrawal_allocations(withdrawal_id: str) -> List[WithdrawalAllocation]:
+    """Alocações já existentes no Notion para o saque. Levanta exceção se a consulta falhar."""
+    filter_payload = {
+        "property": FIA_WITHDRAWAL_REL,
+        "relation": {"contains": withdrawal_id}
+    }
+    allocations = iter_pages_from_notion(
+        current_portfolio().fi_allocations_database_id,
+        filter_payload,
+        record_parser=parse_withdrawal_allocation,
+        properties=FI_ALLOCATION_PROPERTIES,
+    )
+    return [a for a in allocations if a.contract_id]
+
+def get_existing_allocations_for_withdrawal(withdrawal_id: str) -> Dict[str, str]:
+    """Mapeia contract_id -> allocation_id das alocações já existentes no Notion para o saque."""
+    return {a.contract_id: a.id for a in get_withdrawal_allocations(withdrawal_id)}
+
+def link_withdrawal_to_allocations(withdrawal_id: str, allocation_ids: list, processed_amount: float):
+    """
+    Atualiza a página do saque para relacionar as alocações (campo Allocations), salvar data, valor processado e marca como processado.
+    """
+    url = f"https://api.notion.com/v1/pages/{withdrawal_id}"
+    payload = {
+        "properties": {
+            FIW_ALLOCATIONS_REL: {"relation": [{"id": aid} for aid in allocation_ids]},
+            FIW_PROCESSED: {"checkbox": True},
+            FIW_PROCESSED_AMOUNT: {"number": round(processed_amount, 2)},
+            FIW_PROCESSING_DATE: {"date": {"start": datetime.now().isoformat()}}
+        }
+    }
+    response = notion_request("PATCH", url, json=payload, timeout=20)
+    response.raise_for_status()
+
+
+def partition_withdrawals_by_asset(withdrawals: List[FixedIncomeWithdrawal]) -> Dict[Optional[str], List[FixedIncomeWithdrawal]]:
+    """Saques agrupados por ativo, cada grupo em ordem de data (saques de ativos diferentes nunca tocam os mesmos contratos)."""
+    by_asset: Dict[Optional[str], List[FixedIncomeWithdrawal]] = {}
+    for wd in withdrawals:
+        by_asset.setdefault(wd.asset_id, []).append(wd)
+    for asset_withdrawals in by_asset.values():
+        asset_withdrawals.sort(key=lambda wd: (wd.date or date.max, wd.id))
+    return by_asset
+
+def process_withdrawals_lifo():
+    """
+    Processa saques (LIFO)
+    Esta função busca todos os saques não processados (Processed checkbox == False), agrupa por ativo e processa
+    os grupos em paralelo (WITHDRAWAL_WORKERS), cada um em ordem de data do saque.
+    Para cada saque, calcula as alocações (contract_id, deduction) e verifica se há saldo suficiente.
+    Se houver saldo suficiente, cria um registro na tabela Withdrawal Allocations ligado ao saque e contrato.
+    Em seguida, atualiza a página do saque para relacionar as alocações (campo Allocations), salvar data, valor processado e marca como processado.
+    Todas as threads usam o limitador do token da carteira, então o ritmo total de requisições ao Notion não muda.
+    """
+    engine = current_engine()
+    log_and_print("Processando saques (LIFO)...")
+    # Todos os saques são lidos antes de processar: saques processados saem do filtro, e ler durante o
+    # processamento deslocaria o cursor da paginação.
+    withdrawals = get_unprocessed_withdrawals()
+    if not withdrawals:
+        log_and_print("Nenhum saque não-processado.")
+        return
+    partitions = partition_withdrawals_by_asset(withdrawals)
+    workers = max(1, min(current_config().withdrawal_workers, len(partitions)))
+    log_and_print(f"{len(withdrawals)} saques em {len(partitions)} ativos ({workers} em paralelo).")
+
+    def process_partition(asset_withdrawals: List[FixedIncomeWithdrawal]) -> None:
+        for wd in asset_withdrawals:
+            if engine.shutdown_event.is_set():
+                return
+            process_withdrawal(wd)
+
+    if workers == 1:
+        for asset_withdrawals in partitions.values():
+            process_partition(asset_withdrawals)
+    else:
+        # Cada grupo roda no contexto atual (carteira, journal e identity map do run)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="withdrawals") as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, process_partition, asset_withdrawals): asset_id
+                for asset_id, asset_withdrawals in partitions.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    log_and_print(f"Erro nos saques do ativo {futures[future]}: {e}", level="error")
+    if engine.shutdown_event.is_set():
+        log_and_print("Encerramento solicitado. Interrompendo processamento de saques.", level="warning")
+
+def process_withdrawal(wd: FixedIncomeWithdrawal):
+    """Calcula as alocações LIFO de um saque, cria os registros de alocação e marca o saque como processado."""
+    journal = current_journal()
+    try:
+        withdrawal_id = wd.id
+
+        if not wd.asset_id:
+            log_and_print(f"Saque {withdrawal_id} sem asset definido. Pulando.", level="warning")
+            return
+
+        asset_id = wd.asset_id
+        amount = wd.amount
+
+        # Data em que o saque ocorreu (para timeline de juros); se não houver, usa hoje
+        withdrawal_date = wd.date or date.today()
+
+        # Num run retomado, o plano gravado no journal é reutilizado: recalcular sobre saldos
+        # já parcialmente afetados pelo saque produziria alocações diferentes das já criadas.
+        journal_key = f"withdrawal:{withdrawal_id}"
+        plan = journal.planned(journal_key)
+        # Alocações criadas por uma tentativa anterior cujo run terminou (erro no meio do saque, registrado e
+        # seguido de end_run): o journal já não tem o plano, então o Notion é a referência.
+        prior_allocations: List[WithdrawalAllocation] = []
+        if plan is not None:
+            allocations = plan["allocations"]
+            processed_amount = plan["processed_amount"]
+        else:
+            prior_allocations = get_withdrawal_allocations(withdrawal_id)
+            prior_total = round(sum(a.amount for a in prior_allocations), 2)
+            if prior_allocations:
+                log_and_print(
+                    f"Saque {withdrawal_id} com {len(prior_allocations)} alocações de uma tentativa anterior "
+                    f"({prior_total:.2f}). Alocando só o restante.", level='warning'
+                )
+            # calcula alocações em memória (só o que falta, fora dos contratos já alocados) e valida saldo
+            allocations = [{"contract_id": a.contract_id, "deduction": a.amount} for a in prior_allocations]
+            if amount - prior_total > 0:
+                allocations += compute_withdrawal_allocations_for_asset(
+                    asset_id, round(amount - prior_total, 2), {a.contract_id for a in prior_allocations}
+                )
+
+            # calcula o valor processado total (antes do loop para garantir que está sempre definido)
+            processed_amount = round(sum(allocation["deduction"] for allocation in allocations), 2)
+
+        if processed_amount <= 0:
+            log_and_print(f"Saque {withdrawal_id} sem saldo. Pulando.", level="warning")
+            return
+        elif processed_amount < amount:
+            log_and_print(f"Saque {withdrawal_id} com saldo insuficiente. Criando alocações parciais.", level="warning")
+
+        if plan is None:
+            journal.plan(journal_key, {"allocations": allocations, "processed_amount": processed_amount})
+
+        # Persiste: apenas cria alocações
+        allocation_ids = []
+        existing_allocations: Optional[Dict[str, str]] = None
+        if prior_allocations:
+            existing_allocations = {a.contract_id: a.id for a in prior_allocations}
+        for alloc in allocations:
+            contract_id = alloc["contract_id"]
+            deduct = alloc["deduction"]
+            alloc_key = f"alloc:{withdrawal_id}:{contract_id}"
+
+            if journal.is_done(alloc_key):
+                allocation_ids.append(journal.result(alloc_key))
+                continue
+            if journal.is_planned(alloc_key) or (existing_allocations and contract_id in existing_allocations):
+                # A criação pode ter chegado ao Notion antes da interrupção ou do erro: confere antes de repetir.
+                if existing_allocations is None:
+                    existing_allocations = get_existing_allocations_for_withdrawal(withdrawal_id)
+                if contract_id in existing_allocations:
+                    alloc_id = existing_allocations[contract_id]
+                    journal.complete(alloc_key, alloc_id)
+                    allocation_ids.append(alloc_id)
+                    continue
+
+            # cria allocation record (com data do saque para timeline)
+            journal.plan(alloc_key)
+            alloc_id = create_allocation_record(withdrawal_id, contract_id, deduct, operation_date=withdrawal_date)
+            journal.complete(alloc_key, alloc_id)
+            allocation_ids.append(alloc_id)
+
+        # linka o saque às alocações e marca processed (PATCH idempotente, repetido com segurança na retomada)
+        link_withdrawal_to_allocations(withdrawal_id, allocation_ids, processed_amount)
+        journal.complete(journal_key)
+
+        repository = current_repository()
+        if repository is not None:
+            # Alocações de runs anteriores já estão no saldo gravado pelo estágio de contratos daquele run
+            prior_ids = {a.id for a in prior_allocations}
+            for alloc, alloc_id in zip(allocations, allocation_ids):
+                if alloc_id in prior_ids:
+                    continue
+                repository.record_allocation(WithdrawalAllocation(
+                    id=alloc_id, withdrawal_id=withdrawal_id, contract_id=alloc["contract_id"],
+                    amount=alloc["deduction"], date=withdrawal_date,
+                ))
+
+        log_and_print(f"Saque {withdrawal_id} processado com sucesso. Alocações: {allocation_ids}")
+
+    except Exception as e:
+        log_and_print(f"Erro ao processar saque {wd.id}: {e}", level="error")
+
+# ------------------ HISTÓRICO DE VALORIZAÇÃO ------------------
+
+@dataclass(slots=True)
+class HistorySeries:
+    """Saldo diário de um contrato: values[i] é o saldo ao fim do dia start + i."""
+    start: date
+    values: List[float]
+    fingerprint: str
+    checkpoint: Optional[dict]
+    closed: bool
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=len(self.values) - 1)
+
+def contract_fingerprint_enabled() -> bool:
+    """A impressão digital só é usada quando o database de contratos tem a propriedade FI_PRICING_FINGERPRINT."""
+    return FI_PRICING_FINGERPRINT in get_database_property_ids(current_portfolio().fi_contracts_database_id)
+
+def contract_pricing_fingerprint(contract: FixedIncomeContract, allocations: List[WithdrawalAllocation]) -> str:
+    """Hash das entradas que determinam a timeline do contrato (aporte, indexador, taxas, vencimento e saques)."""
+    inputs = [
+        contract.principal,
+        contract.contribution_date.isoformat() if contract.contribution_date else None,
+        contract.indexer,
+        contract.indexer_pct,
+        contract.fixed_rate,
+        contract.due_date.isoformat() if contract.due_date else None,
+        [[alloc.date.isoformat(), alloc.amount] for alloc in allocations],
+    ]
+    return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+def compute_daily_balance_series(
+    contract: FixedIncomeContract,
+    allocations: List[WithdrawalAllocation],
+    today: date,
+    resume: Optional[dict] = None,
+    checkpoint_day: Optional[date] = None,
+) -> Optional[Tuple[date, List[float], Optional[dict], bool]]:
+    """
+    Saldo ao fim de cada dia, em uma única passada, com a mesma semântica de recompute_contract_balance_from_timeline:
+    juros do dia (inclusive) antes dos saques do dia, juros só até min(today, due_date), contrato encerrado ao zerar.
+    - SELIC/CDI: fator diário aplicado nos dias com taxa publicada (mesma expressão e ordem de multiplicação).
+    - IPCA: saldo = saldo_âncora * fator do período iniciado na âncora (aporte ou dia seguinte ao último saque).
+    resume: checkpoint de um run anterior (estado ao fim de um dia); a passada continua no dia seguinte.
+    checkpoint_day: dia cujo estado é devolvido como checkpoint para o próximo run.
+    Retorna (primeiro_dia, saldos, checkpoint, encerrado) ou None se o contrato não puder ser calculado.
+    """
+    if contract.contribution_date is None or contract.principal is None:
+        log_and_print(f"O contrato {contract.id} não tem aporte com data e valor. Pulando histórico.", level="warning")
+        return None
+    indexer = contract.indexer
+    if indexer not in BCB_DAILY_SERIES_MAP and indexer != "IPCA":
+        log_and_print(f"Indexador desconhecido: {indexer}", level="warning")
+        return None
+
+    indexer_pct = contract.indexer_pct
+    fixed_rate = contract.fixed_rate
+    due_date = contract.due_date
+    compounding_end = min(today, due_date) if due_date else today
+
+    if resume:
+        day = date.fromisoformat(resume["day"]) + timedelta(days=1)
+        balance = resume["balance"]
+        alloc_index = resume["alloc_index"]
+        anchor_balance = resume["anchor_balance"]
+        anchor_start = date.fromisoformat(resume["anchor_start"])
+    else:
+        day = contract.contribution_date
+        balance = contract.principal
+        alloc_index = 0
+        anchor_balance = balance
+        anchor_start = day
+    first_day = day
+
+    rates: Dict[date, float] = {}
+    workdays = 0
+    if indexer in BCB_DAILY_SERIES_MAP:
+        rates = get_bcb_daily_rates(indexer, day, compounding_end) if day <= compounding_end else {}
+    elif day > anchor_start:
+        workdays = get_net_workdays(anchor_start, day - timedelta(days=1))
+    acc_ipca: Optional[float] = None
+
+    values: List[float] = []
+    checkpoint = None
+    closed = False
+    while day <= today:
+        if day <= compounding_end:
+            if indexer == "IPCA":
+                if day > anchor_start and day.weekday() < 5 and day not in br_holidays():
+                    workdays += 1
+                # O IPCA acumulado só muda na virada do mês: consulta uma vez por mês do período
+                if acc_ipca is None or day.day == 1:
+                    acc_ipca = get_accumulated_ipca(anchor_start, day)
+                real_factor = (1 + fixed_rate) ** (workdays / BUSY_DAYS_IN_YEAR)
+                balance = anchor_balance * ((1 + acc_ipca) * real_factor)
+            else:
+                annual_rate = rates.get(day)
+                if annual_rate is not None:
+                    effective_annual_rate = (annual_rate * indexer_pct) + fixed_rate
+                    balance *= (1 + effective_annual_rate) ** (1 / BUSY_DAYS_IN_YEAR)
+
+        while alloc_index < len(allocations) and allocations[alloc_index].date <= day:
+            balance = max(0.0, balance - allocations[alloc_index].amount)
+            alloc_index += 1
+            # Após o saque, o próximo período de juros começa no dia seguinte
+            anchor_balance, anchor_start = balance, day + timedelta(days=1)
+            acc_ipca, workdays = None, 0
+
+        values.append(balance)
+        if day == checkpoint_day:
+            checkpoint = {
+                "day": day.isoformat(),
+                "balance": balance,
+                "alloc_index": alloc_index,
+                "anchor_balance": anchor_balance,
+                "anchor_start": anchor_start.isoformat(),
+            }
+        if balance <= 0:
+            closed = True
+            break
+        day += timedelta(days=1)
+
+    return (first_day, values, checkpoint, closed)
+
+class ValuationHistoryStore:
+    """
+    Arquivo colunar de saldos diários (FI_HISTORY_FILE), formado por segmentos anexados:
+    [tamanho do cabeçalho (uint32 LE)][cabeçalho JSON][coluna de saldos em centavos, delta-codificada (int64 LE) e comprimida].
+    Um segmento substitui, do seu dia inicial em diante, a série do mesmo contrato (ou a série inteira, se a
+    impressão digital mudou). Segmento truncado por queda no meio da gravação é ignorado.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segment_count = 0
+
+    @staticmethod
+    def _encode(values: List[float]) -> bytes:
+        cents = [round(value * 100) for value in values]
+        deltas = array("q", [cents[0]] + [cur - prev for prev, cur in zip(cents, cents[1:])] if cents else [])
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        return zlib.compress(deltas.tobytes())
+
+    @staticmethod
+    def _decode(payload: bytes) -> List[float]:
+        deltas = array("q")
+        deltas.frombytes(zlib.decompress(payload))
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        values = []
+        cents = 0
+        for delta in deltas:
+            cents += delta
+            values.append(cents / 100)
+        return values
+
+    def load(self) -> Dict[str, HistorySeries]:
+        series: Dict[str, HistorySeries] = {}
+        self.segment_count = 0
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return series
+
+        offset = 0
+        while offset + 4 <= len(data):
+            (header_size,) = struct.unpack_from("<I", data, offset)
+            header_end = offset + 4 + header_size
+            if header_end > len(data):
+                break
+            header = json.loads(data[offset + 4:header_end])
+            payload_end = header_end + header["bytes"]
+            if payload_end > len(data):
+                break
+            offset = payload_end
+            self.segment_count += 1
+
+            start = date.fromisoformat(header["start"])
+            values = self._decode(data[header_end:payload_end])
+            current = series.get(header["contract"])
+            if current is not None and current.fingerprint == header["fingerprint"] and current.start <= start:
+                values = current.values[:(start - current.start).days] + values
+                start = current.start
+            series[header["contract"]] = HistorySeries(
+                start, values, header["fingerprint"], header.get("checkpoint"), header.get("closed", False)
+            )
+        return series
+
+    def _segment_bytes(self, contract_id: str, start: date, values: List[float], fingerprint: str,
+                       checkpoint: Optional[dict], closed: bool) -> bytes:
+        payload = self._encode(values)
+        header = json.dumps({
+            "contract": contract_id,
+            "start": start.isoformat(),
+            "count": len(values),
+            "bytes": len(payload),
+            "fingerprint": fingerprint,
+            "checkpoint": checkpoint,
+            "closed": closed,
+        }).encode()
+        return struct.pack("<I", len(header)) + header + payload
+
+    def append(self, segments: List[Tuple[str, date, List[float], str, Optional[dict], bool]]) -> None:
+        with open(self.path, "ab") as f:
+            for segment in segments:
+                f.write(self._segment_bytes(*segment))
+            f.flush()
+            os.fsync(f.fileno())
+        self.segment_count += len(segments)
+
+    def rewrite(self, series: Dict[str, HistorySeries]) -> None:
+        """Compacta: um segmento por contrato, gravado em arquivo temporário e trocado atomicamente."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for contract_id, item in series.items():
+                f.write(self._segment_bytes(contract_id, item.start, item.values, item.fingerprint, item.checkpoint, item.closed))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.segment_count = len(series)
+
+def load_valuation_history(path: Optional[str] = None) -> Dict[str, HistorySeries]:
+    """Lê o histórico de saldos diários por contrato (para gráficos)."""
+    return ValuationHistoryStore(current_config().fi_history_file if path is None else path).load()
+
+def get_all_allocations_by_contract() -> Dict[str, List[WithdrawalAllocation]]:
+    """Todas as alocações (uma consulta paginada), agrupadas por contrato e em ordem cronológica."""
+    by_contract: Dict[str, List[WithdrawalAllocation]] = {}
+    allocations = get_all_pages_from_notion(
+        current_portfolio().fi_allocations_database_id,
+        record_parser=parse_withdrawal_allocation,
+        properties=FI_ALLOCATION_PROPERTIES,
+    ) or []
+    for alloc in allocations:
+        if alloc.contract_id and alloc.amount is not None and alloc.date is not None:
+            by_contract.setdefault(alloc.contract_id, []).append(alloc)
+    for contract_allocations in by_contract.values():
+        contract_allocations.sort(key=lambda alloc: alloc.date)
+    return by_contract
+
+def update_valuation_history(today: Optional[date] = None) -> None:
+    """
+    Atualiza o histórico de saldos diários de todos os contratos (inclusive encerrados).
+    Contratos com as mesmas entradas do run anterior continuam do checkpoint (FI_HISTORY_REWRITE_DAYS antes
+    do último dia, para absorver taxas publicadas com atraso pelo BCB); os demais são recalculados do aporte.
+    """
+    if current_portfolio().fi_contracts_database_id is None:
+        log_and_print("FI_CONTRACTS_DATABASE_ID não definido. Pulando histórico de valorização.", level="warning")
+        return
+    log_and_print("Atualizando histórico de valorização dos contratos de renda fixa...")
+
+    today = today or date.today()
+    if not load_fixed_income_reference_data():
+        log_and_print("Sem ativos/aportes de referência. Pulando histórico.", level="warning")
+        return
+
+    filter_payload = {"property": FIC_CONTRIBUTION_REL, "relation": {"is_not_empty": True}}
+    contracts = get_all_pages_from_notion(
+        current_portfolio().fi_contracts_database_id,
+        filter_payload,
+        sorts=[{"property": FI_CONTRIBUTION_DATE, "direction": "ascending"}],
+        record_parser=parse_fixed_income_contract,
+        properties=FI_CONTRACT_PROPERTIES,
+    ) or []
+    allocations_by_contract = get_all_allocations_by_contract()
+
+    store = ValuationHistoryStore(current_portfolio().fi_history_file)
+    history = store.load()
+    checkpoint_day = today - timedelta(days=current_config().fi_history_rewrite_days)
+    segments = []
+    full, incremental, unchanged = 0, 0, 0
+
+    for contract in contracts:
+        if current_engine().shutdown_event.is_set():
+            log_and_print("Encerramento solicitado. Gravando o histórico calculado até aqui.", level="warning")
+            break
+        allocations = allocations_by_contract.get(contract.id, [])
+        fingerprint = contract_pricing_fingerprint(contract, allocations)
+        previous = history.get(contract.id)
+        resume = None
+        if previous is not None and previous.fingerprint == fingerprint:
+            if previous.closed:
+                unchanged += 1
+                continue
+            # Sem checkpoint (contrato mais novo que a janela de reescrita), recalcula do aporte
+            resume = previous.checkpoint
+
+        result = compute_daily_balance_series(contract, allocations, today, resume=resume, checkpoint_day=checkpoint_day)
+        if result is None:
+            continue
+        start, values, checkpoint, closed = result
+        if resume is not None and checkpoint is None:
+            # Passada curta (runs no mesmo dia): o checkpoint anterior continua válido
+            checkpoint = resume
+        if not values:
+            unchanged += 1
+            continue
+
+        segments.append((contract.id, start, values, fingerprint, checkpoint, closed))
+        if resume is not None:
+            incremental += 1
+            history[contract.id] = HistorySeries(
+                previous.start, previous.values[:(start - previous.start).days] + values, fingerprint, checkpoint, closed
+            )
+        else:
+            full += 1
+            history[contract.id] = HistorySeries(start, values, fingerprint, checkpoint, closed)
+
+    if segments:
+        store.append(segments)
+    # Cada run anexa um segmento por contrato alterado; compacta quando os segmentos superam o dobro dos contratos
+    if store.segment_count > 2 * max(len(history), 1):
+        store.rewrite(history)
+
+    days_written = sum(len(segment[2]) for segment in segments)
+    log_and_print(
+        f"Histórico de valorização: {full} contratos recalculados integralmente, {incremental} incrementais, "
+        f"{unchanged} sem alterações; {days_written} dias gravados em {store.path}."
+    )
+
+# ------------------ PROJEÇÃO MONTE CARLO ------------------
+
+@dataclass(slots=True)
+class Ar1Model:
+    """Processo AR(1) mensal: x[t+1] = mean + phi * (x[t] - mean) + sigma * ruído normal."""
+    start: float
+    mean: float
+    phi: float
+    sigma: float
+
+def fit_ar1_model(values: List[float]) -> Ar1Model:
+    """Estima o AR(1) por momentos: média, autocorrelação de ordem 1 (limitada a [0, 0.99]) e desvio do ruído."""
+    if len(values) < 3:
+        raise ValueError("Histórico insuficiente para calibrar o modelo (mínimo de 3 meses).")
+    series = np.asarray(values, dtype=float)
+    mean = float(series.mean())
+    deviations = series - mean
+    variance = float(np.dot(deviations, deviations))
+    phi = float(np.dot(deviations[1:], deviations[:-1]) / variance) if variance > 0 else 0.0
+    phi = min(max(phi, 0.0), 0.99)
+    sigma = float(series.std()) * (1 - phi ** 2) ** 0.5
+    return Ar1Model(start=float(series[-1]), mean=mean, phi=phi, sigma=sigma)
+
+def calibrate_projection_models(today: date) -> Optional[Dict[str, Ar1Model]]:
+    """
+    Calibra um AR(1) por indexador com os últimos PROJECTION_CALIBRATION_YEARS do BCB:
+    média mensal da taxa anual (SELIC/CDI) e variação mensal (IPCA). O ponto de partida é o último mês publicado.
+    """
+    engine = current_engine()
+    start = date(today.year - current_config().projection_calibration_years, today.month, 1)
+    models: Dict[str, Ar1Model] = {}
+    for indexer in BCB_DAILY_SERIES_MAP:
+        rates = get_bcb_daily_rates(indexer, start, today)
+        monthly: Dict[Tuple[int, int], List[float]] = {}
+        for rate_date, annual_rate in sorted(rates.items()):
+            monthly.setdefault((rate_date.year, rate_date.month), []).append(annual_rate)
+        try:
+            models[indexer] = fit_ar1_model([sum(month) / len(month) for month in monthly.values()])
+        except ValueError as e:
+            log_and_print(f"Projeção: {indexer} sem histórico suficiente ({e}).", level="error")
+            return None
+    if not _ensure_ipca_cache(start, today):
+        return None
+    with engine.bcb_lock:
+        ipca = [rate for month_date, rate in sorted(engine.ipca_monthly.items()) if start <= month_date <= today]
+    try:
+        models["IPCA"] = fit_ar1_model(ipca)
+    except ValueError as e:
+        log_and_print(f"Projeção: IPCA sem histórico suficiente ({e}).", level="error")
+        return None
+    return models
+
+@dataclass(slots=True)
+class RateScenarios:
+    """
+    Cenários mensais (cenários × meses) a partir do mês de `start`: taxa anual de SELIC/CDI e IPCA do mês.
+    month_starts[m] é o dia 1 do mês m; business_days[m] são os dias úteis do mês m posteriores a `start`;
+    horizon é o último dia do último mês simulado.
+    """
+    start: date
+    horizon: date
+    month_starts: "np.ndarray"
+    business_days: "np.ndarray"
+    paths: Dict[str, "np.ndarray"]
+
+def _br_holidays_between(start: date, end: date) -> "np.ndarray":
+    calendar = holidays.country_holidays('BR', years=range(start.year, end.year + 1))
+    return np.array(sorted(day for day in calendar if start <= day <= end), dtype="datetime64[D]")
+
+def generate_rate_scenarios(
+    models: Dict[str, Ar1Model],
+    start: date,
+    months: int,
+    scenarios: int,
+    seed: Optional[int] = None,
+) -> RateScenarios:
+    """
+    Simula `scenarios` trajetórias mensais por indexador. SELIC e CDI usam os mesmos choques (andam juntos);
+    o IPCA tem choques próprios. Taxas de SELIC/CDI não ficam negativas.
+    """
+    rng = np.random.default_rng(seed)
+    first_month = np.datetime64(start.replace(day=1), "M")
+    month_starts = (first_month + np.arange(months)).astype("datetime64[D]")
+    month_ends = (first_month + np.arange(1, months + 1)).astype("datetime64[D]")
+    holiday_days = _br_holidays_between(start, month_ends[-1].astype(object))
+    # Dias úteis de cada mês a partir do dia seguinte a `start` (o mês corrente é parcial)
+    first_days = np.maximum(month_starts, np.datetime64(start + timedelta(days=1), "D"))
+    business_days = np.busday_count(first_days, np.maximum(first_days, month_ends), holidays=holiday_days)
+
+    shocks = {"daily": rng.standard_normal((scenarios, months)), "IPCA": rng.standard_normal((scenarios, months))}
+    paths: Dict[str, np.ndarray] = {}
+    for indexer, model in models.items():
+        noise = shocks["IPCA" if indexer == "IPCA" else "daily"]
+        path = np.empty((scenarios, months))
+        level = np.full(scenarios, model.start)
+        for month in range(months):
+            level = model.mean + model.phi * (level - model.mean) + model.sigma * noise[:, month]
+            if indexer != "IPCA":
+                np.maximum(level, 0.0, out=level)
+            path[:, month] = level
+        paths[indexer] = path
+    horizon = (month_ends[-1] - 1).astype(object)
+    return RateScenarios(start=start, horizon=horizon, month_starts=month_starts, business_days=business_days, paths=paths)
+
+@dataclass(slots=True)
+class ProjectionResult:
+    """Faixas de percentis do saldo no vencimento (ou no horizonte): linhas = percentis, colunas = contratos/ativos."""
+    percentiles: List[float]
+    contract_ids: List[str]
+    contract_bands: "np.ndarray"
+    asset_ids: List[Optional[str]]
+    asset_bands: "np.ndarray"
+    total_band: "np.ndarray"
+    end_dates: List[date]
+
+    def to_dict(self) -> dict:
+        def bands(values) -> Dict[str, float]:
+            return {f"p{q:g}": round(float(v), 2) for q, v in zip(self.percentiles, values)}
+        return {
+            "percentiles": self.percentiles,
+            "contracts": {
+                contract_id: {"end_date": end.isoformat(), **bands(self.contract_bands[:, i])}
+                for i, (contract_id, end) in enumerate(zip(self.contract_ids, self.end_dates))
+            },
+            "assets": {str(asset_id): bands(self.asset_bands[:, i]) for i, asset_id in enumerate(self.asset_ids)},
+            "total": bands(self.total_band),
+        }
+
+def project_fixed_income_contracts(
+    contracts: List[FixedIncomeContract],
+    scenarios: RateScenarios,
+    percentiles: List[float],
+) -> ProjectionResult:
+    """
+    Projeta o saldo atual de cada contrato até min(vencimento, horizonte dos cenários), em todos os cenários de uma vez.
+    Mesma convenção de compound_balance_period:
+    - SELIC/CDI: fator (1 + taxa * indexer_pct + fixed_rate) ** (1 / 252) por dia útil (feriados nacionais);
+      a taxa é constante dentro do mês, então o fator acumulado é calculado por mês e completado pelos dias do último mês.
+    - IPCA: produto de (1 + IPCA do mês) dos meses cujo dia 1 cai no período, vezes (1 + fixed_rate) ** (dias úteis / 252).
+    Contratos com o mesmo (indexador, percentual, taxa) compartilham o fator acumulado por cenário.
+    Contratos vencidos (ou sem indexador conhecido) ficam com o saldo atual em todos os cenários.
+    """
+    start = np.datetime64(scenarios.start, "D")
+    horizon = np.datetime64(scenarios.horizon, "D")
+    months = len(scenarios.month_starts)
+    n_scenarios = next(iter(scenarios.paths.values())).shape[0]
+    holiday_days = _br_holidays_between(scenarios.start, scenarios.horizon)
+
+    count = len(contracts)
+    balances = np.array([contract.balance for contract in contracts], dtype=float)
+    ends = np.array([contract.due_date or scenarios.horizon for contract in contracts], dtype="datetime64[D]")
+    ends = np.clip(ends, start, horizon)
+    # Mês do vencimento e dias úteis desse mês até o vencimento (inclusive)
+    end_months = (ends.astype("datetime64[M]") - scenarios.month_starts[0].astype("datetime64[M]")).astype(int)
+    month_first = np.maximum(scenarios.month_starts[end_months], start + 1)
+    partial_days = np.busday_count(month_first, np.maximum(month_first, ends + 1), holidays=holiday_days)
+    # IPCA: meses 1..end_month (dia 1 em (start, end]) e dias úteis do período inteiro para a parcela real
+    workdays = np.busday_count(start + 1, np.maximum(start + 1, ends + 1), holidays=holiday_days)
+
+    terminal = np.tile(balances, (n_scenarios, 1))
+    groups: Dict[Tuple[str, float, float], List[int]] = {}
+    for i, contract in enumerate(contracts):
+        if contract.indexer in scenarios.paths and ends[i] > start:
+            groups.setdefault((contract.indexer, contract.indexer_pct, contract.fixed_rate), []).append(i)
+
+    for (indexer, indexer_pct, fixed_rate), members in groups.items():
+        idx = np.array(members)
+        path = scenarios.paths[indexer]
+        if indexer == "IPCA":
+            cumulative = np.zeros((n_scenarios, months))
+            np.cumsum(np.log1p(path[:, 1:]), axis=1, out=cumulative[:, 1:])
+            log_growth = cumulative[:, end_months[idx]]
+            log_growth += np.log1p(fixed_rate) * workdays[idx] / BUSY_DAYS_IN_YEAR
+        else:
+            daily_log = np.log1p(path * indexer_pct + fixed_rate) / BUSY_DAYS_IN_YEAR
+            cumulative = np.zeros((n_scenarios, months + 1))
+            np.cumsum(daily_log * scenarios.business_days, axis=1, out=cumulative[:, 1:])
+            month_idx = end_months[idx]
+            log_growth = cumulative[:, month_idx] + daily_log[:, month_idx] * partial_days[idx]
+        terminal[:, idx] *= np.exp(log_growth)
+
+    asset_keys = [contract.asset_id for contract in contracts]
+    asset_ids = list(dict.fromkeys(asset_keys))
+    asset_index = {asset_id: i for i, asset_id in enumerate(asset_ids)}
+    asset_totals = np.zeros((n_scenarios, len(asset_ids)))
+    if count:
+        order = np.argsort([asset_index[key] for key in asset_keys], kind="stable")
+        sorted_assets = np.array([asset_index[asset_keys[i]] for i in order])
+        boundaries = np.flatnonzero(np.r_[True, sorted_assets[1:] != sorted_assets[:-1]])
+        asset_totals[:, sorted_assets[boundaries]] = np.add.reduceat(terminal[:, order], boundaries, axis=1)
+
+    return ProjectionResult(
+        percentiles=list(percentiles),
+        contract_ids=[contract.id for contract in contracts],
+        contract_bands=np.percentile(terminal, percentiles, axis=0) if count else np.zeros((len(percentiles), 0)),
+        asset_ids=asset_ids,
+        asset_bands=np.percentile(asset_totals, percentiles, axis=0) if count else np.zeros((len(percentiles), 0)),
+        total_band=np.percentile(terminal.sum(axis=1), percentiles),
+        end_dates=ends.astype(object).tolist(),
+    )
+
+def run_projection() -> None:
+    """Modo --projection: projeta os contratos abertos da carteira e grava as faixas em PROJECTION_FILE (JSON)."""
+    config = current_config()
+    if np is None:
+        log_and_print("Projeção requer o pacote numpy (pip install numpy).", level="error")
+        return
+    portfolio = current_portfolio()
+    if portfolio.fi_contracts_database_id is None:
+        log_and_print("FI_CONTRACTS_DATABASE_ID não definido. Pulando projeção.", level="warning")
+        return
+    if not load_fixed_income_reference_data():
+        log_and_print("Sem ativos/aportes de referência. Pulando projeção.", level="warning")
+        return
+    contracts = get_all_pages_from_notion(
+        portfolio.fi_contracts_database_id,
+        OPEN_CONTRACTS_FILTER,
+        record_parser=parse_fixed_income_contract,
+        properties=FI_CONTRACT_PROPERTIES,
+    )
+    if not contracts:
+        log_and_print("Nenhum contrato de renda fixa para projetar.", level="warning")
+        return
+
+    today = date.today()
+    models = calibrate_projection_models(today)
+    if models is None:
+        log_and_print("Não foi possível calibrar os cenários. Pulando projeção.", level="warning")
+        return
+    started = time.monotonic()
+    scenarios = generate_rate_scenarios(
+        models, today, config.projection_max_years * 12 + 1, config.projection_scenarios, seed=config.projection_seed
+    )
+    result = project_fixed_income_contracts(contracts, scenarios, config.projection_percentiles)
+    log_and_print(
+        f"Projeção de {len(contracts)} contratos em {config.projection_scenarios} cenários concluída em "
+        f"{time.monotonic() - started:.1f}s."
+    )
+
+    assets = portfolio.fi_assets_by_id
+    for i, asset_id in enumerate(result.asset_ids):
+        band = " / ".join(f"R${value:,.2f}" for value in result.asset_bands[:, i])
+        name = asset_id if asset_id not in assets else f"{asset_id} ({assets[asset_id].indexer})"
+        log_and_print(f"Ativo {name}: {band}")
+    log_and_print("Total: " + " / ".join(f"R${value:,.2f}" for value in result.total_band))
+
+    root, ext = os.path.splitext(config.projection_file)
+    path = f"{root}.{portfolio.name}{ext}" if portfolio.name else config.projection_file
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().isoformat(), "start": today.isoformat(), **result.to_dict()}, f, indent=2)
+    log_and_print(f"Faixas de percentis ({', '.join(f'p{q:g}' for q in config.projection_percentiles)}) gravadas em {path}.")
+
+def update_all_variable_income_assets(only_open_markets: bool = False):
+    portfolio = current_portfolio()
+    databases = []
+    if portfolio.vi_assets_database_id is not None:
+        databases.append((portfolio.vi_assets_database_id, False))
+    else:
+        log_and_print("VI_ASSETS_DATABASE_ID não definido. Pulando renda variável (BR).", level="warning")
+    if portfolio.vi_foreign_assets_database_id is not None:
+        databases.append((portfolio.vi_foreign_assets_database_id, True))
+    else:
+        log_and_print("VI_FOREIGN_ASSETS_DATABASE_ID não definido. Pulando renda variável (exterior).", level="warning")
+
+    if current_engine().run_deadline is not None:
+        # Com prazo, B3 e exterior disputam o mesmo orçamento: uma única fila por prioridade
+        sources = [variable_income_source(database_id, convert_to_brl) for database_id, convert_to_brl in databases]
+        update_variable_income_assets_prioritized(sources, only_open_markets=only_open_markets)
+        return
+    for database_id, convert_to_brl in databases:
+        update_variable_income_assets(database_id, only_open_markets=only_open_markets, convert_to_brl=convert_to_brl)
+
+def run_fixed_income_chain():
+    # Um identity map por cadeia: contratos criados e saques processados ficam visíveis aos estágios seguintes
+    with run_repository():
+        run_stage("fi_contributions", process_fixed_income_contributions)
+        run_stage("fi_withdrawals", process_withdrawals_lifo)
+        run_stage("fi_contracts", update_fixed_income_contracts)
+
+def run_journaled_fixed_income_chain():
+    """Cadeia de renda fixa dentro de um run do journal; um run interrompido é retomado na próxima chamada."""
+    journal = current_portfolio().journal
+    journal.begin_run()
+    run_fixed_income_chain()
+    if not current_engine().shutdown_event.is_set():
+        journal.end_run()
+
+# ------------------ FILA DE JOBS (COORDENADOR / WORKERS) ------------------
+
+class LeaseLost(Exception):
+    """O lease do job expirou e outro worker pode tê-lo assumido: o trabalho em andamento é abandonado."""
+
+@dataclass(slots=True)
+class Job:
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    progress: dict
+
+class JobQueue:
+    """
+    Fila durável em SQLite (JOB_QUEUE_FILE), compartilhada por um coordenador e qualquer número de workers.
+    - claim() entrega o job mais antigo disponível com um lease de `lease_seconds`; leases vencidos voltam à fila.
+    - Jobs com a mesma serial_key são entregues um de cada vez, em ordem de inclusão (saques do mesmo ativo).
+    - dedup_key evita enfileirar de novo um job igual ainda pendente.
+    - Jobs que falham voltam à fila até JOB_MAX_ATTEMPTS tentativas; depois ficam como 'failed'.
+    Em várias máquinas, o arquivo precisa estar em um sistema de arquivos com locks confiáveis para o SQLite.
+    """
+
+    def __init__(self, path: str, max_attempts: Optional[int] = None):
+        self.path = path
+        self.max_attempts = current_config().job_max_attempts if max_attempts is None else max_attempts
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    batch TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    serial_key TEXT,
+                    dedup_key TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id);
+                CREATE INDEX IF NOT EXISTS jobs_serial ON jobs(serial_key, status);
+                CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup ON jobs(dedup_key)
+                    WHERE dedup_key IS NOT NULL AND status IN ('queued', 'leased');
+            """)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Uma conexão por operação: a fila é usada por várias threads (heartbeat) e processos
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, batch: str, kind: str, payload: dict, serial_key: Optional[str] = None,
+                dedup_key: Optional[str] = None) -> bool:
+        """Enfileira um job; retorna False se um job com a mesma dedup_key ainda está pendente."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (batch, kind, payload, serial_key, dedup_key, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (batch, kind, json.dumps(payload), serial_key, dedup_key, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """Devolve à fila jobs com lease vencido (ou marca como falhos, se esgotaram as tentativas)."""
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = 'lease expirado', lease_owner = NULL, lease_expires = NULL, updated = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+        # Um job que falhou de vez bloqueia os seguintes da mesma serial_key (ex.: saques posteriores do mesmo ativo)
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'job anterior da mesma serial_key falhou', updated = ? "
+            "WHERE status = 'queued' AND serial_key IS NOT NULL AND EXISTS ("
+            "SELECT 1 FROM jobs AS o WHERE o.serial_key = jobs.serial_key AND o.batch = jobs.batch "
+            "AND o.status = 'failed' AND o.id < jobs.id)",
+            (now,),
+        )
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Job]:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_expired(conn, now)
+                row = conn.execute("""
+                    SELECT id, kind, payload, attempts, progress FROM jobs AS j
+                    WHERE status = 'queued' AND (
+                        serial_key IS NULL OR NOT EXISTS (
+                            SELECT 1 FROM jobs AS o
+                            WHERE o.serial_key = j.serial_key AND o.id != j.id
+                              AND (o.status = 'leased' OR (o.status = 'queued' AND o.id < j.id))
+                        )
+                    )
+                    ORDER BY id LIMIT 1
+                """).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, row[0]),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return Job(id=row[0], kind=row[1], payload=json.loads(row[2]), attempts=row[3] + 1, progress=json.loads(row[4]))
+
+    def _update_leased(self, job_id: int, worker_id: str, sql: str, params: tuple) -> None:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {sql}, updated = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (*params, time.time(), job_id, worker_id),
+            )
+            if cursor.rowcount != 1:
+                raise LeaseLost(f"Job {job_id} não pertence mais ao worker {worker_id}.")
+
+    def extend_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> None:
+        self._update_leased(job_id, worker_id, "lease_expires = ?", (time.time() + lease_seconds,))
+
+    def save_progress(self, job_id: int, worker_id: str, progress: dict) -> None:
+        self._update_leased(job_id, worker_id, "progress = ?", (json.dumps(progress),))
+
+    def complete(self, job_id: int, worker_id: str, result: Any = None) -> None:
+        self._update_leased(
+            job_id, worker_id, "status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL", (json.dumps(result),)
+        )
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> None:
+        self._update_leased(
+            job_id, worker_id,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ?, lease_owner = NULL, lease_expires = NULL",
+            (self.max_attempts, error),
+        )
+
+    def batch_counts(self, batch: str, kinds: Optional[List[str]] = None) -> Dict[str, int]:
+        """Quantidade de jobs do lote por status (opcionalmente só dos tipos informados)."""
+        with self._connect() as conn:
+            self._requeue_expired(conn, time.time())
+            query = "SELECT status, COUNT(*) FROM jobs WHERE batch = ?"
+            params: list = [batch]
+            if kinds:
+                query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+                params += kinds
+            return dict(conn.execute(query + " GROUP BY status", params).fetchall())
+
+    def batch_failures(self, batch: str) -> List[Tuple[int, str, str]]:
+        with self._connect() as conn:
+            return conn.execute("SELECT id, kind, error FROM jobs WHERE batch = ? AND status = 'failed'", (batch,)).fetchall()
+
+    def purge(self, older_than_days: int = 7) -> None:
+        """Remove jobs concluídos ou falhos antigos."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                (time.time() - older_than_days * 86400,),
+            )
+
+class JobJournal:
+    """
+    Journal de um job da fila, com a mesma interface de RunJournal, persistido na própria linha do job:
+    se o worker cair, o job volta à fila e o próximo worker retoma o plano e reconcilia escritas pela metade.
+    """
+
+    def __init__(self, queue: JobQueue, job: Job, worker_id: str):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.job.progress.setdefault("planned", {})
+        self.job.progress.setdefault("done", {})
+
+    def _save(self) -> None:
+        self.queue.save_progress(self.job.id, self.worker_id, self.job.progress)
+
+    def stage_done(self, stage: str) -> bool:
+        return False
+
+    def mark_stage_done(self, stage: str) -> None:
+        pass
+
+    def plan(self, key: str, data: Any = None) -> None:
+        self.job.progress["planned"][key] = data
+        self._save()
+
+    def complete(self, key: str, result: Any = None) -> None:
+        self.job.progress["done"][key] = result
+        self._save()
+
+    def planned(self, key: str) -> Any:
+        return self.job.progress["planned"].get(key)
+
+    def is_planned(self, key: str) -> bool:
+        return key in self.job.progress["planned"]
+
+    def is_done(self, key: str) -> bool:
+        return key in self.job.progress["done"]
+
+    def result(self, key: str) -> Any:
+        return self.job.progress["done"].get(key)
+
+def portfolio_by_name(name: str) -> Portfolio:
+    if not name:
+        return current_engine().env_portfolio
+    for portfolio in get_portfolios():
+        if portfolio.name == name:
+            return portfolio
+    raise ValueError(f"Carteira '{name}' não encontrada em {current_config().portfolios_file}.")
+
+def _ensure_reference_data(max_age_seconds: float) -> None:
+    """Workers recarregam ativos/aportes da carteira periodicamente (o coordenador pode ter criado contratos)."""
+    loaded_at = current_portfolio().reference_loaded_at
+    if loaded_at is None or time.monotonic() - loaded_at > max_age_seconds:
+        if not load_fixed_income_reference_data():
+            raise RuntimeError("Não foi possível carregar ativos/aportes de renda fixa.")
+
+def handle_vi_ticker_job(payload: dict) -> dict:
+    """Uma busca de cotação por ticker, gravada em todas as páginas (de todas as carteiras) com esse ticker."""
+    ticker = payload["ticker"]
+    price = get_price_from_apis(ticker)
+    if not price:
+        return {"price": None}
+    for target in payload["targets"]:
+        with use_portfolio(portfolio_by_name(target["portfolio"])):
+            brl_price = None
+            if target["convert_to_brl"]:
+                asset = VariableIncomeAsset(target["page_id"], ticker, None, None, target["currency"])
+                brl_price = convert_prices_to_brl([(asset, price)]).get(asset.id)
+            update_variable_income_asset_price_in_notion(target["page_id"], price, brl_price=brl_price)
+    return {"price": price}
+
+def handle_fi_withdrawals_job(payload: dict) -> dict:
+    """Saques de um ativo, em ordem de data; a serial_key do job garante um lote por ativo de cada vez."""
+    portfolio = current_portfolio()
+    journal = current_journal()
+    processed = []
+    # Identity map do lote: cada saque enxerga os saldos já reduzidos pelos saques anteriores do ativo
+    with run_repository():
+        for withdrawal_id in payload["withdrawal_ids"]:
+            page = get_notion_page(withdrawal_id, portfolio.fi_withdrawals_database_id, FI_WITHDRAWAL_PROPERTIES)
+            wd = parse_fixed_income_withdrawal(page)
+            journal_key = f"withdrawal:{withdrawal_id}"
+            # Já processado (por este job antes de uma queda ou por outro run): só retoma se o plano ficou pela metade
+            if wd.processed and (journal.is_done(journal_key) or not journal.is_planned(journal_key)):
+                continue
+            process_withdrawal(wd)
+            processed.append(withdrawal_id)
+    return {"processed": processed}
+
+def handle_fi_contract_job(payload: dict) -> dict:
+    portfolio = current_portfolio()
+    _ensure_reference_data(current_config().job_lease_seconds)
+    page = get_notion_page(payload["contract_id"], portfolio.fi_contracts_database_id, FI_CONTRACT_PROPERTIES)
+    contract = parse_fixed_income_contract(page)
+    if contract.closed:
+        return {"closed": True, "skipped": True}
+    today = date.today()
+    prefetch_bcb_data_for_contracts([contract], today)
+    return {"closed": update_fixed_income_contract(contract, today)}
+
+JOB_HANDLERS: Dict[str, Callable[[dict], Any]] = {
+    "vi_ticker": handle_vi_ticker_job,
+    "fi_withdrawals": handle_fi_withdrawals_job,
+    "fi_contract": handle_fi_contract_job,
+}
+
+def run_job(queue: JobQueue, job: Job, worker_id: str) -> None:
+    """Executa um job mantendo o lease renovado em segundo plano; falhas devolvem o job à fila."""
+    config = current_config()
+    stop_heartbeat = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop_heartbeat.wait(config.job_lease_seconds / 3):
+            try:
+                queue.extend_lease(job.id, worker_id, config.job_lease_seconds)
+            except LeaseLost:
+                return
+            except Exception as e:
+                log_and_print(f"Erro ao renovar lease do job {job.id}: {e}", level="warning")
+
+    heartbeat_thread = threading.Thread(target=contextvars.copy_context().run, args=(heartbeat,), name=f"lease-{job.id}", daemon=True)
+    heartbeat_thread.start()
+    journal_token = _current_job_journal.set(JobJournal(queue, job, worker_id))
+    try:
+        with use_portfolio(portfolio_by_name(job.payload.get("portfolio", ""))):
+            log_and_print(f"Job {job.id} ({job.kind}, tentativa {job.attempts}) iniciado.")
+            result = JOB_HANDLERS[job.kind](job.payload)
+        queue.complete(job.id, worker_id, result)
+        log_and_print(f"Job {job.id} ({job.kind}) concluído.")
+    except LeaseLost as e:
+        log_and_print(f"{e} Abandonando o job.", level="warning")
+    except Exception as e:
+        log_and_print(f"Job {job.id} ({job.kind}) falhou: {e}", level="error")
+        try:
+            queue.fail(job.id, worker_id, str(e))
+        except LeaseLost:
+            pass
+    finally:
+        _current_job_journal.reset(journal_token)
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+
+def run_worker() -> None:
+    """Modo worker: assume jobs da fila até SIGTERM/SIGINT (ou, com JOB_WORKER_IDLE_EXIT_SECONDS > 0, até ficar ocioso)."""
+    engine = current_engine()
+    config = current_config()
+    _install_daemon_signal_handlers()
+    queue = JobQueue(config.job_queue_file)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    log_and_print(f"Worker {worker_id} iniciado (fila {config.job_queue_file}).")
+    idle_since = time.monotonic()
+    while not engine.shutdown_event.is_set():
+        job = queue.claim(worker_id, config.job_lease_seconds)
+        if job is None:
+            if config.job_worker_idle_exit_seconds and time.monotonic() - idle_since >= config.job_worker_idle_exit_seconds:
+                break
+            engine.shutdown_event.wait(config.job_poll_seconds)
+            continue
+        run_job(queue, job, worker_id)
+        idle_since = time.monotonic()
+    engine.quota_ledger.save()
+    log_and_print(f"Worker {worker_id} encerrado.")
+
+def _enqueue_variable_income_jobs(queue: JobQueue, batch: str, portfolios: List[Portfolio]) -> int:
+    """Um job por ticker único, com todas as páginas (de todas as carteiras) que o referenciam."""
+    targets_by_ticker = collect_variable_income_targets(portfolios)
+    for ticker, targets in targets_by_ticker.items():
+        queue.enqueue(batch, "vi_ticker", {"ticker": ticker, "targets": targets}, dedup_key=f"vi:{ticker}")
+    return len(targets_by_ticker)
+
+def _enqueue_withdrawal_jobs(queue: JobQueue, batch: str, portfolio: Portfolio) -> int:
+    """Um job por ativo com seus saques pendentes em ordem de data; saques do mesmo ativo ficam serializados."""
+    by_asset = partition_withdrawals_by_asset(get_unprocessed_withdrawals())
+    by_asset.pop(None, None)
+    for asset_id, withdrawals in by_asset.items():
+        queue.enqueue(
+            batch, "fi_withdrawals",
+            {"portfolio": portfolio.name, "asset_id": asset_id, "withdrawal_ids": [wd.id for wd in withdrawals]},
+            serial_key=f"{portfolio.name}:asset:{asset_id}",
+        )
+    return len(by_asset)
+
+def _enqueue_contract_jobs(queue: JobQueue, batch: str, portfolio: Portfolio) -> int:
+    count = 0
+    for page in iter_pages_from_notion(portfolio.fi_contracts_database_id, OPEN_CONTRACTS_FILTER, properties=[FI_CLOSED]):
+        queue.enqueue(
+            batch, "fi_contract", {"portfolio": portfolio.name, "contract_id": page["id"]},
+            dedup_key=f"fi:{portfolio.name}:{page['id']}",
+        )
+        count += 1
+    return count
+
+def _wait_for_batch(queue: JobQueue, batch: str, kinds: Optional[List[str]] = None) -> bool:
+    """Aguarda os jobs do lote (dos tipos informados) saírem da fila; False se o encerramento foi solicitado."""
+    engine = current_engine()
+    while not engine.shutdown_event.is_set():
+        counts = queue.batch_counts(batch, kinds)
+        if not counts.get("queued") and not counts.get("leased"):
+            return True
+        engine.shutdown_event.wait(current_config().job_poll_seconds)
+    return False
+
+def run_coordinator() -> None:
+    """
+    Modo coordenador: enfileira o trabalho do run e acompanha a fila até os workers concluírem.
+    Aportes são processados aqui mesmo (poucos e rápidos). Cotações (um job por ticker) e saques (um job por ativo)
+    são enfileirados primeiro; os contratos só depois que os saques do lote terminam, pois as alocações
+    criadas pelos saques entram no recálculo dos saldos.
+    """
+    config = current_config()
+    _install_daemon_signal_handlers()
+    queue = JobQueue(config.job_queue_file)
+    queue.purge()
+    batch = uuid.uuid4().hex
+    portfolios = all_portfolios()
+    log_and_print(f"Coordenador iniciado: lote {batch}, fila {config.job_queue_file}.")
+
+    tickers = _enqueue_variable_income_jobs(queue, batch, portfolios)
+    assets = 0
+    for portfolio in portfolios:
+        with use_portfolio(portfolio):
+            process_fixed_income_contributions()
+            assets += _enqueue_withdrawal_jobs(queue, batch, portfolio)
+    log_and_print(f"Enfileirados: {tickers} tickers e saques de {assets} ativos.")
+
+    if not _wait_for_batch(queue, batch, ["fi_withdrawals"]):
+        return
+    contracts = 0
+    for portfolio in portfolios:
+        with use_portfolio(portfolio):
+            contracts += _enqueue_contract_jobs(queue, batch, portfolio)
+    log_and_print(f"Enfileirados: {contracts} contratos.")
+
+    if not _wait_for_batch(queue, batch):
+        return
+    counts = queue.batch_counts(batch)
+    log_and_print(f"Lote {batch} concluído: {counts.get('done', 0)} jobs concluídos, {counts.get('failed', 0)} com falha.")
+    for job_id, kind, error in queue.batch_failures(batch):
+        log_and_print(f"Job {job_id} ({kind}) falhou: {error}", level="error")
+
+# ------------------ STREAMING DE COTAÇÕES ------------------
+
+class QuoteFeed(ABC):
+    """
+    Fonte de cotações por push. run() bloqueia entregando (ticker, preço) a on_trade até `stop` ser sinalizado;
+    subscribe() pode ser chamado antes ou durante run() (novos ativos no Notion).
+    """
+
+    @abstractmethod
+    def subscribe(self, tickers: List[str]) -> None:
+        ...
+
+    @abstractmethod
+    def run(self, on_trade: Callable[[str, float], None], stop: threading.Event) -> None:
+        ...
+
+def _finnhub_symbol(ticker: str) -> str:
+    # Tickers da B3 (ações/FIIs) usam o sufixo .SA no Finnhub; os do exterior vão como estão
+    if is_brazilian_ticker(ticker):
+        return f"{ticker.upper().strip()}.SA"
+    return ticker
+
+class FinnhubWebSocketFeed(QuoteFeed):
+    """
+    Trades em tempo real pelo websocket do Finnhub (uma conexão para todos os tickers).
+    Requer o pacote opcional websocket-client; reconecta com espera exponencial se a conexão cair.
+    """
+
+    URL = "wss://ws.finnhub.io?token={token}"
+
+    def __init__(self, token: str):
+        if websocket is None:
+            raise RuntimeError("O modo --stream com Finnhub requer o pacote websocket-client (pip install websocket-client).")
+        self.token = token
+        self._symbols: Dict[str, str] = {}  # símbolo do Finnhub -> ticker
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def subscribe(self, tickers: List[str]) -> None:
+        with self._lock:
+            new_symbols = []
+            for ticker in tickers:
+                symbol = _finnhub_symbol(ticker)
+                if symbol not in self._symbols:
+                    self._symbols[symbol] = ticker
+                    new_symbols.append(symbol)
+            connection = self._connection
+        if connection is not None:
+            for symbol in new_symbols:
+                connection.send(json.dumps({"type": "subscribe", "symbol": symbol}))
+
+    def run(self, on_trade: Callable[[str, float], None], stop: threading.Event) -> None:
+        backoff = 1.0
+        while not stop.is_set():
+            try:
+                connection = websocket.create_connection(self.URL.format(token=self.token), timeout=10)
+                with self._lock:
+                    self._connection = connection
+                    symbols = list(self._symbols)
+                for symbol in symbols:
+                    connection.send(json.dumps({"type": "subscribe", "symbol": symbol}))
+                log_and_print(f"Streaming conectado ao Finnhub ({len(symbols)} tickers).")
+                backoff = 1.0
+                while not stop.is_set():
+                    try:
+                        message = connection.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if not message:
+                        raise ConnectionError("conexão encerrada pelo servidor")
+                    data = json.loads(message)
+                    if data.get("type") != "trade":
+                        continue  # ping e mensagens de controle
+                    for trade in data.get("data") or []:
+                        ticker = self._symbols.get(trade.get("s"))
+                        if ticker and trade.get("p"):
+                            on_trade(ticker, float(trade["p"]))
+            except Exception as e:
+                if stop.is_set():
+                    break
+                log_and_print(f"Streaming do Finnhub desconectado ({e}); reconectando em {backoff:.0f}s.", level="warning")
+                stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                with self._lock:
+                    connection, self._connection = self._connection, None
+                if connection is not None:
+                    connection.close()
+
+class FakeQuoteFeed(QuoteFeed):
+    """Fonte local para testes e benchmarks: push(ticker, preço) entrega um trade; tickers não assinados são ignorados."""
+
+    def __init__(self):
+        self.subscribed: set = set()
+        self._trades: "queue.Queue[Tuple[str, float]]" = queue.Queue()
+
+    def subscribe(self, tickers: List[str]) -> None:
+        self.subscribed.update(tickers)
+
+    def push(self, ticker: str, price: float) -> None:
+        self._trades.put((ticker, price))
+
+    def run(self, on_trade: Callable[[str, float], None], stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                ticker, price = self._trades.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if ticker in self.subscribed:
+                on_trade(ticker, price)
+
+def collect_variable_income_targets(portfolios: List[Portfolio], with_prices: bool = False) -> Dict[str, List[dict]]:
+    """
+    Páginas de renda variável de todas as carteiras agrupadas por ticker:
+    {ticker: [{portfolio, page_id, currency, convert_to_brl[, unit_price]}, ...]}.
+    with_prices: inclui o preço gravado no Notion (base da comparação de variação relevante no streaming).
+    """
+    targets_by_ticker: Dict[str, List[dict]] = {}
+    for portfolio in portfolios:
+        with use_portfolio(portfolio):
+            for database_id, properties, foreign in (
+                (portfolio.vi_assets_database_id, VI_ASSET_PROPERTIES, False),
+                (portfolio.vi_foreign_assets_database_id, VI_FOREIGN_ASSET_PROPERTIES, True),
+            ):
+                if database_id is None:
+                    continue
+                convert_to_brl = foreign and VI_BRL_PRICE in get_database_property_ids(database_id)
+                summary = portfolio.summary if with_prices else None
+                if with_prices:
+                    properties = properties + [VI_UNIT_PRICE]
+                if summary is not None:
+                    properties = properties + [VI_QUANTITY]
+                for asset in iter_pages_from_notion(database_id, record_parser=parse_variable_income_asset, properties=properties):
+                    portfolio.query_snapshot.observe_variable_income_asset(asset, foreign=foreign)
+                    if summary is not None:
+                        summary.observe_variable_income_asset(asset, foreign=foreign)
+                    if not asset.ticker:
+                        continue
+                    target = {
+                        "portfolio": portfolio.name,
+                        "page_id": asset.id,
+                        "currency": asset.currency,
+                        "convert_to_brl": convert_to_brl,
+                    }
+                    if with_prices:
+                        target["unit_price"] = asset.unit_price
+                    targets_by_ticker.setdefault(asset.ticker, []).append(target)
+    return targets_by_ticker
+
+class CoalescingQuoteWriter:
+    """
+    Guarda o último preço de cada ticker recebido do feed e grava no Notion em flush():
+    no máximo uma escrita por página a cada `flush_seconds`, e só se o preço variou ao menos `min_change`
+    (fração) em relação ao último valor gravado. Trades intermediários são descartados (só o último importa).
+    """
+
+    def __init__(self, targets_by_ticker: Dict[str, List[dict]], flush_seconds: Optional[float] = None,
+                 min_change: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        config = current_config()
+        self.flush_seconds = config.stream_flush_seconds if flush_seconds is None else flush_seconds
+        self.min_change = config.stream_min_change if min_change is None else min_change
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._latest: Dict[str, float] = {}
+        self._dirty: set = set()
+        self._targets: Dict[str, List[dict]] = {}
+        self._written: Dict[str, float] = {}      # page_id -> último preço gravado
+        self._written_at: Dict[str, float] = {}   # page_id -> instante (clock) da última escrita
+        self.trades = 0
+        self.writes = 0
+        self.set_targets(targets_by_ticker)
+
+    def set_targets(self, targets_by_ticker: Dict[str, List[dict]]) -> None:
+        with self._lock:
+            self._targets = targets_by_ticker
+            for targets in targets_by_ticker.values():
+                for target in targets:
+                    if target["page_id"] not in self._written and target.get("unit_price"):
+                        self._written[target["page_id"]] = target["unit_price"]
+            self._dirty.update(ticker for ticker in self._latest if ticker in targets_by_ticker)
+
+    def on_trade(self, ticker: str, price: float) -> None:
+        with self._lock:
+            self.trades += 1
+            if self._latest.get(ticker) != price:
+                self._latest[ticker] = price
+                self._dirty.add(ticker)
+
+    def _is_material(self, page_id: str, price: float) -> bool:
+        written = self._written.get(page_id)
+        return written is None or abs(price - written) >= abs(written) * self.min_change
+
+    def flush(self, force: bool = False) -> int:
+        """Grava as páginas com variação relevante cujo intervalo venceu (force ignora o intervalo). Retorna o nº de escritas."""
+        now = self.clock()
+        pending: List[Tuple[str, dict, float]] = []
+        with self._lock:
+            for ticker in list(self._dirty):
+                price = self._latest[ticker]
+                waiting = False
+                for target in self._targets.get(ticker, []):
+                    page_id = target["page_id"]
+                    if not self._is_material(page_id, price):
+                        continue
+                    if not force and now - self._written_at.get(page_id, float("-inf")) < self.flush_seconds:
+                        waiting = True
+                        continue
+                    pending.append((ticker, target, price))
+                if not waiting:
+                    self._dirty.discard(ticker)
+
+        for portfolio_name, items in itertools.groupby(sorted(pending, key=lambda item: item[1]["portfolio"]), key=lambda item: item[1]["portfolio"]):
+            items = list(items)
+            with use_portfolio(portfolio_by_name(portfolio_name)):
+                foreign = [
+                    (VariableIncomeAsset(target["page_id"], ticker, None, None, target["currency"]), price)
+                    for ticker, target, price in items if target["convert_to_brl"]
+                ]
+                brl_prices = convert_prices_to_brl(foreign)
+                for ticker, target, price in items:
+                    update_variable_income_asset_price_in_notion(target["page_id"], price, brl_price=brl_prices.get(target["page_id"]))
+                    with self._lock:
+                        self._written[target["page_id"]] = price
+                        self._written_at[target["page_id"]] = now
+                        self.writes += 1
+        return len(pending)
+
+def run_stream(feed: Optional[QuoteFeed] = None, portfolios: Optional[List[Portfolio]] = None) -> None:
+    """
+    Modo --stream: assina os tickers dos dois databases de renda variável (de todas as carteiras) em um feed por push
+    e grava os preços pelo CoalescingQuoteWriter até SIGTERM/SIGINT. A lista de tickers é relida do Notion
+    a cada STREAM_TARGETS_REFRESH_MINUTES; no encerramento, as variações pendentes são gravadas.
+    """
+    engine = current_engine()
+    config = current_config()
+    _install_daemon_signal_handlers()
+    if portfolios is None:
+        portfolios = all_portfolios()
+    if feed is None:
+        feed = FinnhubWebSocketFeed(config.api_keys("finnhub")[0])
+
+    targets = collect_variable_income_targets(portfolios, with_prices=True)
+    writer = CoalescingQuoteWriter(targets)
+    feed.subscribe(list(targets))
+    feed_thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(feed.run, writer.on_trade, engine.shutdown_event),
+        name="quote-feed", daemon=True,
+    )
+    feed_thread.start()
+    log_and_print(
+        f"Streaming iniciado: {len(targets)} tickers, gravação a cada {writer.flush_seconds:.0f}s por página "
+        f"com variação mínima de {writer.min_change:.2%}."
+    )
+
+    refresh_interval = config.stream_targets_refresh_minutes * 60
+    last_refresh = time.monotonic()
+    while not engine.shutdown_event.wait(min(STREAM_TICK_SECONDS, writer.flush_seconds)):
+        try:
+            writer.flush()
+            if time.monotonic() - last_refresh >= refresh_interval:
+                targets = collect_variable_income_targets(portfolios, with_prices=True)
+                writer.set_targets(targets)
+                feed.subscribe(list(targets))
+                run_portfolios(portfolios, flush_portfolio_summary)
+                run_portfolios(portfolios, save_query_snapshot)
+                last_refresh = time.monotonic()
+        except Exception as e:
+            log_and_print(f"Erro no ciclo do streaming: {e}", level="error")
+
+    writer.flush(force=True)
+    run_portfolios(portfolios, flush_portfolio_summary)
+    run_portfolios(portfolios, save_query_snapshot)
+    feed_thread.join(timeout=5)
+    log_and_print(f"Streaming encerrado: {writer.trades} trades recebidos, {writer.writes} escritas no Notion.")
+
+# ------------------ EXECUÇÃO OFFLINE (EXPORT / COMPUTE / APPLY) ------------------
+# --export grava os databases de renda fixa e as séries do BCB em um snapshot local; --compute roda a cadeia de renda
+# fixa (aportes, saques e contratos) contra o snapshot, sem rede, e grava as escritas em um bundle JSONL;
+# --apply envia o bundle ao Notion. O compute pode rodar em outra máquina e o bundle pode ser revisado antes do apply.
+
+# Databases exportados e as propriedades que a cadeia de renda fixa lê de cada um
+OFFLINE_DATABASES = [
+    ("fi_assets_database_id", FI_ASSET_PROPERTIES),
+    ("fi_contributions_database_id", FI_CONTRIBUTION_PROPERTIES),
+    ("fi_contracts_database_id", FI_CONTRACT_PROPERTIES),
+    ("fi_withdrawals_database_id", FI_WITHDRAWAL_PROPERTIES),
+    ("fi_allocations_database_id", FI_ALLOCATION_PROPERTIES),
+]
+# Prefixo dos ids provisórios das páginas criadas no compute (trocados pelos ids reais no apply)
+OFFLINE_ID_PREFIX = "offline-"
+
+def export_portfolio_databases() -> Dict[str, dict]:
+    """Esquema e páginas (só as propriedades lidas pela cadeia de renda fixa) de cada database da carteira atual."""
+    portfolio = current_portfolio()
+    databases: Dict[str, dict] = {}
+    for attribute, properties in OFFLINE_DATABASES:
+        database_id = getattr(portfolio, attribute)
+        if not database_id:
+            continue
+        pages = [
+            {key: page[key] for key in ("id", "parent", "last_edited_time", "properties") if key in page}
+            for page in iter_pages_from_notion(database_id, properties=properties)
+        ]
+        databases[database_id] = {"properties": get_database_property_ids(database_id), "pages": pages}
+        log_and_print(f"Database {database_id} exportado: {len(pages)} páginas.")
+    return databases
+
+def offline_bcb_windows(databases: Dict[str, dict], today: date) -> List[Tuple[int, date, date]]:
+    """Séries do BCB que o compute pode pedir: do aporte mais antigo da carteira até hoje, por indexador dos ativos."""
+    portfolio = current_portfolio()
+
+    def pages(database_id: Optional[str]) -> List[dict]:
+        return databases.get(database_id, {}).get("pages", []) if database_id else []
+
+    dates = [_prop_date(page.get("properties", {}), FIC_DATE) for page in pages(portfolio.fi_contributions_database_id)]
+    dates += [_prop_date(page.get("properties", {}), FI_CONTRIBUTION_DATE) for page in pages(portfolio.fi_contracts_database_id)]
+    dates = [day for day in dates if day is not None and day <= today]
+    if not dates:
+        return []
+    start = min(dates)
+    indexers = {parse_fixed_income_asset(page).indexer for page in pages(portfolio.fi_assets_database_id)}
+    windows = [(BCB_DAILY_SERIES_MAP[indexer], start, today) for indexer in sorted(indexers & BCB_DAILY_SERIES_MAP.keys())]
+    windows.append((IPCA_SERIES_ID, start.replace(day=1), today))
+    return windows
+
+def fetch_bcb_series_raw(windows: List[Tuple[int, date, date]]) -> Dict[str, list]:
+    """Itens das séries do BCB como a API os devolve (sem conversão), em blocos anuais concorrentes. Falhas são propagadas."""
+    chunks: Dict[Tuple[int, date], date] = {}
+    for serie_id, start_date, end_date in windows:
+        for chunk_start, chunk_end in _bcb_year_chunks(start_date, end_date):
+            chunks[(serie_id, chunk_start)] = max(chunks.get((serie_id, chunk_start), date.min), chunk_end)
+    series: Dict[str, list] = {}
+    if not chunks:
+        return series
+    with ThreadPoolExecutor(max_workers=min(current_config().bcb_fetch_workers, len(chunks)), thread_name_prefix="bcb") as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, _fetch_bcb_chunk_with_retry, serie_id, chunk_start, chunk_end): serie_id
+            for (serie_id, chunk_start), chunk_end in chunks.items()
+        }
+        for future in as_completed(futures):
+            series.setdefault(str(futures[future]), []).extend(future.result())
+    for items in series.values():
+        items.sort(key=lambda item: datetime.strptime(item["data"], "%d/%m/%Y").date())
+    return series
+
+def export_offline_snapshot(path: Optional[str] = None) -> bool:
+    """--export: grava o snapshot de todas as carteiras. Um erro em qualquer consulta aborta o export (nunca um snapshot parcial)."""
+    path = current_config().offline_snapshot_file if path is None else path
+    today = date.today()
+    exported: Dict[str, dict] = {}
+    windows: List[Tuple[int, date, date]] = []
+    failed: List[str] = []
+
+    def export_one() -> None:
+        portfolio = current_portfolio()
+        try:
+            databases = export_portfolio_databases()
+        except Exception as e:
+            log_and_print(f"Erro ao exportar databases: {e}", level="error")
+            failed.append(portfolio.name)
+            return
+        exported[portfolio.name] = databases
+        windows.extend(offline_bcb_windows(databases, today))
+
+    for_each_portfolio(export_one)
+    if failed:
+        log_and_print("Export abortado: snapshot não gravado.", level="error")
+        return False
+    try:
+        bcb_series = fetch_bcb_series_raw(windows)
+    except Exception as e:
+        log_and_print(f"Erro ao exportar séries do BCB: {e}. Snapshot não gravado.", level="error")
+        return False
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"exported_at": datetime.now().isoformat(), "portfolios": exported, "bcb": bcb_series}, f)
+    os.replace(tmp_path, path)
+    page_count = sum(len(database["pages"]) for databases in exported.values() for database in databases.values())
+    log_and_print(f"Snapshot offline gravado em {path}: {page_count} páginas, {len(bcb_series)} séries do BCB.")
+    return True
+
+def _offline_response(status_code: int, data: Any, url: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "OK" if status_code == 200 else "Not Found"
+    response.url = url
+    response._content = json.dumps(data).encode()
+    return response
+
+def _offline_property_value(value: dict) -> dict:
+    """Valor de propriedade no formato de escrita (requisição) convertido para o formato devolvido nas leituras."""
+    for kind in ("title", "rich_text"):
+        if kind in value:
+            items = [{**item, "plain_text": (item.get("text") or {}).get("content", "")} for item in value[kind]]
+            return {"type": kind, kind: items}
+    for kind in ("number", "date", "checkbox", "relation", "select"):
+        if kind in value:
+            return {"type": kind, kind: value[kind]}
+    return value
+
+# Valor comparado por cada tipo de filtro do Notion suportado no compute
+_OFFLINE_FILTER_VALUES: Dict[str, Callable[[dict], Any]] = {
+    "checkbox": lambda value: bool(value.get("checkbox")),
+    "relation": lambda value: [item["id"] for item in value.get("relation") or []],
+    "date": lambda value: ((value.get("date") or {}).get("start") or "")[:10] or None,
+    "number": lambda value: value.get("number"),
+    "select": lambda value: (value.get("select") or {}).get("name"),
+}
+_OFFLINE_FILTER_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "equals": lambda current, target: current == target,
+    "does_not_equal": lambda current, target: current != target,
+    "contains": lambda current, target: target in current,
+    "does_not_contain": lambda current, target: target not in current,
+    "is_empty": lambda current, target: not current,
+    "is_not_empty": lambda current, target: bool(current),
+    "before": lambda current, target: current is not None and current < target,
+    "after": lambda current, target: current is not None and current > target,
+    "on_or_before": lambda current, target: current is not None and current <= target,
+    "on_or_after": lambda current, target: current is not None and current >= target,
+    "greater_than": lambda current, target: current is not None and current > target,
+    "less_than": lambda current, target: current is not None and current < target,
+}
+
+def offline_filter_matches(props: dict, filter_payload: Optional[dict]) -> bool:
+    """Avalia um filtro de consulta do Notion sobre as propriedades de uma página do snapshot."""
+    if not filter_payload:
+        return True
+    if "and" in filter_payload:
+        return all(offline_filter_matches(props, item) for item in filter_payload["and"])
+    if "or" in filter_payload:
+        return any(offline_filter_matches(props, item) for item in filter_payload["or"])
+    kind = next((kind for kind in _OFFLINE_FILTER_VALUES if kind in filter_payload), None)
+    condition = filter_payload.get(kind) if kind else None
+    operator = next(iter(condition), None) if condition else None
+    if operator not in _OFFLINE_FILTER_OPERATORS:
+        raise ValueError(f"Filtro não suportado no modo offline: {filter_payload}")
+    target = condition[operator]
+    if kind == "date" and isinstance(target, str):
+        target = target[:10]
+    current = _OFFLINE_FILTER_VALUES[kind](props.get(filter_payload["property"]) or {})
+    return _OFFLINE_FILTER_OPERATORS[operator](current, target)
+
+def _offline_sort_value(value: dict) -> Any:
+    kind = value.get("type")
+    if kind == "date":
+        return (value.get("date") or {}).get("start") or None
+    if kind == "unique_id":
+        return (value.get("unique_id") or {}).get("number")
+    if kind in ("number", "checkbox"):
+        return value.get(kind)
+    return None
+
+def offline_sort_pages(pages: List[dict], sorts: Optional[list]) -> List[dict]:
+    """Ordena como o Notion: critérios em ordem de prioridade, valores vazios sempre no fim."""
+    for sort in reversed(sorts or []):
+        if "property" not in sort:
+            raise ValueError(f"Ordenação não suportada no modo offline: {sort}")
+        keyed = [(_offline_sort_value(page["properties"].get(sort["property"]) or {}), page) for page in pages]
+        present = [item for item in keyed if item[0] is not None]
+        present.sort(key=lambda item: item[0], reverse=sort.get("direction") == "descending")
+        pages = [page for _, page in present] + [page for value, page in keyed if value is None]
+    return pages
+
+class OfflineNotionSession:
+    """
+    Substitui as sessões HTTP do Engine no --compute: responde às consultas do Notion e do BCB a partir do snapshot do --export
+    e guarda as escritas (criação e PATCH de páginas) em memória, visíveis às leituras seguintes do mesmo compute.
+    Cada página escrita vira uma entrada do bundle, com as propriedades de todas as escritas mescladas;
+    páginas criadas recebem ids provisórios (OFFLINE_ID_PREFIX + n). Qualquer outra requisição falha: o compute não usa a rede.
+    """
+
+    def __init__(self, snapshot: dict):
+        self._lock = threading.Lock()
+        self.databases: Dict[str, dict] = {}
+        self.pages: Dict[str, dict] = {}
+        for databases in snapshot.get("portfolios", {}).values():
+            for database_id, database in databases.items():
+                self.databases[database_id] = database
+                for page in database["pages"]:
+                    self.pages[page["id"]] = page
+        self.bcb_series = {
+            int(serie_id): [(datetime.strptime(item["data"], "%d/%m/%Y").date(), item) for item in items]
+            for serie_id, items in snapshot.get("bcb", {}).items()
+        }
+        self.bundle: Dict[str, dict] = {}   # page id -> entrada do bundle, na ordem da primeira escrita
+        self._created = 0
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method: str, url: str, headers: Optional[dict] = None, json: Optional[dict] = None,
+                params: Optional[dict] = None, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        path = urlsplit(url).path
+        if "api.bcb.gov.br" in url:
+            return self._bcb_series(url, path, params or {})
+        with self._lock:
+            if method == "POST" and path.startswith("/v1/databases/") and path.endswith("/query"):
+                return self._query(url, path.split("/")[-2], json or {})
+            if method == "GET" and path.startswith("/v1/databases/"):
+                database = self.databases.get(path.rsplit("/", 1)[1])
+                if database is None:
+                    return _offline_response(404, {"object": "error", "message": "Database fora do snapshot."}, url)
+                return _offline_response(200, {"properties": {name: {"id": prop_id} for name, prop_id in database["properties"].items()}}, url)
+            if method == "POST" and path == "/v1/pages":
+                return _offline_response(200, self._create(json or {}), url)
+            if path.startswith("/v1/pages/") and method in ("GET", "PATCH"):
+                page = self.pages.get(path.rsplit("/", 1)[1])
+                if page is None:
+                    return _offline_response(404, {"object": "error", "message": "Página fora do snapshot."}, url)
+                if method == "PATCH":
+                    self._write(page, (json or {}).get("properties", {}))
+                return _offline_response(200, page, url)
+        raise requests.ConnectionError(f"Modo offline: {method} {url} não pode ser atendida pelo snapshot.")
+
+    def _query(self, url: str, database_id: str, body: dict) -> requests.Response:
+        database = self.databases.get(database_id)
+        if database is None:
+            return _offline_response(404, {"object": "error", "message": "Database fora do snapshot."}, url)
+        pages = [page for page in database["pages"] if offline_filter_matches(page["properties"], body.get("filter"))]
+        pages = offline_sort_pages(pages, body.get("sorts"))
+        start = int(body.get("start_cursor") or 0)
+        end = start + body.get("page_size", 100)
+        has_more = end < len(pages)
+        return _offline_response(200, {"results": pages[start:end], "has_more": has_more, "next_cursor": str(end) if has_more else None}, url)
+
+    def _create(self, payload: dict) -> dict:
+        self._created += 1
+        database_id = payload["parent"]["database_id"]
+        page = {"object": "page", "id": f"{OFFLINE_ID_PREFIX}{self._created}", "parent": {"database_id": database_id}, "properties": {}}
+        self.databases.setdefault(database_id, {"properties": {}, "pages": []})["pages"].append(page)
+        self.pages[page["id"]] = page
+        self.bundle[page["id"]] = {"portfolio": current_portfolio().name, "page_id": page["id"], "database_id": database_id, "properties": {}}
+        self._write(page, payload.get("properties", {}))
+        return page
+
+    def _write(self, page: dict, properties: dict) -> None:
+        page["properties"].update({name: _offline_property_value(value) for name, value in properties.items()})
+        page["last_edited_time"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+        entry = self.bundle.setdefault(page["id"], {"portfolio": current_portfolio().name, "page_id": page["id"], "properties": {}})
+        entry["properties"].update(json.loads(json.dumps(properties)))
+
+    def _bcb_series(self, url: str, path: str, params: dict) -> requests.Response:
+        serie_id = int(re.search(r"bcdata\.sgs\.(\d+)", path).group(1))
+        start_date = datetime.strptime(params["dataInicial"], "%d/%m/%Y").date()
+        end_date = datetime.strptime(params["dataFinal"], "%d/%m/%Y").date()
+        return _offline_response(200, [item for day, item in self.bcb_series.get(serie_id, []) if start_date <= day <= end_date], url)
+
+    def write_bundle(self, path: str) -> int:
+        """Grava o bundle (uma entrada JSON por linha). A chave de cada entrada é o hash do seu conteúdo."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.bundle.values():
+                content = {name: entry[name] for name in ("page_id", "database_id", "properties") if name in entry}
+                key = hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+                f.write(json.dumps({"key": key, **entry}) + "\n")
+        os.replace(tmp_path, path)
+        return len(self.bundle)
+
+def compute_offline_patch_bundle(snapshot_path: Optional[str] = None, bundle_path: Optional[str] = None) -> bool:
+    """--compute: cadeia de renda fixa de todas as carteiras contra o snapshot; as escritas vão para o bundle."""
+    config = current_config()
+    snapshot_path = config.offline_snapshot_file if snapshot_path is None else snapshot_path
+    bundle_path = config.patch_bundle_file if bundle_path is None else bundle_path
+    try:
+        with open(snapshot_path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        log_and_print(f"Snapshot offline {snapshot_path} ilegível: {e}", level="error")
+        return False
+    exported_at = snapshot.get("exported_at", "")
+    log_and_print(f"Calculando a partir do snapshot de {exported_at}...")
+    if exported_at[:10] != date.today().isoformat():
+        log_and_print("Snapshot de outro dia: taxas do BCB posteriores ao export não entram no cálculo.", level="warning")
+
+    from .engine import Engine  # import local: engine importa este módulo
+
+    # Engine próprio para o compute: o Engine atual (e outras threads que o usam) continua com as sessões online
+    session = OfflineNotionSession(snapshot)
+    with Engine(config, http=session, notion_http=session).activate():
+        for_each_portfolio(run_fixed_income_chain)
+    count = session.write_bundle(bundle_path)
+    log_and_print(f"Bundle gravado em {bundle_path}: {count} páginas a escrever.")
+    return True
+
+_applied_patches_lock = threading.Lock()
+
+def _read_applied_patches(path: str) -> Dict[str, str]:
+    """Chave da entrada -> id da página gravada, das entradas já aplicadas (arquivo <bundle>.applied)."""
+    applied: Dict[str, str] = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # linha truncada por uma queda durante a escrita
+                applied[entry["key"]] = entry["page_id"]
+    except FileNotFoundError:
+        pass
+    return applied
+
+def _append_applied_patch(path: str, key: str, page_id: str) -> None:
+    with _applied_patches_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"key": key, "page_id": page_id}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _offline_references(entry: dict) -> set:
+    """Ids provisórios citados nas relações da entrada (páginas criadas por outras entradas do bundle)."""
+    return {
+        item["id"]
+        for value in entry["properties"].values()
+        for item in value.get("relation") or []
+        if item["id"].startswith(OFFLINE_ID_PREFIX)
+    }
+
+def _apply_patch_entry(entry: dict, resolved: Dict[str, str]) -> str:
+    properties = {
+        name: {**value, "relation": [{"id": resolved.get(item["id"], item["id"])} for item in value["relation"]]}
+        if "relation" in value else value
+        for name, value in entry["properties"].items()
+    }
+    if "database_id" in entry:
+        payload = {"parent": {"database_id": entry["database_id"]}, "properties": properties}
+        response = notion_request("POST", "https://api.notion.com/v1/pages", json=payload, timeout=20)
+    else:
+        response = notion_request("PATCH", f"https://api.notion.com/v1/pages/{entry['page_id']}", json={"properties": properties}, timeout=20)
+    response.raise_for_status()
+    return response.json()["id"]
+
+def apply_patch_bundle(path: Optional[str] = None) -> None:
+    """
+    --apply: envia ao Notion as entradas do bundle da carteira atual.
+    Cada entrada escreve uma página diferente, então as prontas vão em paralelo (APPLY_WORKERS); uma entrada que
+    cita páginas criadas no compute espera a rodada em que os ids reais delas são conhecidos.
+    Entradas aplicadas ficam em <bundle>.applied e são puladas ao repetir o apply (ex.: depois de uma queda).
+    """
+    config = current_config()
+    path = config.patch_bundle_file if path is None else path
+    portfolio = current_portfolio()
+    applied_path = path + ".applied"
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError) as e:
+        log_and_print(f"Bundle {path} ilegível: {e}", level="error")
+        return
+    entries = [entry for entry in entries if entry.get("portfolio", "") == portfolio.name]
+    applied = _read_applied_patches(applied_path)
+    resolved = {entry["page_id"]: applied[entry["key"]] for entry in entries if "database_id" in entry and entry["key"] in applied}
+    pending = [entry for entry in entries if entry["key"] not in applied]
+    if len(pending) < len(entries):
+        log_and_print(f"{len(entries) - len(pending)} entradas do bundle já aplicadas. Pulando.")
+
+    written = failed = 0
+    while pending and not current_engine().shutdown_event.is_set():
+        ready = [entry for entry in pending if _offline_references(entry) <= resolved.keys()]
+        if not ready:
+            log_and_print(f"{len(pending)} entradas dependem de páginas que não foram criadas. Não aplicadas.", level="error")
+            break
+        with ThreadPoolExecutor(max_workers=min(config.apply_workers, len(ready)), thread_name_prefix="apply") as pool:
+            futures = {pool.submit(contextvars.copy_context().run, _apply_patch_entry, entry, resolved): entry for entry in ready}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    page_id = future.result()
+                except Exception as e:
+                    log_and_print(f"Erro ao aplicar a entrada da página {entry['page_id']}: {e}", level="error")
+                    failed += 1
+                    continue
+                _append_applied_patch(applied_path, entry["key"], page_id)
+                if "database_id" in entry:
+                    resolved[entry["page_id"]] = page_id
+                written += 1
+        ready_ids = {entry["page_id"] for entry in ready}
+        pending = [entry for entry in pending if entry["page_id"] not in ready_ids]
+    log_and_print(f"Bundle aplicado: {written} páginas escritas, {failed} com erro.")
+
+# ------------------ PLANEJAMENTO DO RUN ------------------
+
+# Ordem da cascata de cotações (_fetch_price_cascade)
+QUOTE_CASCADE = ["eod", "brapi", "twelve_data", "alpha_vantage", "finnhub", "yahoo"]
+# Latência assumida (segundos por chamada) enquanto não houver medição em RUN_STATS_FILE
+DEFAULT_LATENCY_SECONDS = {"notion": 0.4, "bcb": 1.0, **{provider: 0.7 for provider in QUOTE_CASCADE}}
+
+class RunStats:
+    """
+    Medições dos runs, persistidas em RUN_STATS_FILE para o planejador (--plan):
+    latência por host (média móvel exponencial, sem as esperas do limitador) e, por ticker,
+    os provedores chamados na última cotação bem-sucedida (o último é o que respondeu).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._changed = False
+        self._state: dict = {"latency": {}, "quote_traces": {}}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            log_and_print(f"Erro ao ler {path}: {e}. Medições dos runs recomeçam vazias.", level="warning")
+
+    def record_latency(self, host: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._state["latency"].get(host)
+            self._state["latency"][host] = seconds if previous is None else 0.1 * seconds + 0.9 * previous
+            self._changed = True
+
+    def latency(self, host: str) -> float:
+        with self._lock:
+            return self._state["latency"].get(host, DEFAULT_LATENCY_SECONDS[host])
+
+    def record_quote_trace(self, ticker: str, providers: List[str]) -> None:
+        with self._lock:
+            if self._state["quote_traces"].get(ticker) != providers:
+                self._state["quote_traces"][ticker] = providers
+                self._changed = True
+
+    def quote_trace(self, ticker: str) -> Optional[List[str]]:
+        with self._lock:
+            return self._state["quote_traces"].get(ticker)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._changed:
+                return
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._state, f)
+                os.replace(tmp_path, self.path)
+                self._changed = False
+            except Exception as e:
+                log_and_print(f"Erro ao gravar {self.path}: {e}", level="warning")
+
+@dataclass
+class RunPlan:
+    """Estimativa de um run da carteira: chamadas por host, consumo de cota por provedor e duração."""
+    notion_reads: int = 0
+    notion_writes: int = 0
+    bcb_calls: int = 0
+    quote_calls: Dict[str, int] = field(default_factory=dict)
+    quota_remaining: Dict[str, Optional[int]] = field(default_factory=dict)
+    tickers: int = 0
+    cached_tickers: int = 0
+    unquoted_tickers: List[str] = field(default_factory=list)
+    skipped_tickers: List[str] = field(default_factory=list)
+    vi_seconds: float = 0.0
+    fi_seconds: float = 0.0
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        return self.vi_seconds + self.fi_seconds
+
+    def report_lines(self) -> List[str]:
+        quota = ", ".join(
+            f"{PROVIDER_NAMES[provider]} {calls}"
+            + (f"/{self.quota_remaining[provider]} restantes" if self.quota_remaining.get(provider) is not None else "")
+            for provider, calls in self.quote_calls.items() if calls
+        ) or "nenhuma"
+        lines = [
+            f"Notion: {self.notion_reads} leituras, {self.notion_writes} escritas; BCB: {self.bcb_calls} blocos.",
+            f"Cotações: {self.tickers} tickers ({self.cached_tickers} em cache, {len(self.unquoted_tickers)} sem cota); "
+            f"chamadas por provedor: {quota}.",
+            f"Duração estimada: {self.total_seconds:.0f}s (renda variável {self.vi_seconds:.0f}s, renda fixa {self.fi_seconds:.0f}s).",
+        ]
+        if self.skipped_tickers:
+            lines.append(f"Ajuste ao prazo: {len(self.skipped_tickers)} tickers de menor prioridade ficam para o próximo run.")
+        return lines + self.notes
+
+def _notion_pages(count: int) -> int:
+    """Requisições de uma consulta paginada (100 páginas por requisição; uma mesmo sem resultados)."""
+    return max(1, -(-count // 100))
+
+def _take_quota(remaining: Dict[str, Optional[int]], provider: str) -> bool:
+    left = remaining.get(provider)
+    if left is None:
+        return True
+    if left <= 0:
+        return False
+    remaining[provider] = left - 1
+    return True
+
+def simulate_quote(ticker: str, remaining: Dict[str, Optional[int]]) -> Tuple[List[str], bool]:
+    """
+    Provedores que a cascata chamaria para o ticker, consumindo `remaining` (cota simulada).
+    Repete a sequência do último run (RUN_STATS_FILE); sem histórico, assume o primeiro provedor.
+    Se o provedor que respondeu está sem cota, o seguinte da cascata com cota responde (o BRAPI só para tickers brasileiros).
+    Retorna (provedores chamados, se alguém responde).
+    """
+    trace = current_engine().run_stats.quote_trace(ticker) or [QUOTE_CASCADE[0]]
+    calls = [provider for provider in trace[:-1] if _take_quota(remaining, provider)]
+    winner = trace[-1]
+    if _take_quota(remaining, winner):
+        return calls + [winner], True
+    for provider in QUOTE_CASCADE[QUOTE_CASCADE.index(winner) + 1:]:
+        if not _take_quota(remaining, provider):
+            continue
+        calls.append(provider)
+        if provider != "brapi" or is_brazilian_ticker(ticker):
+            return calls, True
+    return calls, False
+
+def _simulate_withdrawal_allocations(withdrawals: List[FixedIncomeWithdrawal], contracts: List[FixedIncomeContract]) -> int:
+    """Alocações que o LIFO criaria (um registro por contrato debitado), sem gravar nada."""
+    balances = {contract.id: contract.balance for contract in contracts if not contract.closed}
+    by_asset: Dict[str, List[FixedIncomeContract]] = {}
+    for contract in contracts:
+        by_asset.setdefault(contract.asset_id, []).append(contract)
+    for asset_contracts in by_asset.values():
+        asset_contracts.sort(key=lambda c: (c.contribution_date or date.min, c.unique_id or 0), reverse=True)
+    allocations = 0
+    for wd in sorted(withdrawals, key=lambda wd: wd.date or date.min):
+        remaining = wd.amount
+        for contract in by_asset.get(wd.asset_id, []):
+            if remaining <= 0:
+                break
+            available = balances.get(contract.id, 0.0)
+            if available <= 0:
+                continue
+            deduction = min(available, remaining)
+            balances[contract.id] = available - deduction
+            remaining -= deduction
+            allocations += 1
+    return allocations
+
+@dataclass
+class PlanInputs:
+    """O que o planejador sabe da carteira: ativos de renda variável (com a flag de exterior) e o estado da renda fixa."""
+    assets: List[Tuple[VariableIncomeAsset, bool]]
+    contracts: List[FixedIncomeContract]
+    open_contracts: List[FixedIncomeContract]
+    withdrawals: List[FixedIncomeWithdrawal] = field(default_factory=list)
+    unlinked_contributions: int = 0
+    allocation_count: int = 0
+    asset_count: int = 0
+    contribution_count: int = 0
+
+def _iso_date(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(value[:10]) if value else None
+
+def _plan_inputs_from_snapshot(portfolio: Portfolio) -> PlanInputs:
+    snapshot = portfolio.query_snapshot
+    assets = [
+        (VariableIncomeAsset(
+            id=row["page_id"], ticker=row.get("ticker"), unit_price=row.get("price"),
+            last_update=_iso_date(row.get("updated_at")), currency=row.get("currency"),
+        ), bool(row.get("foreign")))
+        for row in snapshot.query("prices", {})
+    ]
+    contracts = [
+        FixedIncomeContract(
+            id=row["id"], asset_id=row["asset"], contribution_id=None,
+            contribution_date=_iso_date(row.get("contribution_date")),
+            indexer=row["indexer"], indexer_pct=row.get("indexer_pct") or 1.0, fixed_rate=row.get("fixed_rate") or 0.0,
+            due_date=_iso_date(row.get("due_date")), principal=row.get("principal"), balance=row["balance"],
+            last_update=_iso_date(row.get("last_update")), last_rate_date=_iso_date(row.get("last_rate_date")),
+            closed=False, unique_id=0,
+        )
+        for row in snapshot.query("contracts", {})
+    ]
+    return PlanInputs(
+        assets=assets, contracts=contracts, open_contracts=contracts,
+        allocation_count=len(snapshot.query("allocations", {})),
+        asset_count=len({contract.asset_id for contract in contracts}), contribution_count=len(contracts),
+    )
+
+def _plan_inputs_from_notion(portfolio: Portfolio) -> PlanInputs:
+    assets: List[Tuple[VariableIncomeAsset, bool]] = []
+    for database_id, properties, foreign in (
+        (portfolio.vi_assets_database_id, VI_ASSET_PROPERTIES, False),
+        (portfolio.vi_foreign_assets_database_id, VI_FOREIGN_ASSET_PROPERTIES, True),
+    ):
+        for asset in get_all_pages_from_notion(
+            database_id, record_parser=parse_variable_income_asset, properties=list(dict.fromkeys(properties + VI_PRIORITY_PROPERTIES))
+        ) or []:
+            assets.append((asset, foreign))
+    load_fixed_income_reference_data()
+    contracts = get_all_pages_from_notion(
+        portfolio.fi_contracts_database_id, record_parser=parse_fixed_income_contract, properties=FI_CONTRACT_PROPERTIES
+    ) or []
+    return PlanInputs(
+        assets=assets,
+        contracts=contracts,
+        open_contracts=[c for c in contracts if not c.closed and c.contribution_id],
+        withdrawals=get_unprocessed_withdrawals(),
+        unlinked_contributions=sum(1 for c in portfolio.fi_contributions_by_id.values() if not c.contract_id),
+        allocation_count=len(get_all_pages_from_notion(portfolio.fi_allocations_database_id, properties=FI_ALLOCATION_PROPERTIES) or []),
+        asset_count=len(portfolio.fi_assets_by_id),
+        contribution_count=len(portfolio.fi_contributions_by_id),
+    )
+
+def plan_run(source: str = "notion", target_seconds: Optional[float] = None, today: Optional[date] = None) -> RunPlan:
+    """
+    Estima o run completo da carteira atual sem efeitos colaterais: lê os databases (source="notion", só consultas)
+    ou o snapshot da API de consulta (source="snapshot", sem tráfego; não conhece aportes e saques novos),
+    simula a cascata de cotações contra a cota restante e o cache de cotações, e estima a duração pelas latências medidas.
+    Com `target_seconds`, descarta os tickers de menor prioridade (mesma ordem do --time-budget) até o run caber no prazo.
+    """
+    engine = current_engine()
+    config = current_config()
+    today = today or date.today()
+    portfolio = current_portfolio()
+    plan = RunPlan()
+    if source == "snapshot":
+        inputs = _plan_inputs_from_snapshot(portfolio)
+        plan.notes.append("Fonte: snapshot local (aportes e saques ainda não processados não entram na estimativa).")
+    else:
+        inputs = _plan_inputs_from_notion(portfolio)
+    assets = inputs.assets
+
+    notion_seconds = max(engine.run_stats.latency("notion"), 1 / config.notion_requests_per_second)
+    databases = [
+        database_id for database_id in (
+            portfolio.vi_assets_database_id, portfolio.vi_foreign_assets_database_id, portfolio.fi_assets_database_id,
+            portfolio.fi_contributions_database_id, portfolio.fi_contracts_database_id,
+            portfolio.fi_withdrawals_database_id, portfolio.fi_allocations_database_id,
+        ) if database_id
+    ]
+    schema_reads = sum(1 for database_id in databases if database_id not in engine.notion_property_ids)
+
+    # Renda variável: uma busca por ticker único (cache de cotações e single-flight), uma escrita por ativo com preço
+    assets.sort(key=lambda item: variable_income_priority(item[0], today))
+    remaining = {provider: engine.quota_ledger.remaining(provider) for provider in engine.quota_ledger.keys}
+    plan.quota_remaining = dict(remaining)
+    with engine.quote_lock:
+        cached = {ticker for ticker, (_, fetched_at) in engine.quote_cache.items() if time.monotonic() - fetched_at < config.quote_cache_ttl_seconds}
+    ticker_cost: Dict[str, Tuple[float, List[str], bool]] = {}
+    for asset, _ in assets:
+        if not asset.ticker or asset.ticker in ticker_cost:
+            continue
+        if asset.ticker in cached:
+            ticker_cost[asset.ticker] = (0.0, [], True)
+            continue
+        calls, answered = simulate_quote(asset.ticker, remaining)
+        ticker_cost[asset.ticker] = (sum(engine.run_stats.latency(provider) for provider in calls), calls, answered)
+    plan.tickers = len(ticker_cost)
+    plan.cached_tickers = sum(1 for ticker in ticker_cost if ticker in cached)
+    plan.unquoted_tickers = [ticker for ticker, (_, _, answered) in ticker_cost.items() if not answered]
+
+    vi_reads = sum(
+        _notion_pages(sum(1 for _, foreign in assets if foreign == (index == 1)))
+        for index, database_id in enumerate((portfolio.vi_assets_database_id, portfolio.vi_foreign_assets_database_id))
+        if database_id
+    )
+    fx_calls = 1 if any(foreign for _, foreign in assets) else 0
+
+    def vi_estimate(skipped: set) -> Tuple[float, int, Dict[str, int]]:
+        quote_calls = {provider: 0 for provider in QUOTE_CASCADE}
+        seconds = 0.0
+        for ticker, (cost, calls, _) in ticker_cost.items():
+            if ticker in skipped:
+                continue
+            seconds += cost
+            for provider in calls:
+                quote_calls[provider] += 1
+        writes = sum(1 for asset, _ in assets if asset.ticker and asset.ticker not in skipped and ticker_cost[asset.ticker][2])
+        seconds += (vi_reads + writes) * notion_seconds + fx_calls * engine.run_stats.latency("twelve_data")
+        return seconds, writes, quote_calls
+
+    # Renda fixa (identity map do run): referência, aportes novos, saques (LIFO), uma escrita por contrato aberto.
+    # Com saques, o LIFO lê todos os contratos; sem saques, só os abertos.
+    fi_reads = _notion_pages(inputs.asset_count) + _notion_pages(inputs.contribution_count) + _notion_pages(len(inputs.withdrawals))
+    fi_reads += _notion_pages(len(inputs.contracts) if inputs.withdrawals else len(inputs.open_contracts))
+    fi_reads += _notion_pages(inputs.allocation_count)
+    allocations_created = _simulate_withdrawal_allocations(inputs.withdrawals, inputs.contracts)
+    fi_writes = (
+        2 * inputs.unlinked_contributions  # criação do contrato + primeira atualização
+        + allocations_created + len(inputs.withdrawals)  # alocações + marcação do saque
+        + len(inputs.open_contracts)
+    )
+    windows = bcb_windows_for_contracts(inputs.open_contracts, today)
+    plan.bcb_calls = sum(len(_missing_bcb_chunks(serie_id, start, end)) for serie_id, start, end in windows)
+    bcb_seconds = plan.bcb_calls * engine.run_stats.latency("bcb") / max(1, min(config.bcb_fetch_workers, plan.bcb_calls))
+    plan.fi_seconds = (fi_reads + fi_writes) * notion_seconds + bcb_seconds
+
+    skipped: set = set()
+    plan.vi_seconds, vi_writes, plan.quote_calls = vi_estimate(skipped)
+    if target_seconds is not None and plan.total_seconds > target_seconds:
+        # Mesma ordem de prioridade do --time-budget: os tickers do fim da lista saem primeiro
+        for asset, _ in reversed(assets):
+            if plan.total_seconds <= target_seconds:
+                break
+            if not asset.ticker or asset.ticker in skipped:
+                continue
+            skipped.add(asset.ticker)
+            plan.vi_seconds, vi_writes, plan.quote_calls = vi_estimate(skipped)
+        plan.skipped_tickers = sorted(skipped)
+        if plan.total_seconds > target_seconds:
+            plan.notes.append(f"Mesmo sem renda variável, a renda fixa estimada ({plan.fi_seconds:.0f}s) excede o prazo de {target_seconds:.0f}s.")
+
+    plan.notion_reads = schema_reads + vi_reads + fi_reads
+    plan.notion_writes = vi_writes + fi_writes
+    for provider, calls in plan.quote_calls.items():
+        left = plan.quota_remaining.get(provider)
+        if left is not None and calls >= left and calls:
+            plan.notes.append(f"{PROVIDER_NAMES[provider]} esgota a cota restante ({left}) neste run.")
+    return plan
+
+def print_run_plan(source: str = "notion", target_seconds: Optional[float] = None) -> RunPlan:
+    """Modo --plan: imprime a estimativa do run da carteira atual (nenhuma escrita no Notion, nenhuma cotação buscada)."""
+    plan = plan_run(source, target_seconds)
+    log_and_print("Plano do run:")
+    for line in plan.report_lines():
+        log_and_print(f"  {line}")
+    return plan
+
+def apply_run_plan(target_seconds: float) -> None:
+    """--auto-scale: planeja o run e deixa de fora os tickers que não cabem no prazo (ficam para o próximo run)."""
+    plan = print_run_plan("notion", target_seconds)
+    current_portfolio().skip_tickers = set(plan.skipped_tickers)
+
+# ------------------ API LOCAL DE CONSULTA ------------------
+
+QUERY_API_RESOURCES = ("prices", "contracts", "allocations", "rates")
+
+class QueryApiHandler(BaseHTTPRequestHandler):
+    """
+    GET /v1/<recurso>[?portfolio=<nome>&asset=<page id ou ticker>&...] com o snapshot da carteira, em JSON.
+    Recursos: prices, contracts (include_closed=1), allocations (contract=<id>), rates (series=CDI|SELIC|IPCA, start, end).
+    Responde 304 quando If-None-Match coincide com o ETag do conteúdo.
+    """
+    server_version = "NotionFinanceQueryAPI/1"
+    # Configurados por start_query_api
+    portfolios: List[Portfolio] = []
+    reload_from_disk = False
+    _responses: Dict[Tuple[str, str, Tuple[Tuple[str, str], ...]], Tuple[int, bytes, str]] = {}
+    _responses_lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if len(segments) != 2 or segments[0] != "v1" or segments[1] not in QUERY_API_RESOURCES:
+            self._send_json(404, {"error": f"Recurso desconhecido: {parts.path}", "resources": list(QUERY_API_RESOURCES)})
+            return
+        portfolio = self._portfolio(params.pop("portfolio", None))
+        if portfolio is None:
+            self._send_json(404, {"error": "Carteira desconhecida.", "portfolios": [p.name for p in self.portfolios]})
+            return
+
+        snapshot = portfolio.query_snapshot
+        if self.reload_from_disk:
+            snapshot.reload_if_changed()
+        cache_key = (portfolio.name, segments[1], tuple(sorted(params.items())))
+        with self._responses_lock:
+            cached = self._responses.get(cache_key)
+        if cached is None or cached[0] != snapshot.version:
+            version = snapshot.version
+            content = snapshot.query(segments[1], params)
+            body = json.dumps({"portfolio": portfolio.name, segments[1]: content}, ensure_ascii=False).encode("utf-8")
+            cached = (version, body, f'"{hashlib.sha1(body).hexdigest()[:20]}"')
+            with self._responses_lock:
+                self._responses[cache_key] = cached
+        _, body, etag = cached
+
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send_body(200, body, etag)
+
+    def _portfolio(self, name: Optional[str]) -> Optional[Portfolio]:
+        if name is None:
+            return self.portfolios[0] if len(self.portfolios) == 1 else None
+        return next((portfolio for portfolio in self.portfolios if portfolio.name == name), None)
+
+    def _send_json(self, status: int, content: dict) -> None:
+        self._send_body(status, json.dumps(content, ensure_ascii=False).encode("utf-8"))
+
+    def _send_body(self, status: int, body: bytes, etag: Optional[str] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("API de consulta: " + format, *args)
+
+def start_query_api(portfolios: List[Portfolio], port: Optional[int] = None, host: Optional[str] = None,
+                    reload_from_disk: bool = False) -> ThreadingHTTPServer:
+    """
+    Sobe a API local de consulta (somente leitura) em uma thread. Com várias carteiras, o parâmetro `portfolio` é obrigatório.
+    reload_from_disk: relê o snapshot gravado por outro processo (modo `--serve`, sem updater no mesmo processo).
+    """
+    config = current_config()
+    port = config.query_api_port if port is None else port
+    host = config.query_api_host if host is None else host
+    handler = type("BoundQueryApiHandler", (QueryApiHandler,), {
+        "portfolios": portfolios,
+        "reload_from_disk": reload_from_disk,
+        "_responses": {},
+        "_responses_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=contextvars.copy_context().run, args=(server.serve_forever,), name="query-api", daemon=True).start()
+    log_and_print(f"API de consulta em http://{host}:{server.server_address[1]}/v1/ ({', '.join(QUERY_API_RESOURCES)}).")
+    return server
+
+def save_query_snapshot() -> None:
+    try:
+        current_portfolio().query_snapshot.save()
+    except Exception as e:
+        log_and_print(f"Erro ao gravar o snapshot de consulta: {e}", level="error")
+
+def run_query_api_server() -> None:
+    """Modo --serve: só a API de consulta, servindo os snapshots gravados pelo updater até SIGTERM/SIGINT."""
+    _install_daemon_signal_handlers()
+    portfolios = all_portfolios()
+    server = start_query_api(portfolios, port=current_config().query_api_port or QUERY_API_DEFAULT_PORT, reload_from_disk=True)
+    while not current_engine().shutdown_event.wait(DAEMON_TICK_SECONDS):
+        pass
+    server.shutdown()
+    log_and_print("API de consulta encerrada.")
+
+# ------------------ MODO DAEMON ------------------
+
+def request_refresh():
+    """Agenda uma atualização completa (renda variável + renda fixa) no próximo ciclo do daemon."""
+    current_engine().request_refresh()
+
+def request_shutdown():
+    """Solicita encerramento gracioso: a etapa em andamento termina o item atual e o daemon sai."""
+    current_engine().shutdown()
+
+def _install_daemon_signal_handlers():
+    # Sinais só podem ser tratados na thread principal; embutido em outra thread, o Engine para por engine.shutdown()
+    if threading.current_thread() is not threading.main_thread():
+        return
+    engine = current_engine()
+    signal.signal(signal.SIGTERM, lambda signum, frame: engine.shutdown())
+    signal.signal(signal.SIGINT, lambda signum, frame: engine.shutdown())
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: engine.request_refresh())
+
+def run_daemon():
+    """
+    Modo residente: mantém caches (BCB, cotações, feriados) e conexões HTTP aquecidos entre ciclos.
+    - Renda variável: a cada DAEMON_VI_INTERVAL_MINUTES, apenas tickers com pregão aberto (B3/NYSE).
+    - Renda fixa: cadeia aportes -> saques -> contratos uma vez por dia, após DAEMON_FI_RUN_AFTER (Brasília).
+    - SIGUSR1 (ou request_refresh) força uma atualização completa; SIGTERM/SIGINT encerram de forma graciosa.
+    """
+    engine = current_engine()
+    config = current_config()
+    _install_daemon_signal_handlers()
+    fi_run_after = dtime.fromisoformat(config.daemon_fi_run_after)
+    vi_interval = config.daemon_vi_interval_minutes * 60
+    last_vi_run: Optional[float] = None
+    last_fi_run_date: Optional[date] = None
+
+    log_and_print(f"Daemon iniciado (PID {os.getpid()}). Renda variável a cada {config.daemon_vi_interval_minutes} min; renda fixa após {config.daemon_fi_run_after}.")
+
+    while not engine.shutdown_event.is_set():
+        engine.daemon_wake.clear()
+        now = datetime.now(BRT)
+
+        try:
+            if engine.refresh_event.is_set():
+                engine.refresh_event.clear()
+                log_and_print("Atualização sob demanda solicitada.")
+                for_each_portfolio(update_all_variable_income_assets)
+                last_vi_run = time.monotonic()
+                invalidate_bcb_cache_tail()
+                for_each_portfolio(run_journaled_fixed_income_chain)
+                last_fi_run_date = now.date()
+            else:
+                if is_any_market_open() and (last_vi_run is None or time.monotonic() - last_vi_run >= vi_interval):
+                    for_each_portfolio(lambda: update_all_variable_income_assets(only_open_markets=True))
+                    last_vi_run = time.monotonic()
+
+                if now.time() >= fi_run_after and last_fi_run_date != now.date():
+                    invalidate_bcb_cache_tail()
+                    for_each_portfolio(run_journaled_fixed_income_chain)
+                    last_fi_run_date = now.date()
+            for_each_portfolio(flush_portfolio_summary)
+            for_each_portfolio(save_query_snapshot)
+            engine.run_stats.save()
+            engine.quota_ledger.save()
+        except Exception as e:
+            log_and_print(f"Erro no ciclo do daemon: {e}", level="error")
+
+        engine.daemon_wake.wait(timeout=DAEMON_TICK_SECONDS)
+
+    log_and_print("Daemon encerrado.")
+
+def run_update():
+    """Atualização completa da carteira atual: renda variável e cadeia de renda fixa, dentro de um run do journal."""
+    engine = current_engine()
+    journal = current_portfolio().journal
+    current_portfolio().skip_tickers = set()
+    # Estatísticas de payload do relatório são por run (a carteira sobrevive entre runs de um Engine reutilizado)
+    current_portfolio().payload_stats.clear()
+    if engine.auto_scale and engine.run_deadline is not None:
+        # O relógio do prazo já corre (inclusive durante as leituras do próprio planejador): planeja o que resta
+        apply_run_plan(engine.run_deadline.remaining() - engine.run_deadline.safety_seconds)
+    # Um run interrompido (queda, kill) fica sem "run_end" no journal e é retomado aqui,
+    # pulando estágios concluídos e reconciliando escritas que ficaram pela metade.
+    journal.begin_run()
+    run_stage("variable_income", update_all_variable_income_assets)
+    run_fixed_income_chain()
+    flush_portfolio_summary()
+    save_query_snapshot()
+    journal.end_run()
+    report_notion_payload_savings()
+
+def run_all(time_budget: Optional[float] = None, auto_scale: bool = False):
+    """Run completo de todas as carteiras (modo padrão), com prazo opcional (--time-budget/--auto-scale)."""
+    engine = current_engine()
+    log_and_print(f"Iniciando atualização de investimentos (Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')})...")
+    if time_budget:
+        engine.run_deadline = RefreshDeadline(time_budget)
+        log_and_print(f"Prazo do run: {time_budget:.0f}s (margem {engine.run_deadline.safety_seconds:.0f}s, {engine.config.time_budget_fi_share:.0%} reservado à renda fixa).")
+        engine.auto_scale = auto_scale
+
+    try:
+        for_each_portfolio(run_update)
+    finally:
+        engine.run_deadline = None
+        engine.auto_scale = False
+        # Tickers deixados de fora pelo --auto-scale valem só para este run (o Engine pode ser reutilizado)
+        for portfolio in all_portfolios():
+            portfolio.skip_tickers = set()
+    engine.run_stats.save()
+    engine.quota_ledger.save()
+    log_and_print(f"Cota das APIs de cotação hoje: {engine.quota_ledger.summary()}")
+
+    log_and_print("Atualização concluída.")
@@ -0,0 +1,182 @@
+"""
+Engine: ponto de entrada do notion_finance para embutir o updater em outro processo.
+Cada Engine tem sua configuração, suas sessões HTTP e seus caches (BCB, cotações, câmbio, esquemas do Notion,
+cota das APIs); chamadas sucessivas ao mesmo Engine reaproveitam os caches aquecidos.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import date
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+from . import core
+from .config import EngineConfig
+
+
+class Engine:
+    """
+    Updater com configuração explícita e estado próprio.
+    http: sessão usada para BCB e provedores de cotação (padrão: requests.Session());
+    notion_http: sessão usada para a API do Notion (padrão: a mesma de `http`).
+    Os métodos de estágio rodam para todas as carteiras ou, com `portfolio`, só para a carteira com esse nome
+    (PORTFOLIOS_FILE). Métodos que rodam até shutdown() (daemon, stream, worker, API de consulta) bloqueiam.
+    """
+
+    def __init__(self, config: EngineConfig, http: Optional[requests.Session] = None,
+                 notion_http: Optional[requests.Session] = None):
+        self.config = config
+        self.http = http if http is not None else requests.Session()
+        self.notion_http = notion_http if notion_http is not None else self.http
+
+        # Caches do BCB: taxas diárias por indexador, IPCA mensal e cobertura por bloco anual de cada série
+        # (série -> {início do bloco: dia até o qual o bloco foi buscado}). O lock serializa buscas de carteiras
+        # concorrentes (a segunda encontra o cache pronto).
+        self.bcb_daily_rates: Dict[str, Dict[date, float]] = {}
+        self.ipca_monthly: Dict[date, float] = {}
+        self.bcb_chunk_coverage: Dict[int, Dict[date, date]] = {}
+        self.bcb_lock = threading.RLock()
+        # Esquema (nome -> id) por database, para a projeção de propriedades nas consultas ao Notion
+        self.notion_property_ids: Dict[str, Dict[str, str]] = {}
+        self.notion_schema_lock = threading.Lock()
+        # Cotações: ticker -> (preço, instante em time.monotonic()) e buscas em andamento (single-flight)
+        self.quote_cache: Dict[str, Tuple[float, float]] = {}
+        self.quote_inflight: Dict[str, Future] = {}
+        self.quote_lock = threading.Lock()
+        # Início do run multi-carteira: cotações buscadas desde então valem para todas as carteiras, além do TTL
+        self.quote_fresh_since: Optional[float] = None
+        # Câmbio: moeda -> (cotação em BRL, instante em time.monotonic())
+        self.fx_rates: Dict[str, Tuple[float, float]] = {}
+        self.fx_lock = threading.Lock()
+        # Limitador de requisições por token do Notion, compartilhado entre as carteiras
+        self.notion_rate_limiters: Dict[str, core.NotionRateLimiter] = {}
+        self.notion_rate_limiters_lock = threading.Lock()
+
+        self.quota_ledger = core.build_quota_ledger(config)
+        self.run_stats = core.RunStats(config.run_stats_file)
+        # Prazo do run (--time-budget) e --auto-scale; só valem dentro de run()
+        self.run_deadline: Optional[core.RefreshDeadline] = None
+        self.auto_scale = False
+
+        # Sinalização dos modos residentes: shutdown() encerra, request_refresh() força atualização completa
+        self.shutdown_event = threading.Event()
+        self.refresh_event = threading.Event()
+        self.daemon_wake = threading.Event()
+
+        self.portfolios: Optional[List[core.Portfolio]] = None
+        self.portfolios_lock = threading.Lock()
+        self._env_portfolio: Optional[core.Portfolio] = None
+
+    @property
+    def env_portfolio(self) -> core.Portfolio:
+        """Carteira da configuração (modo de carteira única), criada no primeiro uso."""
+        with self.portfolios_lock:
+            if self._env_portfolio is None:
+                with self.activate():
+                    self._env_portfolio = core.env_portfolio(self.config)
+            return self._env_portfolio
+
+    @contextmanager
+    def activate(self) -> Iterator["Engine"]:
+        """Torna este Engine o do contexto atual, para chamar funções de notion_finance.core diretamente."""
+        token = core._current_engine.set(self)
+        try:
+            yield self
+        finally:
+            core._current_engine.reset(token)
+
+    def _call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self.activate():
+            return func(*args, **kwargs)
+
+    def _for_portfolios(self, task: Callable[[], Any], portfolio: Optional[str]) -> None:
+        with self.activate():
+            if portfolio is None:
+                core.for_each_portfolio(task)
+            else:
+                with core.use_portfolio(core.portfolio_by_name(portfolio)):
+                    task()
+
+    # ------------------ ESTÁGIOS ------------------
+
+    def update_variable_income(self, portfolio: Optional[str] = None, only_open_markets: bool = False) -> None:
+        """Atualiza os preços da renda variável (B3 e exterior)."""
+        self._for_portfolios(lambda: core.update_all_variable_income_assets(only_open_markets=only_open_markets), portfolio)
+
+    def process_contributions(self, portfolio: Optional[str] = None) -> None:
+        """Cria os contratos dos aportes de renda fixa ainda sem contrato."""
+        self._for_portfolios(core.process_fixed_income_contributions, portfolio)
+
+    def process_withdrawals(self, portfolio: Optional[str] = None) -> None:
+        """Aloca os saques pendentes nos contratos (LIFO)."""
+        self._for_portfolios(core.process_withdrawals_lifo, portfolio)
+
+    def update_contracts(self, portfolio: Optional[str] = None) -> None:
+        """Atualiza saldos e variação dos contratos de renda fixa."""
+        self._for_portfolios(core.update_fixed_income_contracts, portfolio)
+
+    def update_fixed_income(self, portfolio: Optional[str] = None) -> None:
+        """Cadeia aportes -> saques -> contratos dentro de um run do journal (retomada após interrupção)."""
+        self._for_portfolios(core.run_journaled_fixed_income_chain, portfolio)
+
+    def update_history(self, portfolio: Optional[str] = None) -> None:
+        """Atualiza o histórico diário de saldos da renda fixa."""
+        self._for_portfolios(core.update_valuation_history, portfolio)
+
+    def project(self, portfolio: Optional[str] = None) -> None:
+        """Projeção Monte Carlo dos saldos de renda fixa (requer numpy)."""
+        self._for_portfolios(core.run_projection, portfolio)
+
+    def plan(self, source: str = "notion", target_seconds: Optional[float] = None, portfolio: Optional[str] = None) -> None:
+        """Estima chamadas, cota e duração do run sem executá-lo."""
+        self._for_portfolios(lambda: core.print_run_plan(source, target_seconds), portfolio)
+
+    def run(self, time_budget: Optional[float] = None, auto_scale: bool = False) -> None:
+        """Run completo de todas as carteiras: renda variável e cadeia de renda fixa."""
+        self._call(core.run_all, time_budget=time_budget, auto_scale=auto_scale)
+
+    # ------------------ EXECUÇÃO OFFLINE ------------------
+
+    def export_snapshot(self, path: Optional[str] = None) -> bool:
+        return self._call(core.export_offline_snapshot, path)
+
+    def compute_bundle(self, snapshot_path: Optional[str] = None, bundle_path: Optional[str] = None) -> bool:
+        return self._call(core.compute_offline_patch_bundle, snapshot_path, bundle_path)
+
+    def apply_bundle(self, path: Optional[str] = None, portfolio: Optional[str] = None) -> None:
+        self._for_portfolios(lambda: core.apply_patch_bundle(path), portfolio)
+
+    # ------------------ MODOS RESIDENTES ------------------
+
+    def start_query_api(self, port: Optional[int] = None, host: Optional[str] = None):
+        """Sobe a API local de consulta em uma thread, servindo os snapshots das carteiras deste Engine."""
+        with self.activate():
+            return core.start_query_api(core.all_portfolios(), port=port, host=host)
+
+    def serve_query_api(self) -> None:
+        self._call(core.run_query_api_server)
+
+    def run_daemon(self) -> None:
+        self._call(core.run_daemon)
+
+    def run_stream(self, feed: Optional[core.QuoteFeed] = None, portfolio: Optional[str] = None) -> None:
+        """Streaming de cotações (padrão: websocket do Finnhub) até shutdown(); com `portfolio`, só essa carteira."""
+        with self.activate():
+            core.run_stream(feed, None if portfolio is None else [core.portfolio_by_name(portfolio)])
+
+    def run_worker(self) -> None:
+        self._call(core.run_worker)
+
+    def run_coordinator(self) -> None:
+        self._call(core.run_coordinator)
+
+    def request_refresh(self) -> None:
+        """Agenda uma atualização completa no próximo ciclo do daemon."""
+        self.refresh_event.set()
+        self.daemon_wake.set()
+
+    def shutdown(self) -> None:
+        """Encerramento gracioso: a etapa em andamento termina o item atual e os modos residentes retornam."""
+        self.shutdown_event.set()
+        self.daemon_wake.set()
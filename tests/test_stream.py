@@ -0,0 +1,13 @@
+from notion_finance.core import _finnhub_symbol
+
+
+def test_finnhub_symbol_adds_sa_suffix_to_b3_tickers():
+    assert _finnhub_symbol("PETR4") == "PETR4.SA"
+    assert _finnhub_symbol("HGLG11") == "HGLG11.SA"
+    assert _finnhub_symbol("petr4") == "PETR4.SA"
+
+
+def test_finnhub_symbol_keeps_foreign_tickers():
+    assert _finnhub_symbol("AAPL") == "AAPL"
+    assert _finnhub_symbol("MSFT") == "MSFT"
+    assert _finnhub_symbol("BRK.B") == "BRK.B"
@@ -1,1316 +1,87 @@
-import requests
+"""
+Linha de comando do notion_finance: carrega o .env, configura o log em update_prices.log e executa o modo pedido
+sobre um Engine (ver notion_finance/engine.py).
+"""
+import argparse
 import logging
-from datetime import datetime, date, timedelta
-from dateutil import parser
-import os
-from dotenv import load_dotenv
-import holidays
-from typing import Optional, Tuple, Dict, List
-import re
-
-load_dotenv() # Carrega variáveis de ambiente do arquivo .env
-
-# CONFIGURAÇÕES ----------------------
-NOTION_TOKEN = os.getenv('NOTION_TOKEN')
-VI_ASSETS_DATABASE_ID = os.getenv('VI_ASSETS_DATABASE_ID')
-VI_FOREIGN_ASSETS_DATABASE_ID = os.getenv('VI_FOREIGN_ASSETS_DATABASE_ID')
-FI_CONTRACTS_DATABASE_ID = os.getenv('FI_CONTRACTS_DATABASE_ID')
-FI_CONTRIBUTIONS_DATABASE_ID = os.getenv('FI_CONTRIBUTIONS_DATABASE_ID')
-FI_ASSETS_DATABASE_ID = os.getenv('FI_ASSETS_DATABASE_ID')
-FI_WITHDRAWALS_DATABASE_ID = os.getenv('FI_WITHDRAWALS_DATABASE_ID')
-FI_ALLOCATIONS_DATABASE_ID = os.getenv('FI_ALLOCATIONS_DATABASE_ID')
-TWELVE_DATA_API_KEY = os.getenv('TWELVE_DATA_API_KEY')
-YAHOO_FINANCE_API_KEY = os.getenv('YAHOO_FINANCE_API_KEY')
-BRAPI_TOKEN = os.getenv('BRAPI_TOKEN')
-EOD_HISTORICAL_DATA_API_TOKEN = os.getenv('EOD_HISTORICAL_DATA_API_TOKEN')
-ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
-FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
-# -------------------------------------
-
-# Propriedades dos ativos de renda variável
-VI_TICKER = 'Ticker'
-VI_TYPE = 'Type'
-VI_UNIT_PRICE = 'Unit Price'
-VI_UPDATE_DATE = 'Last Update'
-
-# Propriedades dos contratos de renda fixa
-FI_TYPE = "Type" # Tipo de investimento (Tesouro Direto, Renda Fixa, etc)
-FI_INDEXER = "Indexer" # Indexador (SELIC, IPCA, CDI)
-FI_INDEXER_PCT = "Indexer %" # Percentual do indexador (ex: 100% do CDI)
-FI_ADDITIONAL_FIXED_RATE = "Additional Fixed Rate" # Taxa fixa adicional (para IPCA+ ou pré-fixado)
-FI_BALANCE = "Balance" # Saldo atual com juros compostos
-FI_PRINCIPAL_AMOUNT = "Principal Amount" # Valor aportado
-FI_VARIATION = "Variation" # Percentual de variação do saldo
-FI_LAST_UPDATE = "Last Update" # Data da última atualização
-FI_CONTRIBUTION_DATE = "Contribution Date" # Data da compra
-FI_DUE_DATE = "Due Date" # Data de vencimento
-FI_INFLATION = "Inflation" # Inflação (IPCA)
-FI_CLOSED = "Closed" # Fechado
-FI_CONTRACT_UNIQUE_ID = "ID" # Propriedade unique id on contracts (tie-breaker)
-FI_LAST_RATE_DATE = "Last Rate Date" # Data da última taxa diária utilizada no cálculo dos juros compostos
-
-# Propriedades dos aportes de renda fixa
-FIC_ASSET = "Asset"                     # Relation → Fixed Income Assets
-FIC_CONTRACT = "Contract"               # Relation → Fixed Income Contracts
-FIC_AMOUNT = "Amount"                   # Number
-FIC_DATE = "Date"                       # Date
-FIC_ADDITIONAL_FIXED_RATE = "Additional Fixed Rate"  # Number
-FIC_CONTRIBUTION_REL = "Contribution"  # Relation
-
-# Propriedades da tabela de saques de renda fixa
-FIW_ASSET = "Asset"
-FIW_AMOUNT = "Amount"
-FIW_DATE = "Date"  # Data em que o saque ocorreu (para timeline de juros)
-FIW_PROCESSED = "Processed"
-FIW_PROCESSING_DATE = "Processing Date"
-FIW_ALLOCATIONS_REL = "Allocations"
-FIW_PROCESSED_AMOUNT = "Processed Amount"
-
-# Propriedades de Allocation table
-FIA_WITHDRAWAL_REL = "Withdrawal"
-FIA_CONTRACT_REL = "Contract"
-FIA_AMOUNT = "Amount"
-FIA_OPERATION_DATE = "Date"
-
-br_holidays = holidays.country_holidays('BR')
-BUSY_DAYS_IN_YEAR = 252
-
-BCB_DAILY_SERIES_MAP = {
-    "SELIC": 1178,
-    "CDI": 4389,
-}
-IPCA_SERIES_ID = 433
-
-# Cache em memória para reduzir chamadas repetidas ao BCB no mesmo run.
-_bcb_daily_rates_cache: Dict[str, Dict[date, float]] = {}
-_bcb_daily_cache_range: Dict[str, Tuple[date, date]] = {}
-_ipca_monthly_cache: Dict[date, float] = {}
-_ipca_cache_range: Optional[Tuple[date, date]] = None
-
-notion_headers = {
-    "Authorization": f"Bearer {NOTION_TOKEN}",
-    "Notion-Version": "2022-06-28",
-    "Content-Type": "application/json"
-}
-
-# CONFIGURAÇÃO DO LOG ----------------
-logging.basicConfig(
-    filename='update_prices.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-# -------------------------------------
-
-# Valida se as variáveis de ambiente foram carregadas
-if not all([NOTION_TOKEN, TWELVE_DATA_API_KEY, YAHOO_FINANCE_API_KEY, BRAPI_TOKEN, VI_ASSETS_DATABASE_ID, VI_FOREIGN_ASSETS_DATABASE_ID, FI_CONTRACTS_DATABASE_ID, FI_CONTRIBUTIONS_DATABASE_ID, FI_ASSETS_DATABASE_ID, FI_WITHDRAWALS_DATABASE_ID, FI_ALLOCATIONS_DATABASE_ID, EOD_HISTORICAL_DATA_API_TOKEN, ALPHA_VANTAGE_API_KEY, FINNHUB_API_KEY]):
-    message = "Erro: Uma ou mais variáveis de ambiente não foram definidas. Verifique seu arquivo .env."
-    print(message)
-    logging.critical(message)
-    exit(1)
-
-def get_usd_brl_rate():
-    log_and_print("Buscando cotação USD/BRL...")
-    """Busca cotação USD/BRL usando cascata de APIs"""
-    # Tentativa 1 - Twelve Data
-    try:
-        url = f"https://api.twelvedata.com/price?symbol=USD/BRL&apikey={TWELVE_DATA_API_KEY}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if "price" in data:
-            return float(data["price"])
-    except Exception as e:
-        print(f"Erro Twelve Data USD/BRL: {e}")
-        
-    # Tentativa 2 - Yahoo Finance
-    try:
-        url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/market/v2/get-quotes"
-        querystring = {"symbols": "USDBRL=X", "region": "BR"}
-        headers = {
-            "X-RapidAPI-Key": YAHOO_FINANCE_API_KEY,
-            "X-RapidAPI-Host": "apidojo-yahoo-finance-v1.p.rapidapi.com"
-        }
-        response = requests.get(url, headers=headers, params=querystring, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        price = data["quoteResponse"]["result"][0]["regularMarketPrice"]
-        if price:
-            return float(price)
-    except Exception as e:
-        print(f"Erro Yahoo Finance USD/BRL: {e}")
-
-    print("Não foi possível obter a cotação USD/BRL.")
-    return None
-
-def log_and_print(message: str, level='info'):
-    print(message)
-    if level == 'info':
-        logging.info(message)
-    elif level == 'error':
-        logging.error(message)
-    elif level == 'warning':
-        logging.warning(message)
-        
-# ------------------ FUNÇÕES GERAIS -------------------------
-
-def get_net_workdays(start_date: date, end_date: date) -> int:
-    """Conta dias úteis entre duas datas excluindo feriados e fins de semana"""
-    # Se usar numpy: return np.busday_count(start_date, end_date)
-    # Implementação simples com loop (para volumes pequenos de dados é ok):
-    days = 0
-    current_date = start_date
-    while current_date < end_date:
-        current_date += timedelta(days=1)
-        if current_date.weekday() < 5 and current_date not in br_holidays:
-            days += 1
-    return days
-
-def get_all_pages_from_notion(
-    DATABASE_ID: Optional[str],
-    filter_payload: Optional[dict] = None,
-    sorts: Optional[list] = None,
-) -> Optional[list]:
-    """
-    Busca TODOS os registros de um database do Notion, tratando paginação automaticamente (Notion retorna no máximo 100 registros por requisição).
-    Suporta filtros e ordenações opcionais.
-    """
-    if not DATABASE_ID:
-        return []
-    try:
-        url = f"https://api.notion.com/v1/databases/{DATABASE_ID}/query"
-        all_pages = []
-        start_cursor = None
-
-        while True:
-            payload: dict = {"page_size": 100}
-            if filter_payload:
-                payload["filter"] = filter_payload
-            if sorts:
-                payload["sorts"] = sorts
-            if start_cursor:
-                payload["start_cursor"] = start_cursor
-
-            response = requests.post(url, headers=notion_headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            pages = data.get("results", [])
-            all_pages.extend(pages)
-
-            if not data.get("has_more", False):
-                break
-            start_cursor = data.get("next_cursor")
-            if not start_cursor:
-                break
-
-        return all_pages
-    except Exception as e:
-        log_and_print(f"Erro ao buscar dados do Notion: {e}", level='error')
-        return []
-
-def extract_asset_name_from_title(page: dict) -> Optional[str]:
-    try:
-        properties = page['properties'] # Pega as propriedades da página
-        title_field = properties[VI_TICKER] # Pega o campo do título
-        title_content = title_field.get("title", []) # O title_content é um array de objetos com o texto do título
-
-        if title_content:
-            return title_content[0].get("plain_text", "").strip() # Pega o texto do título
-        else:
-            return None
-    except Exception as e:
-        log_and_print(f"Erro ao extrair título da página: {e}", level='error')
-        return None
-    
-def is_brazilian_ticker(ticker: str) -> bool:
-    if not ticker:
-        return False
-
-    ticker = ticker.upper().strip()
-
-    pattern = r"^[A-Z0-9]{4}\d{1,2}$"
-    return bool(re.match(pattern, ticker))    
-
-# ---------------- FUNÇÕES RENDA VARIÁVEL -------------------
-
-def get_price_from_apis(ticker: str) -> Optional[float]:
-    """Lógica de cascata priorizando APIs com maior cobertura de ativos e número de requisições gratuitas"""
-
-    # 1) EOD Historical Data (forte global + BR)
-    log_and_print("Buscando preço no EOD Historical Data...")
-    eod_variations = []
-    
-    # Se parecer um ticker brasileiro, adiciona .SA
-    if is_brazilian_ticker(ticker):
-        eod_variations.append(f"{ticker}.SA")
-    
-    # Adiciona variação com .US
-    eod_variations.append(f"{ticker}.US")
-    
-    # Adiciona variação sem sufixo
-    eod_variations.append(ticker)
-    
-    for eod_ticker in eod_variations:
-        price = get_from_eod(eod_ticker)
-        if price:
-            return price
-
-    # 2) BRAPI (forte para Brasil)
-    log_and_print(f"EOD Historical Data não encontrou {ticker}, tentando BRAPI...")
-    price = get_from_brapi(ticker)
-    if price:
-        return price
-
-    # 3) Twelve Data (global)
-    log_and_print(f"BRAPI não encontrou {ticker}, tentando Twelve Data...")
-    price = get_from_twelve_data(ticker)
-    if price:
-        return price
-
-    # 4) Alpha Vantage (fallback global)
-    log_and_print(f"Twelve Data não encontrou {ticker}, tentando Alpha Vantage...")
-    price = get_from_alpha_vantage(ticker)
-    if price:
-        return price
-
-    # 5) Finnhub (fallback global)
-    log_and_print(f"Alpha Vantage não encontrou {ticker}, tentando Finnhub...")
-    price = get_from_finnhub(ticker)
-    if price:
-        return price
-
-    # 6) Yahoo Finance (fallback final) - tenta múltiplas variações de ticker
-    log_and_print(f"Finnhub não encontrou {ticker}, tentando Yahoo Finance...")
-    yahoo_variations = [
-        (ticker, "US"),  # Tenta primeiro com o ticker original (US)
-    ]
-    
-    # Se parecer um ticker brasileiro, adiciona .SA
-    if is_brazilian_ticker(ticker):
-        yahoo_variations.append((f"{ticker}.SA", "BR"))
-    
-    # Adiciona variação com .US
-    yahoo_variations.append((f"{ticker}.US", "US"))
-    
-    for eod_ticker, region in yahoo_variations:
-        price = get_from_yahoo_finance(eod_ticker, region=region)
-        if price:
-            return price
-
-    log_and_print(f"Não foi possível encontrar preço para {ticker} em nenhuma API.", level='warning')
-    return None
-
-# Twelve Data API para buscar o preço dos ativos dos EUA
-# https://twelvedata.com/docs/api/price
-def get_from_twelve_data(ticker: str) -> Optional[float]:
-    try:
-        url = f"https://api.twelvedata.com/price?symbol={ticker}&apikey={TWELVE_DATA_API_KEY}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        price_info = response.json()
-        if "price" in price_info:
-            return float(price_info["price"])
-        else:
-            return None
-    except Exception as e:
-        log_and_print(f"Erro ao buscar preço de {ticker} na Twelve Data: {e}", level='error')
-        return None
-
-def get_from_yahoo_finance(ticker: str, region: str) -> Optional[float]:
-    try:
-        # URL da API do Yahoo Finance
-        #url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-timeseries"
-        url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-summary"
-
-        querystring = {"symbol": ticker, "region": region}
-        
-        headers = {
-            "X-RapidAPI-Key": YAHOO_FINANCE_API_KEY,
-            "X-RapidAPI-Host": "apidojo-yahoo-finance-v1.p.rapidapi.com"
-        }
-        
-        response = requests.get(url, headers=headers, params=querystring, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        market_price = data.get("price", {}).get("regularMarketPrice", {}).get("raw", None)
-        
-        if market_price:
-            return float(market_price)        
-        else:
-            
-            log_and_print(f"Preço não encontrado para {ticker} no Yahoo Finance: {data}", level='warning')
-            return None
-    except Exception as e:
-        log_and_print(f"Erro ao buscar preço de {ticker} no Yahoo Finance: {e}", level='error')
-        return None
-
-def get_from_brapi(ticker: str) -> Optional[float]:
-    try:
-        url = f"https://brapi.dev/api/quote/{ticker.upper()}?token={BRAPI_TOKEN}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        results = data.get("results", [])
-        if results and "regularMarketPrice" in results[0]:
-            return float(results[0]["regularMarketPrice"])
-        else:
-            log_and_print(f"Preço não encontrado para {ticker} na Brapi: {data}", level='warning')
-            return None
-    except Exception as e:
-        log_and_print(f"Erro ao buscar {ticker} na Brapi: {e}", level='error')
-        return None
-
-def get_from_eod(ticker: str) -> Optional[float]:
-    try:
-        url = f"https://eodhistoricaldata.com/api/eod/{ticker}?api_token={EOD_HISTORICAL_DATA_API_TOKEN}&fmt=json"
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if not data:
-            log_and_print("EOD retornou lista vazia")
-            return None
-        last = data[-1]
-        price = last.get("close")
-        if price:
-            return float(price)
-    except Exception as e:
-        log_and_print(f"Erro EOD Historical para {ticker}: {e}", level='error')
-    return None
-
-def get_from_alpha_vantage(ticker: str) -> Optional[float]:
-    try:
-        url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={ALPHA_VANTAGE_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        price_str = data.get("Global Quote", {}).get("05. price")
-        if price_str:
-            return float(price_str)
-    except Exception as e:
-        log_and_print(f"Erro AlphaVantage {ticker}: {e}", level='error')
-    return None
-
-def get_from_finnhub(ticker: str) -> Optional[float]:
-    try:
-        # ajusta ticker para US ou BR
-        query_ticker = ticker
-        if ticker[-2:].isalpha() and not "." in ticker:
-            # B3 FIIs/ações
-            query_ticker = f"{ticker}.SA"
-        url = f"https://finnhub.io/api/v1/quote?symbol={query_ticker}&token={FINNHUB_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        price = data.get("c")
-        if price:
-            return float(price)
-    except Exception as e:
-        log_and_print(f"Erro Finnhub {ticker}: {e}", level='error')
-    return None
-
-
-def update_variable_income_asset_price_in_notion(page_id: str, price: float):
-    try:
-        url = f"https://api.notion.com/v1/pages/{page_id}"
-        data = {
-            "properties": {
-                VI_UNIT_PRICE: {"number": float(price)},
-                VI_UPDATE_DATE: {
-                    "date": {
-                        "start": datetime.now().isoformat()
-                    }
-                }
-            }
-        }
-        response = requests.patch(url, headers=notion_headers, json=data)
-        
-        if response.status_code == 200:
-            log_and_print(f"Preço atualizado com sucesso no Notion para {page_id}.")
-        else:
-            log_and_print(f"Erro ao atualizar o preço no Notion: {response.status_code} - {response.text}", level='error')
-        
-    except Exception as e:
-        log_and_print(f"Erro ao atualizar preço no Notion para {page_id}: {e}", level='error')
-
-def update_variable_income_assets(database_id: str):
-    log_and_print("Atualizando valores dos ativos de renda variável...")
-    # Atualiza valor dos ativos de renda variável
-    pages = get_all_pages_from_notion(database_id)
-
-    if not pages:
-        log_and_print("Nenhum ativo encontrado ou erro na consulta!", level='warning')
-        return
-
-    for page in pages:
-        page_id = page['id'] # Pega o ID da página
-
-        # Agora pegamos o ticker direto do título
-        ticker = extract_asset_name_from_title(page)
-
-        if not ticker:
-            log_and_print(f"Página {page_id} sem título (Ticker), pulando.", level='warning')
-            continue
-        
-        print(f"Encontrado ticker: {ticker}")
-
-        log_and_print(f"Atualizando {ticker}...")
-        price = get_price_from_apis(ticker)
-
-        if price:
-            update_variable_income_asset_price_in_notion(page_id, price)
-            log_and_print(f"Preço atualizado: {ticker} -> {price}")
-        else:
-            log_and_print(f"Não foi possível atualizar {ticker}.", level='warning')
-
-# ------------------ API Banco Central ------------------
-
-def _fetch_bcb_series_data(serie_id: int, start_date: date, end_date: date, timeout: int = 20) -> list:
-    """Busca uma série do BCB em um intervalo de datas."""
-    if start_date > end_date:
-        return []
-
-    url = f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{serie_id}/dados"
-    params = {
-        "formato": "json",
-        "dataInicial": start_date.strftime("%d/%m/%Y"),
-        "dataFinal": end_date.strftime("%d/%m/%Y"),
-    }
-    response = requests.get(url, params=params, timeout=timeout)
-    if response.status_code == 404:
-        return []
-    response.raise_for_status()
-    data = response.json()
-    if not isinstance(data, list):
-        return []
-    return data
-
-
-def get_bcb_daily_rates(indexer: str, start_date: date, end_date: date) -> dict:
-    """
-    Retorna taxas diárias do BCB.
-    Cada item: {date: annual_rate_decimal}
-    """
-    if start_date > end_date:
-        return {}
-    indexer_norm = (indexer or "").strip().upper()
-    serie_id = BCB_DAILY_SERIES_MAP.get(indexer_norm)
-    if not serie_id:
-        log_and_print(f"Indexador inválido: {indexer}. Retornando dicionário vazio.", level="warning")
-        return {}
-
-    cache = _bcb_daily_rates_cache.setdefault(indexer_norm, {})
-    cache_range = _bcb_daily_cache_range.get(indexer_norm)
-    ranges_to_fetch: List[Tuple[date, date]] = []
-
-    if cache_range is None:
-        ranges_to_fetch.append((start_date, end_date))
-    else:
-        cached_start, cached_end = cache_range
-        if start_date < cached_start:
-            ranges_to_fetch.append((start_date, cached_start - timedelta(days=1)))
-        if end_date > cached_end:
-            ranges_to_fetch.append((cached_end + timedelta(days=1), end_date))
-
-    if ranges_to_fetch:
-        try:
-            for chunk_start, chunk_end in ranges_to_fetch:
-                data = _fetch_bcb_series_data(serie_id, chunk_start, chunk_end, timeout=20)
-                for item in data:
-                    try:
-                        # BCB retorna DD/MM/YYYY; parser genérico pode inverter dia/mês quando dia <= 12.
-                        rate_date = datetime.strptime(item["data"], "%d/%m/%Y").date()
-                        annual_rate = float(item["valor"].replace(",", "."))
-                        cache[rate_date] = annual_rate / 100  # Ex: 11.15 vira 0.1115
-                    except Exception as parse_error:
-                        log_and_print(f"Erro ao processar entrada do BCB para {indexer_norm}: {parse_error}", level="error")
-        except Exception as e:
-            log_and_print(f"Erro ao buscar {indexer_norm} no BCB: {e}. Retornando dicionário vazio.", level="error")
-            return {}
-
-        if cache_range is None:
-            _bcb_daily_cache_range[indexer_norm] = (start_date, end_date)
-        else:
-            cached_start, cached_end = cache_range
-            _bcb_daily_cache_range[indexer_norm] = (
-                min(start_date, cached_start),
-                max(end_date, cached_end),
-            )
-
-    return {
-        rate_date: annual_rate
-        for rate_date, annual_rate in cache.items()
-        if start_date <= rate_date <= end_date
-    }
-
-def _ensure_ipca_cache(start_date: date, end_date: date) -> bool:
-    """Garante cache de IPCA mensal para o intervalo informado."""
-    global _ipca_cache_range
-    if start_date > end_date:
-        return True
-
-    ranges_to_fetch: List[Tuple[date, date]] = []
-    if _ipca_cache_range is None:
-        ranges_to_fetch.append((start_date, end_date))
-    else:
-        cached_start, cached_end = _ipca_cache_range
-        if start_date < cached_start:
-            ranges_to_fetch.append((start_date, cached_start - timedelta(days=1)))
-        if end_date > cached_end:
-            ranges_to_fetch.append((cached_end + timedelta(days=1), end_date))
-
-    if not ranges_to_fetch:
-        return True
-
-    try:
-        for chunk_start, chunk_end in ranges_to_fetch:
-            data = _fetch_bcb_series_data(IPCA_SERIES_ID, chunk_start, chunk_end, timeout=10)
-            for item in data:
-                try:
-                    month_date = datetime.strptime(item["data"], "%d/%m/%Y").date()
-                    month_ipca = float(item["valor"].replace(",", ".")) / 100
-                    _ipca_monthly_cache[month_date] = month_ipca
-                except Exception as parse_error:
-                    log_and_print(f"Erro ao processar entrada do IPCA no BCB: {parse_error}", level="error")
-    except Exception as e:
-        log_and_print(f"Erro ao buscar IPCA no BCB: {e}", level="error")
-        return False
-
-    if _ipca_cache_range is None:
-        _ipca_cache_range = (start_date, end_date)
-    else:
-        cached_start, cached_end = _ipca_cache_range
-        _ipca_cache_range = (min(start_date, cached_start), max(end_date, cached_end))
-    return True
-
-
-def get_accumulated_ipca(purchase_date: date, end_date: date) -> float:
-    """Calcula o IPCA acumulado (composto) entre purchase_date e end_date"""
-    if purchase_date > end_date:
-        return 0.0
-
-    # Força o dia 1 para garantir que a API retorne o índice do mês da compra
-    # O BCB registra o IPCA sempre no dia 01/MM/AAAA
-    start_query = purchase_date.replace(day=1)
-
-    if not _ensure_ipca_cache(start_query, end_date):
-        return 0.0
-
-    month_rates = [
-        monthly_rate
-        for month_date, monthly_rate in _ipca_monthly_cache.items()
-        if start_query <= month_date <= end_date
-    ]
-    if not month_rates:
-        log_and_print(f"Nenhum dado IPCA disponível entre {start_query} e {end_date}. Retornando 0.", level="warning")
-        return 0.0
-
-    accumulated = 1.0
-    for month_rate in month_rates:
-        accumulated *= (1 + month_rate)
-    return accumulated - 1  # retorna em decimal
-
-
-def prefetch_bcb_data_for_contracts(contracts: list, today: date) -> None:
-    """
-    Faz prefetch das séries do BCB para o maior intervalo necessário por indexador.
-    Isso reduz drasticamente o número de chamadas durante o processamento dos contratos.
-    """
-    daily_windows: Dict[str, Tuple[date, date]] = {}
-    ipca_start: Optional[date] = None
-    ipca_end: Optional[date] = None
-
-    for contract in contracts:
-        props = contract.get("properties", {})
-        try:
-            if not props.get(FI_CONTRIBUTION_DATE, {}).get("date"):
-                log_and_print(f"Contrato {contract.get('id')} sem data de aporte. Pulando.", level="warning")
-                continue
-            contribution_date = parser.parse(props[FI_CONTRIBUTION_DATE]["date"]["start"]).date()
-
-            due_date = None
-            due_rollup = props.get(FI_DUE_DATE, {}).get("rollup", {})
-            due_items = due_rollup.get("array", [])
-            if due_items:
-                date_obj = due_items[0].get("date")
-                if date_obj and date_obj.get("start"):
-                    due_date = parser.parse(date_obj["start"]).date()
-
-            end_date_cap = min(today, due_date) if due_date else today
-            if contribution_date > end_date_cap:
-                continue
-
-            indexer_rollup = props.get(FI_INDEXER, {}).get("rollup", {}).get("array", [])
-            if indexer_rollup:
-                indexer = indexer_rollup[0]["select"]["name"].upper()
-                if indexer in BCB_DAILY_SERIES_MAP:
-                    current_window = daily_windows.get(indexer)
-                    if current_window is None:
-                        daily_windows[indexer] = (contribution_date, end_date_cap)
-                    else:
-                        cur_start, cur_end = current_window
-                        daily_windows[indexer] = (
-                            min(cur_start, contribution_date),
-                            max(cur_end, end_date_cap),
-                        )
-
-            ipca_query_start = contribution_date.replace(day=1)
-            ipca_start = ipca_query_start if ipca_start is None else min(ipca_start, ipca_query_start)
-            ipca_end = end_date_cap if ipca_end is None else max(ipca_end, end_date_cap)
-        except Exception as e:
-            log_and_print(f"Erro ao preparar prefetch BCB para contrato {contract.get('id')}: {e}", level="warning")
-
-    for indexer, (range_start, range_end) in daily_windows.items():
-        get_bcb_daily_rates(indexer, range_start, range_end)
-
-    if ipca_start is not None and ipca_end is not None:
-        _ensure_ipca_cache(ipca_start, ipca_end)
-
-# ---------------- FUNÇÕES RENDA FIXA -------------------
-
-def compound_balance_period(
-    balance: float,
-    start_date: date,
-    end_date: date,
-    indexer: str,
-    indexer_pct: float,
-    fixed_rate: float,
-) -> Optional[Tuple[float, date]]:
-    """
-    Aplica juros compostos ao saldo em um período [start_date, end_date] (ambos inclusivos).
-    Retorna (novo_saldo, last_rate_date). Retorna None se não houver dados de taxa (ex.: SELIC/CDI vazios).
-    start_date == end_date aplica um único dia útil (quando houver cotação no BCB); se for fim de semana/sem série, mantém o saldo.
-    """
-    if start_date > end_date:
-        return (balance, start_date)
-    new_balance = balance
-    last_rate_date = start_date
-    if indexer in ("SELIC", "CDI"):
-        rates = get_bcb_daily_rates(indexer, start_date, end_date)
-        if not rates:
-            if start_date == end_date:
-                return (balance, start_date)
-            log_and_print(f"Pulando período: {indexer} entre {start_date} e {end_date}.", level="warning")
-            return (balance, start_date)
-        
-        # BCB já retorna apenas dias úteis, então não filtramos fins de semana/feriados aqui
-        for rate_date in sorted(rates.keys()):
-            annual_rate = rates[rate_date]
-            effective_annual_rate = (annual_rate * indexer_pct) + fixed_rate
-            daily_factor = (1 + effective_annual_rate) ** (1 / BUSY_DAYS_IN_YEAR)
-            new_balance *= daily_factor
-            last_rate_date = rate_date
-    elif indexer == "IPCA":
-        acc_ipca = get_accumulated_ipca(start_date, end_date)
-        interval_workdays = get_net_workdays(start_date, end_date)
-        real_factor = (1 + fixed_rate) ** (interval_workdays / BUSY_DAYS_IN_YEAR)
-        factor = (1 + acc_ipca) * real_factor
-        new_balance *= factor
-        last_rate_date = end_date
-    else:
-        log_and_print(f"Indexador desconhecido: {indexer}", level="warning")
-        return None
-    return (new_balance, last_rate_date)
-
-
-def recompute_contract_balance_from_timeline(
-    contract_page: dict,
-    indexer: str,
-    indexer_pct: float,
-    fixed_rate: float,
-    due_date: Optional[date],
-    today: date,
-    allocations: Optional[list] = None,
-) -> Optional[Tuple[float, date, date, float]]:
-    """
-    Recalcula o saldo do contrato a partir da timeline: aporte inicial + saques em ordem cronológica.
-    Convenção: compõe juros até a data do saque (inclusive) e só então subtrai o valor.
-    Após o saque, o próximo período começa no dia seguinte ao saque.
-    Juros só são compostos até min(today, due_date); após vencimento, apenas deduz saques (sem novos juros).
-    Retorna (novo_saldo, last_rate_date, end_date, acc_ipca) ou None se não for possível (ex.: sem aporte).
-    """
-    contract_props = contract_page.get("properties", {})
-    
-    cont_rel = contract_props.get(FIC_CONTRIBUTION_REL, {}).get("relation", [])
-    if not cont_rel:
-        log_and_print(f"O contrato {contract_page['id']} não tem aporte vinculado. Pulando.", level="warning")
-        return None
-    
-    cont_date = contract_props.get(FI_CONTRIBUTION_DATE, {}).get("date", {}).get("start")
-    if cont_date is None:
-        log_and_print(f"O contrato {contract_page['id']} não tem data de aporte. Pulando.", level="warning")
-        return None
-    
-    cont_amount = contract_props.get(FI_PRINCIPAL_AMOUNT, {}).get("rollup", {}).get("number")
-    if cont_amount is None:
-        log_and_print(f"O contrato {contract_page['id']} não tem valor de aporte. Pulando.", level="warning")
-        return None
-    
-    contribution_date = parser.parse(cont_date).date()
-    contribution_amount = float(cont_amount)
-    if allocations is None:
-        allocations = get_allocations_for_contract(contract_page["id"])
-    balance = contribution_amount
-    last_date = contribution_date
-    last_rate_date = contribution_date
-    compounding_end = min(today, due_date) if due_date else today
-    timeline_end = today
-
-    # Períodos: juros até a data do saque (inclusive), depois deduz saque, próximo período começa no dia seguinte.
-    post_due_mode = False  # quando True: subtrai saques sem mais compor juros
-    for alloc in allocations:
-        event_date = alloc["date"]
-        if event_date > timeline_end:
-            break
-
-        if not post_due_mode:
-            if event_date <= compounding_end:
-                # Juros até a data do saque (inclusive) e então subtrai.
-                period_end = event_date
-                if last_date <= period_end:
-                    result = compound_balance_period(
-                        balance,
-                        last_date,
-                        period_end,
-                        indexer,
-                        indexer_pct,
-                        fixed_rate,
-                    )
-                    if result is None:
-                        return None
-                    balance, last_rate_date = result
-
-                balance = max(0.0, balance - alloc["amount"])
-                if balance <= 0:
-                    break
-
-                # Próximo período começa no dia seguinte ao saque.
-                last_date = event_date + timedelta(days=1)
-            else:
-                # Primeiro saque após expiração: compor uma única vez até `due_date`,
-                # depois aplicar saques como dedução (sem mais juros).
-                if last_date <= compounding_end:
-                    result = compound_balance_period(
-                        balance,
-                        last_date,
-                        compounding_end,
-                        indexer,
-                        indexer_pct,
-                        fixed_rate,
-                    )
-                    if result is None:
-                        return None
-                    balance, last_rate_date = result
-                last_date = compounding_end + timedelta(days=1)
-                post_due_mode = True
-
-                balance = max(0.0, balance - alloc["amount"])
-                if balance <= 0:
-                    break
-        else:
-            # Após vencimento: apenas deduz saques.
-            balance = max(0.0, balance - alloc["amount"])
-            if balance <= 0:
-                break
-
-    # Último período de juros: até min(today, due_date)
-    if balance > 0 and not post_due_mode and last_date <= compounding_end:
-        result = compound_balance_period(
-            balance, last_date, compounding_end, indexer, indexer_pct, fixed_rate
-        )
-        if result is None:
-            return None
-        balance, last_rate_date = result
-    acc_ipca = get_accumulated_ipca(contribution_date, compounding_end)
-    return (balance, last_rate_date, timeline_end, acc_ipca)
-
-
-def update_fixed_income_contracts():
-    if FI_CONTRACTS_DATABASE_ID is None:
-        log_and_print("FI_CONTRACTS_DATABASE_ID não definido. Pulando renda fixa.", level="warning")
-        return
-    
-    log_and_print("Atualizando contratos de renda fixa...")
-
-    today = date.today()
-
-    filter_payload = {
-        "and": [
-            {
-                "property": FIC_CONTRIBUTION_REL, 
-                "relation": {"is_not_empty": True}
-            },
-            {
-                "property": FI_CLOSED, 
-                "checkbox": {"equals": False}
-            }
-        ]
-    }
-    contracts = get_all_pages_from_notion(FI_CONTRACTS_DATABASE_ID, filter_payload=filter_payload)
-    if not contracts:
-        log_and_print("Nenhum contrato de renda fixa encontrado.", level="warning")
-        return
-    
-    prefetch_bcb_data_for_contracts(contracts, today)
-
-    for contract in contracts:
-        props = contract["properties"]
-        contract_id = contract["id"]
-
-        try:
-            log_and_print(f">> Processando contrato {contract_id}...", level="debug")
-            # Indexadores
-            indexer_rollup = props[FI_INDEXER]["rollup"]["array"]
-            if not indexer_rollup:
-                log_and_print(f"Contrato {contract_id} sem indexador. Pulando.")
-                continue  
-            else:
-                indexer = indexer_rollup[0]["select"]["name"].upper()
-          
-            indexer_pct = props[FI_INDEXER_PCT]["rollup"]["number"] or 1.0
-            fixed_rate = props[FI_ADDITIONAL_FIXED_RATE]["number"] or 0.0
-            
-            # Datas
-            if not props[FI_CONTRIBUTION_DATE]["date"]:
-                log_and_print(f"Contrato {contract_id} sem data de aporte. Pulando.")
-                continue
-            contribution_date = parser.parse(props[FI_CONTRIBUTION_DATE]["date"]["start"]).date()
-            due_date = None
-
-            rollup = props[FI_DUE_DATE]["rollup"]
-            items = rollup["array"]
-
-            if items:
-                date_obj = items[0]["date"]
-                if date_obj and date_obj["start"]:
-                    due_date = parser.parse(date_obj["start"]).date()
-
-            end_date_cap = min(today, due_date) if due_date else today
-
-            # Se o contrato tem alocações (saques), recalcular saldo pela timeline (histórico cronológico)
-            allocations = get_allocations_for_contract(contract_id)
-            if allocations:
-                result = recompute_contract_balance_from_timeline(
-                    contract, indexer, indexer_pct, fixed_rate, due_date, today, allocations=allocations
-                )
-                if result is not None:
-                    new_balance, last_rate_date, end_date, acc_ipca = result
-                    is_closed = new_balance <= 0
-                    update_url = f"https://api.notion.com/v1/pages/{contract_id}"
-                    payload = {
-                        "properties": {
-                            FI_BALANCE: {"number": round(new_balance, 2)},
-                            FI_LAST_UPDATE: {"date": {"start": end_date.isoformat()}},
-                            FI_LAST_RATE_DATE: {"date": {"start": last_rate_date.isoformat()}},
-                            FI_INFLATION: {"number": round(acc_ipca, 4)},
-                            FI_CLOSED: {"checkbox": is_closed},
-                        }
-                    }
-                    resp = requests.patch(update_url, headers=notion_headers, json=payload, timeout=20)
-                    resp.raise_for_status()
-                    log_and_print(f"Renda fixa (timeline) atualizada: {contract_id} -> R${round(new_balance, 2)}")
-                else:
-                    log_and_print(f"Contrato {contract_id} com alocações mas sem aporte vinculado. Pulando.", level="warning")
-                continue
-
-            # Contrato sem saques: compõe apenas o período ainda não processado.
-            # Para SELIC/CDI, o início deve ser a próxima data após a última taxa aplicada.
-            # FI_LAST_UPDATE permanece apenas como informação de quando o script rodou.
-            last_update_str = props[FI_LAST_UPDATE]["date"]["start"] if props[FI_LAST_UPDATE]["date"] else None
-            last_update_date = parser.parse(last_update_str).date() if last_update_str else None
-            
-            last_rate_date_str = props[FI_LAST_RATE_DATE]["date"]["start"] if props[FI_LAST_RATE_DATE]["date"] else None
-            last_rate_date = parser.parse(last_rate_date_str).date() if last_rate_date_str else contribution_date
-            
-            if last_rate_date > end_date_cap:
-                last_rate_date = end_date_cap
-            
-            next_rate_start = last_rate_date
-            if last_rate_date_str is not None:
-                next_rate_start = last_rate_date + timedelta(days=1)
-
-            if indexer in ("SELIC", "CDI"):
-                start_date = max(contribution_date, next_rate_start)
-            else:
-                # Para indexadores sem defasagem diária, mantém referência em Last Update.
-                start_date = last_update_date if last_update_date else contribution_date
-                start_date = max(contribution_date, start_date)
-            
-            end_date = end_date_cap
-            
-            balance = props[FI_BALANCE]["number"] or 0
-            if balance <= 0:
-                update_url = f"https://api.notion.com/v1/pages/{contract_id}"
-                payload = {
-                    "properties": {
-                        FI_BALANCE: {"number": 0},
-                        FI_CLOSED: {"checkbox": True},
-                        FI_LAST_UPDATE: {"date": {"start": end_date.isoformat()}},
-                    }
-                }
-                resp = requests.patch(update_url, headers=notion_headers, json=payload, timeout=20)
-                resp.raise_for_status()
-                log_and_print(f"Contrato {contract_id} fechado (saldo zerado).")
-                continue
-            
-            new_balance = balance
-            
-            if start_date >= end_date:
-                log_and_print(f"Contrato {contract_id} vencido ou sem período para calcular.")
-            else:
-                result = compound_balance_period(
-                    balance, start_date, end_date, indexer, indexer_pct, fixed_rate
-                )
-                if result is None:
-                    log_and_print(f"Pulando período: {indexer} entre {start_date} e {end_date}.", level="warning")
-                    continue
-                new_balance, last_rate_date = result
-            acc_ipca = get_accumulated_ipca(contribution_date, end_date)
-            is_closed = new_balance <= 0
-                
-            # Atualiza Notion
-            update_url = f"https://api.notion.com/v1/pages/{contract_id}"
-            payload = {
-                "properties": {
-                    FI_BALANCE: {"number": round(new_balance, 2)},
-                    FI_LAST_UPDATE: {"date": {"start": end_date.isoformat()}},
-                    FI_LAST_RATE_DATE: {"date": {"start": last_rate_date.isoformat()}},
-                    FI_INFLATION: {"number": round(acc_ipca, 4)},
-                    FI_CLOSED: {"checkbox": is_closed},
-                }
-            }
-
-            resp = requests.patch(update_url, headers=notion_headers, json=payload, timeout=20)
-            resp.raise_for_status()
-
-            log_and_print(f"Renda fixa atualizada: R${round(balance, 2)} -> R${round(new_balance, 2)}")
+from typing import List, Optional
 
-        except Exception as e:
-            log_and_print(f"Erro ao atualizar renda fixa {contract_id}: {e}", level="error")
-
-def get_contribution_for_contract(contract_page: dict) -> Optional[Tuple[date, float]]:
-    """
-    Retorna (data_aporte, valor) do aporte vinculado ao contrato, ou None se não houver.
-    """
-    props = contract_page.get("properties", {})
-    rel = props.get(FIC_CONTRIBUTION_REL, {}).get("relation", [])
-    if not rel:
-        log_and_print(f"O contrato {contract_page['id']} não tem aporte vinculado. Pulando.", level="warning")
-        return None
-    contribution_id = rel[0]["id"]
-    
-    try:
-        url = f"https://api.notion.com/v1/pages/{contribution_id}"
-        response = requests.get(url, headers=notion_headers, timeout=20)
-        response.raise_for_status()
-        contribution = response.json()
-    except Exception as e:
-        log_and_print(f"Erro ao buscar página {contribution_id} do Notion: {e}", level='error')
-        return None
-    
-    contribution_props = contribution.get("properties", {})
-    amount = contribution_props.get(FIC_AMOUNT, {}).get("number")
-    date_prop = contribution_props.get(FIC_DATE, {}).get("date", {}).get("start")
-    if amount is None or not date_prop:
-        return None
-    constribution_date = parser.parse(date_prop).date()
-    return (constribution_date, float(amount))
-
-def get_allocations_for_contract(contract_id: str) -> list:
-    """
-    Retorna lista de alocações (saques) do contrato: [{"date": date, "amount": float}, ...]
-    ordenada por data (cronológica).
-    """
-    filter_payload = {
-        "property": FIA_CONTRACT_REL,
-        "relation": {"contains": contract_id}
-    }
-    try:
-        results = get_all_pages_from_notion(FI_ALLOCATIONS_DATABASE_ID, filter_payload=filter_payload) or []
-    except Exception as e:
-        log_and_print(f"Erro ao buscar alocações do contrato {contract_id}: {e}", level="error")
-        return []
-    out = []
-    for page in results:
-        props = page.get("properties", {})
-        amt = props.get(FIA_AMOUNT, {}).get("number")
-        date_prop = props.get(FIA_OPERATION_DATE, {}).get("date", {}).get("start")
-        if amt is not None and date_prop:
-            out.append({"date": parser.parse(date_prop).date(), "amount": float(amt)})
-    out.sort(key=lambda x: x["date"])
-    return out
-
-def get_unlinked_fixed_income_contributions():
-    """
-    Retorna aportes de renda fixa que ainda não possuem contrato vinculado
-    """
-    filter_payload = {
-        "property": FIC_CONTRACT,
-        "relation": {"is_empty": True}
-    }
-    pages = get_all_pages_from_notion(FI_CONTRIBUTIONS_DATABASE_ID, filter_payload=filter_payload)
-    return pages or []
-
-def create_contract_from_contribution(contribution_page: dict):
-    props = contribution_page["properties"]
-    contribution_id = contribution_page["id"]
-
-    # --- Validações básicas ---
-    if not props[FIC_ASSET]["relation"]:
-        raise ValueError("Aporte sem ativo vinculado")
-
-    today = date.today()
-    asset_id = props[FIC_ASSET]["relation"][0]["id"]
-    amount = props[FIC_AMOUNT]["number"]
-    contribution_date = parser.parse(props[FIC_DATE]["date"]["start"]).date() if props[FIC_DATE]["date"] else today
+from dotenv import load_dotenv
 
-    additional_fixed_rate = props[FIC_ADDITIONAL_FIXED_RATE]["number"] or 0.0
+from notion_finance import ConfigError, Engine, EngineConfig
 
-    # --- Criação do contrato ---
-    payload = {
-        "parent": {
-            "database_id": FI_CONTRACTS_DATABASE_ID
-        },
-        "properties": {
-            "Name": {
-                "title": [
-                    {
-                        "text": {
-                            "content": f"Contract {contribution_date.strftime('%Y-%m-%d')}"
-                        }
-                    }
-                ]
-            },
-            "Asset": {
-                "relation": [{"id": asset_id}]
-            },
-            FIC_CONTRIBUTION_REL: {
-                "relation": [{"id": contribution_id}]
-            },
-            FI_CONTRIBUTION_DATE: {
-                "date": {"start": contribution_date.isoformat()}
-            },
-            FI_ADDITIONAL_FIXED_RATE: {
-                "number": additional_fixed_rate
-            },
-            FI_BALANCE: {
-                "number": amount
-            }
-        }
-    }
 
-    response = requests.post(
-        "https://api.notion.com/v1/pages",
-        headers=notion_headers,
-        json=payload,
-        timeout=20
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(description="Atualiza preços e saldos de investimentos no Notion.")
+    arg_parser.add_argument("--daemon", action="store_true", help="Executa em modo residente com agendamento por pregão.")
+    arg_parser.add_argument("--coordinator", action="store_true", help="Enfileira o trabalho na fila local e acompanha os workers.")
+    arg_parser.add_argument("--worker", action="store_true", help="Processa jobs da fila local (vários workers podem rodar em paralelo).")
+    arg_parser.add_argument("--stream", action="store_true", help="Acompanha cotações em tempo real (websocket do Finnhub) e grava variações relevantes.")
+    arg_parser.add_argument("--serve", action="store_true", help="Serve apenas a API local de consulta (snapshot do último run), sem atualizar.")
+    arg_parser.add_argument(
+        "--plan", nargs="?", const="notion", choices=["notion", "snapshot"],
+        help="Estima chamadas, cota e duração do run sem executá-lo (lendo o Notion ou o snapshot local)."
     )
-    response.raise_for_status()
-
-def process_fixed_income_contributions():
-    """ 
-    Processa novos aportes de renda fixa que ainda não foram vinculadas a contratos.
-
-    Esta função busca todos os aportes de renda fixa não vinculados a um contrato do banco de dados do Notion,
-    cria um contrato correspondente para cada um e registra o resultado de cada operação.
-    """
-    log_and_print("Processando aportes de renda fixa...")
-
-    contributions = get_unlinked_fixed_income_contributions()
-
-    if not contributions:
-        log_and_print("Nenhum aporte novo para processar.")
-        return
-
-    for contribution in contributions:
-        try:
-            create_contract_from_contribution(contribution)
-
-            log_and_print(
-                f"Contrato criado e vinculado com sucesso para aporte {contribution['id']}"
-            )
-
-        except Exception as e:
-            log_and_print(
-                f"Erro ao processar aporte {contribution['id']}: {e}",
-                level="error"
-            )
-
-def get_unprocessed_withdrawals() -> list:
-    """
-    Retorna saques não processados (Processed checkbox == False)
-    """
-    filter_payload = {
-        "property": FIW_PROCESSED,
-        "checkbox": {"equals": False}
-    }
-    pages = get_all_pages_from_notion(FI_WITHDRAWALS_DATABASE_ID, filter_payload=filter_payload)
-    return pages or []
-
-def get_contracts_lifo_for_asset(asset_id: str) -> list:
-    """
-    Busca contratos do asset ordenados por Contribution Date desc e ID desc (LIFO).
-    """
-    filter_payload = {
-        "property": "Asset",
-        "relation": {"contains": asset_id}
-    }
-    sorts = [
-        {"property": FI_CONTRIBUTION_DATE, "direction": "descending"},
-        {"property": FI_CONTRACT_UNIQUE_ID, "direction": "descending"}
-    ]
-    pages = get_all_pages_from_notion(
-        FI_CONTRACTS_DATABASE_ID,
-        filter_payload=filter_payload,
-        sorts=sorts
+    arg_parser.add_argument(
+        "--auto-scale", action="store_true",
+        help="Com --time-budget: planeja o run e deixa de fora os tickers de menor prioridade que não cabem no prazo."
+    )
+    arg_parser.add_argument("--projection", action="store_true", help="Projeta os saldos de renda fixa até o vencimento (Monte Carlo, requer numpy).")
+    arg_parser.add_argument("--history", action="store_true", help="Atualiza apenas o histórico diário de saldos da renda fixa.")
+    arg_parser.add_argument("--export", action="store_true", help="Grava os databases de renda fixa e as séries do BCB no snapshot offline.")
+    arg_parser.add_argument("--compute", action="store_true", help="Calcula aportes, saques e contratos a partir do snapshot offline, sem rede, e grava o bundle de escritas.")
+    arg_parser.add_argument("--apply", action="store_true", help="Envia ao Notion as escritas do bundle, pulando as já aplicadas.")
+    arg_parser.add_argument(
+        "--time-budget", type=float, metavar="SEGUNDOS",
+        help="Prazo do run: processa primeiro os preços e contratos mais defasados e para antes do prazo."
+    )
+    return arg_parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    load_dotenv() # Carrega variáveis de ambiente do arquivo .env
+    logging.basicConfig(
+        filename='update_prices.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
     )
-    return pages or []
-
-def compute_withdrawal_allocations_for_asset(asset_id: str, amount: float) -> list:
-    """
-    Calcula (em memória) a lista de alocações (contract_id, deduction)
-    e verifica se há saldo suficiente. Não grava nada.
-    Retorna lista de dicts: [{"contract_id": id, "deduction": X}, ...]
-    """
-    contracts = get_contracts_lifo_for_asset(asset_id)
-    remaining = float(amount)
-    allocations = []
-
-    for contract in contracts:
-        if remaining <= 0:
-            break
-        balance = contract["properties"].get(FI_BALANCE, {}).get("number") or 0.0
-        if balance <= 0:
-            continue
-        deduct = min(balance, remaining)
-        allocations.append({"contract_id": contract["id"], "deduction": round(deduct, 2)})
-        remaining -= deduct
-
-    return allocations
-
-def create_allocation_record(withdrawal_id: str, contract_id: str, amount: float, operation_date: Optional[date] = None):
-    """
-    Cria um registro na tabela Withdrawal Allocations ligado ao saque e contrato.
-    operation_date: data em que o saque ocorreu (para timeline de juros). Se None, usa hoje.
-    Retorna allocation_id.
-    """
-    op_date = operation_date or date.today()
-    payload = {
-        "parent": {"database_id": FI_ALLOCATIONS_DATABASE_ID},
-        "properties": {
-            "Name": {
-                "title": [{"text": {"content": f"Allocation {withdrawal_id} -> {contract_id}"}}]
-            },
-            FIA_WITHDRAWAL_REL: {"relation": [{"id": withdrawal_id}]},
-            FIA_CONTRACT_REL: {"relation": [{"id": contract_id}]},
-            FIA_AMOUNT: {"number": round(amount, 2)},
-            FIA_OPERATION_DATE: {"date": {"start": op_date.isoformat()}}
-        }
-    }
-
-    response = requests.post("https://api.notion.com/v1/pages", headers=notion_headers, json=payload, timeout=20)
-    response.raise_for_status()
-    data = response.json()
-    allocation_id = data["id"]
-    return allocation_id
-
-def link_withdrawal_to_allocations(withdrawal_id: str, allocation_ids: list, processed_amount: float):
-    """
-    Atualiza a página do saque para relacionar as alocações (campo Allocations), salvar data, valor processado e marca como processado.
-    """
-    url = f"https://api.notion.com/v1/pages/{withdrawal_id}"
-    payload = {
-        "properties": {
-            FIW_ALLOCATIONS_REL: {"relation": [{"id": aid} for aid in allocation_ids]},
-            FIW_PROCESSED: {"checkbox": True},
-            FIW_PROCESSED_AMOUNT: {"number": round(processed_amount, 2)},
-            FIW_PROCESSING_DATE: {"date": {"start": datetime.now().isoformat()}}
-        }
-    }
-    response = requests.patch(url, headers=notion_headers, json=payload, timeout=20)
-    response.raise_for_status()
-
-
-def process_withdrawals_lifo():
-    """
-    Processa saques (LIFO)
-    Esta função busca todos os saques não processados (Processed checkbox == False)
-    e processa cada saque em ordem de data de saque (Contribution Date desc e ID desc).
-    Para cada saque, calcula as alocações (contract_id, deduction) e verifica se há saldo suficiente.
-    Se houver saldo suficiente, cria um registro na tabela Withdrawal Allocations ligado ao saque e contrato.
-    Em seguida, atualiza a página do saque para relacionar as alocações (campo Allocations), salvar data, valor processado e marca como processado.
-    """
-    log_and_print("Processando saques (LIFO)...")
-    withdrawals = get_unprocessed_withdrawals()
-    if not withdrawals:
-        log_and_print("Nenhum saque não-processado.")
-        return
-
-    for wd in withdrawals:
-        try:
-            props = wd["properties"]
-            withdrawal_id = wd["id"]
-
-            if not props.get(FIW_ASSET, {}).get("relation"):
-                log_and_print(f"Saque {withdrawal_id} sem asset definido. Pulando.", level="warning")
-                continue
-
-            asset_id = props[FIW_ASSET]["relation"][0]["id"]
-            amount = props.get(FIW_AMOUNT, {}).get("number") or 0.0
-
-            # Data em que o saque ocorreu (para timeline de juros); se não houver, usa hoje
-            withdrawal_date = date.today()
-            if props.get(FIW_DATE, {}).get("date") and props[FIW_DATE]["date"].get("start"):
-                withdrawal_date = parser.parse(props[FIW_DATE]["date"]["start"]).date()
-
-            # calcula alocações em memória e valida saldo
-            allocations = compute_withdrawal_allocations_for_asset(asset_id, amount)
-            
-            # calcula o valor processado total (antes do loop para garantir que está sempre definido)
-            processed_amount = round(sum(allocation["deduction"] for allocation in allocations), 2)
-            
-            if processed_amount <= 0:
-                log_and_print(f"Saque {withdrawal_id} sem saldo. Pulando.", level="warning")
-                continue
-            elif processed_amount < amount:
-                log_and_print(f"Saque {withdrawal_id} com saldo insuficiente. Criando alocações parciais.", level="warning")
-
-            # Persiste: apenas cria alocações
-            allocation_ids = []
-            for alloc in allocations:
-                contract_id = alloc["contract_id"]
-                deduct = alloc["deduction"]
-
-                # cria allocation record (com data do saque para timeline)
-                alloc_id = create_allocation_record(withdrawal_id, contract_id, deduct, operation_date=withdrawal_date)
-                allocation_ids.append(alloc_id)
-            
-            # linka o saque às alocações e marca processed
-            link_withdrawal_to_allocations(withdrawal_id, allocation_ids, processed_amount)
-
-            log_and_print(f"Saque {withdrawal_id} processado com sucesso. Alocações: {allocation_ids}")
-
-        except Exception as e:
-            log_and_print(f"Erro ao processar saque {wd['id']}: {e}", level="error")
-
-def main():
-    log_and_print(f"Iniciando atualização de investimentos (Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')})...")
-    
-    if VI_ASSETS_DATABASE_ID is not None:
-        update_variable_income_assets(VI_ASSETS_DATABASE_ID)
-    else:
-        log_and_print("VI_ASSETS_DATABASE_ID não definido. Pulando renda variável (BR).", level="warning")
 
-    if VI_FOREIGN_ASSETS_DATABASE_ID is not None:
-        update_variable_income_assets(VI_FOREIGN_ASSETS_DATABASE_ID)
+    config = EngineConfig.from_env()
+    try:
+        config.validate()
+    except ConfigError as e:
+        message = f"Erro: {e} Verifique seu arquivo .env."
+        print(message)
+        logging.critical(message)
+        exit(1)
+
+    engine = Engine(config)
+    if config.query_api_port and (args.daemon or args.stream):
+        engine.start_query_api()
+    if args.serve:
+        engine.serve_query_api()
+    elif args.daemon:
+        engine.run_daemon()
+    elif args.coordinator:
+        engine.run_coordinator()
+    elif args.worker:
+        engine.run_worker()
+    elif args.history:
+        engine.update_history()
+    elif args.export:
+        engine.export_snapshot()
+    elif args.compute:
+        engine.compute_bundle()
+    elif args.apply:
+        engine.apply_bundle()
+    elif args.stream:
+        engine.run_stream()
+    elif args.projection:
+        engine.project()
+    elif args.plan:
+        engine.plan(args.plan, args.time_budget)
     else:
-        log_and_print("VI_FOREIGN_ASSETS_DATABASE_ID não definido. Pulando renda variável (exterior).", level="warning")
-
-    process_fixed_income_contributions()
-    process_withdrawals_lifo()
-    update_fixed_income_contracts()
-    
-    log_and_print("Atualização concluída.")
+        engine.run(time_budget=args.time_budget, auto_scale=args.auto_scale)
 
 if __name__ == "__main__":
     main()